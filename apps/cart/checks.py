@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+from .storage import CacheCartStorage, cart_cache_alias
+
+
+@checks.register(checks.Tags.caches)
+def check_cart_cache(app_configs, **kwargs):
+    """Cached carts must not live in a per-process cache: each worker would see its own copy."""
+    storage = import_string(getattr(settings, 'CART_STORAGE', 'apps.cart.storage.SessionCartStorage'))
+    if not issubclass(storage, CacheCartStorage):
+        return []
+    if isinstance(caches[cart_cache_alias()], LocMemCache):
+        return [checks.Error(
+            f'CART_CACHE_ALIAS {cart_cache_alias()!r} is a per-process LocMemCache.',
+            hint='Point it at a cache shared by every worker (the database, Redis or Memcached), '
+                 'or use another CART_STORAGE.',
+            id='cart.E001',
+        )]
+    return []
@@ -1,6 +1,10 @@
 from .service import Cart
 
 def cart_context(request):
+    if getattr(request, 'public_page', False):
+        # Publicly cached page: no session access; the badge and drawer
+        # are loaded afterwards from cart:summary
+        return {'public_page': True}
     cart = Cart(request)
     return {
         'cart': cart,
@@ -0,0 +1,13 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.cart.models import CartLine
+from apps.cart.storage import cart_ttl
+
+class Command(BaseCommand):
+    help = 'Delete DatabaseCartStorage lines of carts idle for longer than CART_TTL'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=cart_ttl())
+        deleted, _ = CartLine.objects.filter(updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired cart lines.'))
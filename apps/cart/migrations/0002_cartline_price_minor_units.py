@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_cartline'),
+    ]
+
+    operations = [
+        # Decimal amounts to cents before the column becomes an integer
+        migrations.RunSQL(
+            'UPDATE cart_cartline SET price = price * 100',
+            reverse_sql='UPDATE cart_cartline SET price = price / 100',
+        ),
+        migrations.AlterField(
+            model_name='cartline',
+            name='price',
+            field=models.PositiveIntegerField(),
+        ),
+    ]
@@ -1,3 +1,21 @@
 from django.db import models
+from apps.catalog.models import Product
 
-# Models are deleted as we switched to Session-based cart.
+# The default cart lives in the session (apps.cart.storage.SessionCartStorage);
+# CartLine backs the opt-in DatabaseCartStorage.
+class CartLine(models.Model):
+    cart_id = models.CharField(max_length=32, db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    size = models.CharField(max_length=50)
+    # Minor units (cents), like the session and cache carts
+    price = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart_id', 'product', 'size'], name='cartline_unique_line'),
+        ]
+
+    def __str__(self):
+        return f'{self.cart_id}: {self.quantity} x {self.product_id} ({self.size})'
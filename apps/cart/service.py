@@ -1,70 +1,63 @@
-from decimal import Decimal
-from django.conf import settings
-from apps.catalog.models import Product
+from .snapshots import product_snapshots
+from .storage import empty_state, from_minor, get_cart_storage
 
 class Cart:
     def __init__(self, request):
         """
-        Initialize the cart.
+        Initialize the cart from the configured storage (settings.CART_STORAGE,
+        the session by default). Reading never writes: an empty cart lives
+        only in memory until the first change, so anonymous browsing creates
+        no session row and no cookie.
         """
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_cart_storage(request)
+        # Lines plus running item count and subtotal, see apps.cart.storage
+        self.state = self.storage.load()
+        self._products = {}
+
+    @property
+    def cart(self):
+        return self.state['lines']
 
     def add(self, product, size, quantity=1, override_quantity=False):
         """
         Add a product to the cart or update its quantity.
         """
-        # Composite key for product and size
-        product_id = str(product.id)
-        cart_key = f"{product_id}-{size}"
-        
-        if cart_key not in self.cart:
-            self.cart[cart_key] = {
-                'quantity': 0,
-                'price': str(product.price),
-                'size': size,
-                'product_id': product_id
-            }
-        
-        if override_quantity:
-            self.cart[cart_key]['quantity'] = quantity
-        else:
-            self.cart[cart_key]['quantity'] += quantity
-        self.save()
-
-    def save(self):
-        # mark the session as "modified" to make sure it gets saved
-        self.session.modified = True
+        self.state = self.storage.add(product.id, size, product.price, quantity, override_quantity)
 
     def remove(self, product_id, size):
         """
         Remove a product from the cart.
         """
-        cart_key = f"{product_id}-{size}"
-        if cart_key in self.cart:
-            del self.cart[cart_key]
-            self.save()
+        self.state = self.storage.remove(product_id, size)
 
-    def __iter__(self):
+    def reprice(self, prices):
         """
-        Iterate over the items in the cart and get the products from the database.
+        Move the lines of the products in ``prices`` ({product_id: price})
+        to that price, e.g. after checkout found it changed.
         """
-        product_ids = [item['product_id'] for item in self.cart.values()]
-        products = Product.objects.filter(id__in=product_ids)
-        
-        cart = self.cart.copy()
-        
-        # We need to map product objects to their IDs for easy lookup
-        product_map = {str(p.id): p for p in products}
+        for product_id, price in prices.items():
+            self.state = self.storage.set_price(product_id, price)
 
-        for key, item in cart.items():
-            item = item.copy() # Avoid mutating the session data explicitly
-            item['product'] = product_map.get(item['product_id'])
-            item['price'] = Decimal(item['price'])
+    def products(self):
+        """
+        Product snapshots (see apps.cart.snapshots) of the cart's lines, loaded
+        once per Cart: iterating again only fetches products added since.
+        """
+        missing = {item['product_id'] for item in self.cart.values()} - self._products.keys()
+        if missing:
+            snapshots = product_snapshots(missing)
+            self._products.update({product_id: snapshots.get(int(product_id)) for product_id in missing})
+        return self._products
+
+    def __iter__(self):
+        """
+        Iterate over the items in the cart with their product snapshots.
+        """
+        products = self.products()
+        for key, item in list(self.cart.items()):
+            item = item.copy() # Avoid mutating the stored cart
+            item['product'] = products.get(item['product_id'])
+            item['price'] = from_minor(item['price'])
             item['total_price'] = item['price'] * item['quantity']
             item['item_id'] = key # Helper for templates/URLs to identify this specific line item
             yield item
@@ -73,12 +66,12 @@ class Cart:
         """
         Count all items in the cart.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.state['count']
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return from_minor(self.state['subtotal'])
 
     def clear(self):
-        # remove cart from session
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        # remove cart from storage
+        self.storage.clear()
+        self.state = empty_state()
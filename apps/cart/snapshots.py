@@ -0,0 +1,44 @@
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.cache import cache
+from django.db.models import OuterRef
+from apps.catalog.cards import refresh_product_cards
+from apps.catalog.models import ProductCard, ProductSize
+from apps.catalog.versioning import catalog_version
+
+# Snapshots are also dropped as soon as the catalog version moves
+SNAPSHOT_TIMEOUT = 60 * 60
+
+
+def _snapshot_key(version, product_id):
+    return f'cart:product:{version}:{product_id}'
+
+
+def _load_snapshots(product_ids):
+    sizes = ArraySubquery(ProductSize.objects.filter(product=OuterRef('pk')).order_by('id').values('size'))
+    return {card.pk: card for card in ProductCard.objects.filter(pk__in=product_ids).annotate(available_sizes=sizes)}
+
+
+def product_snapshots(product_ids):
+    """
+    What the cart shows of each product: its ProductCard (name, thumbnail,
+    brand, color, current price) plus ``available_sizes``. Served from the
+    cache in one get_many; misses are read in a single query and cached
+    under the current catalog version, so any catalog change invalidates them.
+    """
+    product_ids = {int(product_id) for product_id in product_ids}
+    if not product_ids:
+        return {}
+    version = catalog_version()
+    keys = {_snapshot_key(version, product_id): product_id for product_id in product_ids}
+    snapshots = {keys[key]: snapshot for key, snapshot in cache.get_many(keys).items()}
+
+    missing = product_ids - snapshots.keys()
+    if missing:
+        loaded = _load_snapshots(missing)
+        if len(loaded) < len(missing):
+            # Products inserted without signals have no card yet
+            refresh_product_cards(missing - loaded.keys())
+            loaded.update(_load_snapshots(missing - loaded.keys()))
+        cache.set_many({_snapshot_key(version, product_id): snapshot for product_id, snapshot in loaded.items()}, SNAPSHOT_TIMEOUT)
+        snapshots.update(loaded)
+    return snapshots
@@ -0,0 +1,345 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CartLine
+
+# Carts untouched for this long are dropped (DB and cache backends)
+DEFAULT_CART_TTL = 60 * 60 * 24 * 30
+
+# Session key holding the visitor's cart id for the DB and cache backends
+CART_ID_SESSION_KEY = 'cart_id'
+
+# Bumped whenever the stored cart layout changes; stored carts of another
+# version have their totals recomputed on load. Version 1 was a plain dict
+# of lines with decimal string prices.
+CART_SCHEMA_VERSION = 2
+
+# Prices are kept in integer minor units (cents)
+MINOR_UNIT_EXPONENT = 2
+
+
+def cart_ttl():
+    return getattr(settings, 'CART_TTL', DEFAULT_CART_TTL)
+
+
+def cart_cache_alias():
+    # Must be shared by every worker, see settings.CACHES
+    return getattr(settings, 'CART_CACHE_ALIAS', 'shared')
+
+
+def get_cart_storage(request):
+    """Instantiate settings.CART_STORAGE (a dotted path) for this request."""
+    path = getattr(settings, 'CART_STORAGE', 'apps.cart.storage.SessionCartStorage')
+    return import_string(path)(request)
+
+
+def line_key(product_id, size):
+    # Composite key for product and size
+    return f'{product_id}-{size}'
+
+
+def to_minor(amount):
+    return int(Decimal(amount).scaleb(MINOR_UNIT_EXPONENT).to_integral_value(ROUND_HALF_UP))
+
+
+def from_minor(minor):
+    return Decimal(minor).scaleb(-MINOR_UNIT_EXPONENT)
+
+
+def empty_state():
+    return {'version': CART_SCHEMA_VERSION, 'count': 0, 'subtotal': 0, 'lines': {}}
+
+
+def make_line(product_id, size, price, quantity):
+    return {'quantity': quantity, 'price': price, 'size': size, 'product_id': str(product_id)}
+
+
+def set_line(state, key, line):
+    """Replace one line of ``state`` (remove it if ``line`` is None), adjusting the running totals."""
+    old = state['lines'].pop(key, None)
+    if old is not None:
+        state['count'] -= old['quantity']
+        state['subtotal'] -= old['price'] * old['quantity']
+    if line is not None:
+        state['lines'][key] = line
+        state['count'] += line['quantity']
+        state['subtotal'] += line['price'] * line['quantity']
+    return state
+
+
+def checked_state(data):
+    """
+    A stored cart as a current state. Stored totals are trusted as long as
+    the schema version matches; anything else (including version 1 session
+    carts) is rebuilt line by line.
+    """
+    if not data:
+        return empty_state()
+    if data.get('version') == CART_SCHEMA_VERSION:
+        return data
+    state = empty_state()
+    for key, line in data.get('lines', data).items():
+        price = line['price']
+        if not isinstance(price, int):
+            price = to_minor(price)
+        set_line(state, key, make_line(line['product_id'], line['size'], price, int(line['quantity'])))
+    return state
+
+
+def encode_state(state):
+    """Compact form of a cart: [version, count, subtotal, [[product_id, size, price, quantity], ...]]."""
+    return json.dumps(
+        [state['version'], state['count'], state['subtotal'], [
+            [int(line['product_id']), line['size'], line['price'], line['quantity']]
+            for line in state['lines'].values()
+        ]],
+        separators=(',', ':'),
+    )
+
+
+def decode_state(data):
+    if not data:
+        return empty_state()
+    version, count, subtotal, rows = json.loads(data)
+    lines = {
+        line_key(product_id, size): make_line(product_id, size, price, quantity)
+        for product_id, size, price, quantity in rows
+    }
+    return checked_state({'version': version, 'count': count, 'subtotal': subtotal, 'lines': lines})
+
+
+class CartStorage:
+    """
+    Where a Cart keeps its state: a dict with the schema 'version', the
+    running 'count' and 'subtotal' (minor units) and the 'lines', keyed by
+    line_key(). Each line is a dict with 'product_id' (str), 'size',
+    'price' (minor units) and 'quantity'.
+
+    add() and remove() change one line, set_price() the lines of one
+    product, and return the new state; backends other than the session
+    apply them atomically, so concurrent requests for the same cart never
+    lose an update.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+
+    def load(self):
+        raise NotImplementedError
+
+    def add(self, product_id, size, price, quantity, override_quantity=False):
+        raise NotImplementedError
+
+    def remove(self, product_id, size):
+        raise NotImplementedError
+
+    def set_price(self, product_id, price):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def cart_id(self, create=False):
+        """
+        The visitor's cart id, kept in the session. It is only created on
+        the first write, so browsing without a cart never writes the session.
+        """
+        cart_id = self.session.get(CART_ID_SESSION_KEY)
+        if cart_id is None and create:
+            cart_id = self.session[CART_ID_SESSION_KEY] = uuid.uuid4().hex
+        return cart_id
+
+
+def _added_line(state, product_id, size, price, quantity, override_quantity):
+    # A line keeps the price of its first add
+    line = state['lines'].get(line_key(product_id, size))
+    if line is None:
+        return make_line(product_id, size, to_minor(price), quantity)
+    return make_line(product_id, size, line['price'], quantity if override_quantity else line['quantity'] + quantity)
+
+
+def _repriced(state, product_id, price):
+    # Every size of the product, keeping its quantity
+    for key, line in list(state['lines'].items()):
+        if line['product_id'] == str(product_id):
+            set_line(state, key, make_line(product_id, line['size'], to_minor(price), line['quantity']))
+    return state
+
+
+class SessionCartStorage(CartStorage):
+    """
+    The default: the cart state is a dict inside the session. Every change
+    rewrites the session, and concurrent requests can overwrite each
+    other's changes; use the DB or cache backend where that matters.
+    """
+
+    def load(self):
+        return checked_state(self.session.get(settings.CART_SESSION_ID))
+
+    def _save(self, state):
+        # attach the cart on its first write, and mark the session as
+        # "modified" to make sure it gets saved
+        self.session[settings.CART_SESSION_ID] = state
+        self.session.modified = True
+        return state
+
+    def add(self, product_id, size, price, quantity, override_quantity=False):
+        state = self.load()
+        line = _added_line(state, product_id, size, price, quantity, override_quantity)
+        return self._save(set_line(state, line_key(product_id, size), line))
+
+    def remove(self, product_id, size):
+        state = self.load()
+        if line_key(product_id, size) in state['lines']:
+            self._save(set_line(state, line_key(product_id, size), None))
+        return state
+
+    def set_price(self, product_id, price):
+        return self._save(_repriced(self.load(), product_id, price))
+
+    def clear(self):
+        if settings.CART_SESSION_ID in self.session:
+            del self.session[settings.CART_SESSION_ID]
+
+
+class DatabaseCartStorage(CartStorage):
+    """
+    One CartLine row per line. Increments are a single conditional
+    UPDATE ... SET quantity = quantity + n, so they are atomic per line.
+    The rows are the source of truth: totals are summed while loading them
+    and kept up to date in memory for the rest of the request.
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._state = None
+
+    def _lines(self, cart_id):
+        return CartLine.objects.filter(cart_id=cart_id)
+
+    def load(self):
+        if self._state is None:
+            self._state = empty_state()
+            cart_id = self.cart_id()
+            if cart_id is not None:
+                cutoff = timezone.now() - timedelta(seconds=cart_ttl())
+                rows = self._lines(cart_id).filter(updated_at__gte=cutoff).order_by('id').values_list(
+                    'product_id', 'size', 'price', 'quantity'
+                )
+                for product_id, size, price, quantity in rows:
+                    set_line(self._state, line_key(product_id, size), make_line(product_id, size, price, quantity))
+        return self._state
+
+    def add(self, product_id, size, price, quantity, override_quantity=False):
+        state = self.load()
+        cart_id = self.cart_id(create=True)
+        lines = self._lines(cart_id)
+        line = lines.filter(product_id=product_id, size=size)
+        now = timezone.now()
+        change = {'quantity': quantity} if override_quantity else {'quantity': F('quantity') + quantity}
+        with transaction.atomic():
+            # An expired cart starts over rather than reviving its old lines
+            lines.filter(updated_at__lt=now - timedelta(seconds=cart_ttl())).delete()
+            if not line.update(updated_at=now, **change):
+                try:
+                    with transaction.atomic():
+                        CartLine.objects.create(
+                            cart_id=cart_id, product_id=product_id, size=size, price=to_minor(price), quantity=quantity
+                        )
+                except IntegrityError:
+                    # Another request created the line first: apply ours on top
+                    line.update(updated_at=now, **change)
+            # The whole cart lives as long as its latest change
+            lines.update(updated_at=now)
+        stored_price, stored_quantity = line.values_list('price', 'quantity').get()
+        return set_line(state, line_key(product_id, size), make_line(product_id, size, stored_price, stored_quantity))
+
+    def remove(self, product_id, size):
+        state = self.load()
+        cart_id = self.cart_id()
+        if cart_id is not None:
+            self._lines(cart_id).filter(product_id=product_id, size=size).delete()
+        return set_line(state, line_key(product_id, size), None)
+
+    def set_price(self, product_id, price):
+        state = self.load()
+        cart_id = self.cart_id()
+        if cart_id is not None:
+            # One UPDATE: lines removed meanwhile stay removed
+            self._lines(cart_id).filter(product_id=product_id).update(price=to_minor(price), updated_at=timezone.now())
+        return _repriced(state, product_id, price)
+
+    def clear(self):
+        cart_id = self.cart_id()
+        if cart_id is not None:
+            self._lines(cart_id).delete()
+        self._state = None
+
+
+class CacheCartStorage(CartStorage):
+    """
+    The whole cart state as one compactly encoded cache entry that expires
+    after CART_TTL of inactivity. Changes run under a short per-cart lock
+    taken with cache.add(), which is atomic on every cache backend.
+    """
+
+    LOCK_TIMEOUT = 5
+    LOCK_WAIT = 2
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.cache = caches[cart_cache_alias()]
+
+    def _key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def load(self):
+        cart_id = self.cart_id()
+        return decode_state(self.cache.get(self._key(cart_id))) if cart_id else empty_state()
+
+    def _change(self, cart_id, mutate):
+        key, lock = self._key(cart_id), self._key(cart_id) + ':lock'
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while not self.cache.add(lock, 1, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Cart {cart_id} is locked')
+            time.sleep(0.01)
+        try:
+            state = mutate(decode_state(self.cache.get(key)))
+            self.cache.set(key, encode_state(state), cart_ttl())
+            return state
+        finally:
+            self.cache.delete(lock)
+
+    def add(self, product_id, size, price, quantity, override_quantity=False):
+        def mutate(state):
+            line = _added_line(state, product_id, size, price, quantity, override_quantity)
+            return set_line(state, line_key(product_id, size), line)
+        return self._change(self.cart_id(create=True), mutate)
+
+    def remove(self, product_id, size):
+        cart_id = self.cart_id()
+        if cart_id is None:
+            return empty_state()
+        return self._change(cart_id, lambda state: set_line(state, line_key(product_id, size), None))
+
+    def set_price(self, product_id, price):
+        cart_id = self.cart_id()
+        if cart_id is None:
+            return empty_state()
+        return self._change(cart_id, lambda state: _repriced(state, product_id, price))
+
+    def clear(self):
+        cart_id = self.cart_id()
+        if cart_id is not None:
+            self.cache.delete(self._key(cart_id))
@@ -0,0 +1,203 @@
+import threading
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from apps.catalog.models import Brand, Product, ProductBrand, ProductSize
+from .checks import check_cart_cache
+from .service import Cart
+from .storage import CART_ID_SESSION_KEY, CART_SCHEMA_VERSION, decode_state, encode_state
+
+class LazyCartTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.product = Product.objects.create(
+            name='Test Product',
+            price=Decimal('100.00'),
+            description='Test Description'
+        )
+
+    def test_anonymous_browsing_writes_no_session(self):
+        requests = [
+            (reverse('catalog:home'), {}),
+            (reverse('catalog:product_list'), {}),
+            (reverse('catalog:product_list'), {'HTTP_HX_REQUEST': 'true', 'HTTP_HX_TARGET': 'product-grid'}),
+            (reverse('catalog:product_detail', args=[self.product.id]), {}),
+            (reverse('cart:cart_detail'), {'HTTP_HX_REQUEST': 'true'}),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            for url, headers in requests:
+                response = self.client.get(url, **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        session_queries = [q['sql'] for q in queries if 'django_session' in q['sql']]
+        self.assertEqual(session_queries, [])
+
+    def test_first_add_creates_the_session(self):
+        response = self.client.post(reverse('cart:add'), {'product_id': self.product.id, 'size': 'M'})
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        cart = self.client.session[settings.CART_SESSION_ID]['lines']
+        self.assertEqual(cart[f'{self.product.id}-M']['quantity'], 1)
+
+
+def cart_request(session=None):
+    request = RequestFactory().get('/')
+    request.session = session or SessionStore()
+    return request
+
+
+class CartStorageTestMixin:
+    """Behaviour every storage backend shares."""
+
+    def setUp(self):
+        cache.clear()
+        self.tee = Product.objects.create(name='Tee', price=Decimal('20.00'), description='')
+        self.cap = Product.objects.create(name='Cap', price=Decimal('35.50'), description='')
+        self.session = SessionStore()
+
+    def cart(self):
+        # A fresh Cart per "request" reads back what the previous one stored
+        return Cart(cart_request(self.session))
+
+    def test_line_operations(self):
+        self.cart().add(self.tee, 'M')
+        self.cart().add(self.tee, 'M', quantity=2)
+        self.cart().add(self.cap, 'One Size')
+        cart = self.cart()
+        self.assertEqual(len(cart), 4)
+        self.assertEqual(cart.get_total_price(), Decimal('95.50'))
+
+        cart.add(self.tee, 'M', quantity=1, override_quantity=True)
+        cart.remove(self.cap.id, 'One Size')
+        cart = self.cart()
+        self.assertEqual(list(cart.cart), [f'{self.tee.id}-M'])
+        self.assertEqual(len(cart), 1)
+
+        cart.clear()
+        self.assertEqual(len(self.cart()), 0)
+
+    def test_totals_follow_changes_in_minor_units(self):
+        cart = self.cart()
+        cart.add(self.cap, 'One Size', quantity=3)
+        cart.add(self.tee, 'M')
+        self.assertEqual(cart.state['subtotal'], 3 * 3550 + 2000)
+        cart.add(self.cap, 'One Size', quantity=1, override_quantity=True)
+        cart.remove(self.tee.id, 'M')
+        self.assertEqual((len(cart), cart.get_total_price()), (1, Decimal('35.50')))
+        self.assertEqual([item['total_price'] for item in cart], [Decimal('35.50')])
+
+    def test_reprice_changes_lines_in_place(self):
+        self.cart().add(self.tee, 'M', quantity=2)
+        self.cart().add(self.tee, 'L')
+        self.cart().add(self.cap, 'One Size')
+        stale = self.cart()
+        # Another request removes a line after this one loaded the cart
+        self.cart().remove(self.tee.id, 'L')
+        stale.reprice({self.tee.id: Decimal('25.00')})
+
+        cart = self.cart()
+        self.assertEqual(sorted(cart.cart), sorted([f'{self.tee.id}-M', f'{self.cap.id}-One Size']))
+        self.assertEqual(cart.cart[f'{self.tee.id}-M']['quantity'], 2)
+        self.assertEqual(cart.get_total_price(), Decimal('85.50'))
+
+
+class SessionCartStorageTest(CartStorageTestMixin, TestCase):
+    def test_totals_recomputed_only_on_schema_change(self):
+        # A version 1 cart (plain dict of lines, decimal string prices) is rebuilt
+        self.session[settings.CART_SESSION_ID] = {
+            f'{self.tee.id}-M': {'quantity': 2, 'price': '20.00', 'size': 'M', 'product_id': str(self.tee.id)},
+        }
+        self.assertEqual((len(self.cart()), self.cart().get_total_price()), (2, Decimal('40.00')))
+
+        # Current-version totals are read as stored, not summed again
+        self.session[settings.CART_SESSION_ID] = {
+            'version': CART_SCHEMA_VERSION, 'count': 99, 'subtotal': 1, 'lines': {},
+        }
+        self.assertEqual(len(self.cart()), 99)
+
+
+@override_settings(CART_STORAGE='apps.cart.storage.DatabaseCartStorage')
+class DatabaseCartStorageTest(CartStorageTestMixin, TestCase):
+    def test_expired_cart_starts_over(self):
+        self.cart().add(self.tee, 'M', quantity=3)
+        with self.settings(CART_TTL=-1):
+            self.assertEqual(len(self.cart()), 0)
+            self.cart().add(self.tee, 'M')
+        self.assertEqual(len(self.cart()), 1)
+
+
+@override_settings(CART_STORAGE='apps.cart.storage.CacheCartStorage')
+class CacheCartStorageTest(CartStorageTestMixin, TestCase):
+    def test_compact_encoding_round_trips(self):
+        self.cart().add(self.tee, 'M', quantity=2)
+        state = self.cart().state
+        encoded = encode_state(state)
+        self.assertEqual(encoded, f'[{CART_SCHEMA_VERSION},2,4000,[[{self.tee.id},"M",2000,2]]]')
+        self.assertEqual(decode_state(encoded), state)
+
+    def test_cache_must_be_shared(self):
+        self.assertEqual(check_cart_cache(None), [])
+        with self.settings(CART_CACHE_ALIAS='default'):
+            self.assertEqual([error.id for error in check_cart_cache(None)], ['cart.E001'])
+
+
+class CartHydrationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = SessionStore()
+        self.tee = Product.objects.create(name='Tee', price=Decimal('20.00'), description='', color='Ecru')
+        ProductBrand.objects.create(product=self.tee, brand=Brand.objects.create(name='Sunspel'))
+        for size in ('S', 'M'):
+            ProductSize.objects.create(product=self.tee, size=size)
+        self.cap = Product.objects.create(name='Cap', price=Decimal('35.50'), description='')
+        cart = Cart(cart_request(self.session))
+        cart.add(self.tee, 'M')
+        cart.add(self.cap, 'One Size')
+
+    def test_lines_hydrate_in_one_query_then_from_cache(self):
+        cart = Cart(cart_request(self.session))
+        with self.assertNumQueries(1):
+            items = list(cart)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(list(cart)), 2)
+        tee = items[0]['product']
+        self.assertEqual((tee.name, tee.brand_name, tee.available_sizes), ('Tee', 'Sunspel', ['S', 'M']))
+
+        # Another request is served from the snapshot cache
+        with self.assertNumQueries(0):
+            list(Cart(cart_request(self.session)))
+
+    def test_catalog_change_refreshes_snapshots(self):
+        list(Cart(cart_request(self.session)))
+        self.tee.name = 'Riviera Tee'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tee.save()
+        items = list(Cart(cart_request(self.session)))
+        self.assertEqual(items[0]['product'].name, 'Riviera Tee')
+
+
+@override_settings(CART_STORAGE='apps.cart.storage.DatabaseCartStorage')
+class ConcurrentCartTest(TransactionTestCase):
+    def test_concurrent_increments_are_not_lost(self):
+        product = Product.objects.create(name='Tee', price=Decimal('20.00'), description='')
+        session = SessionStore()
+        session[CART_ID_SESSION_KEY] = 'shared'
+        barrier = threading.Barrier(8)
+
+        def add_one():
+            try:
+                barrier.wait()
+                Cart(cart_request(session)).add(product, 'M')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_one) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(Cart(cart_request(session))), 8)
@@ -5,6 +5,7 @@ app_name = 'cart'
 
 urlpatterns = [
     path('', views.cart_detail_view, name='cart_detail'),
+    path('summary/', views.cart_summary_view, name='summary'),
     path('add/', views.add_to_cart_view, name='add'),
     path('remove/<str:item_id>/', views.remove_from_cart_view, name='remove'),
     path('update/<str:item_id>/', views.update_cart_item_view, name='update'),
@@ -1,5 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_GET, require_POST
 from .service import Cart
 from apps.catalog.models import Product
 
@@ -13,6 +15,24 @@ def cart_detail_view(request):
          return render(request, 'partials/cart_drawer.html', context)
     return render(request, 'cart/cart_detail.html', context)
 
+@require_GET
+@never_cache
+@ensure_csrf_cookie
+def cart_summary_view(request):
+    """
+    Badge and drawer contents for publicly cached pages, which render
+    without the cart. Both are swapped in out of band. Also sets the CSRF
+    cookie the pages' HTMX forms send back as a header.
+    """
+    cart = Cart(request)
+    context = {
+        'cart': cart,
+        'total_price': cart.get_total_price(),
+        'cart_total_items': len(cart),
+        'update_badge': True
+    }
+    return render(request, 'cart/partials/cart_drawer_content.html', context)
+
 @require_POST
 def add_to_cart_view(request):
     cart = Cart(request)
@@ -26,7 +26,7 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 @admin.register(ProductSize)
 class ProductSizeAdmin(admin.ModelAdmin):
-    list_display = ('product', 'size')
+    list_display = ('product', 'size', 'stock')
     list_filter = ('size',)
     search_fields = ('product__name', 'size')
 
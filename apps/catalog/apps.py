@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.catalog'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,74 @@
+from django.db.models import Prefetch
+
+from .models import Product, ProductBrand, ProductCard, ProductImage
+
+CARD_FIELDS = [
+    'name', 'price', 'brand_name', 'color', 'base_color', 'image',
+    'category', 'category_name', 'in_stock', 'created_at',
+]
+
+# Products per upsert when refreshing the whole table
+REFRESH_BATCH_SIZE = 2000
+
+
+def build_card(product):
+    """Flatten a product (with brands, gallery and category prefetched) into a card."""
+    brands = product.product_brands.all()
+    gallery = product.gallery_images.all()
+    image = product.image.name if product.image else (gallery[0].image.name if gallery else '')
+    return ProductCard(
+        product_id=product.pk,
+        name=product.name,
+        price=product.price,
+        brand_name=brands[0].brand.name if brands else '',
+        color=product.color,
+        base_color=product.base_color,
+        image=image,
+        category_id=product.category_id,
+        category_name=product.category.name if product.category else '',
+        in_stock=product.in_stock,
+        created_at=product.created_at,
+    )
+
+
+def refresh_product_cards(product_ids):
+    """
+    Upsert the cards of ``product_ids`` in one INSERT ... ON CONFLICT.
+    Three reads (products + category, brands, gallery) regardless of count.
+    """
+    products = Product.objects.filter(pk__in=product_ids).select_related('category').prefetch_related(
+        Prefetch('product_brands', queryset=ProductBrand.objects.select_related('brand').order_by('id')),
+        Prefetch('gallery_images', queryset=ProductImage.objects.order_by('id')),
+    )
+    cards = [build_card(product) for product in products]
+    ProductCard.objects.bulk_create(
+        cards, update_conflicts=True, unique_fields=['product'], update_fields=CARD_FIELDS
+    )
+    return len(cards)
+
+
+def refresh_all_product_cards(batch_size=REFRESH_BATCH_SIZE):
+    refreshed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return refreshed
+        refreshed += refresh_product_cards(ids)
+        last_id = ids[-1]
+
+
+def cards_for(product_ids):
+    """
+    Cards for ``product_ids`` in the given order. Products that have no
+    card yet (e.g. inserted with bulk_create, which sends no signals)
+    get one built on the spot.
+    """
+    cards = ProductCard.objects.in_bulk(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in cards]
+    if missing:
+        refresh_product_cards(missing)
+        cards.update(ProductCard.objects.in_bulk(missing))
+    return [cards[product_id] for product_id in product_ids if product_id in cards]
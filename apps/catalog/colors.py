@@ -0,0 +1,141 @@
+"""
+Mapping of free-text product colors ("Triple Black", "Off-White/Sail")
+onto Product.BaseColor, for the map_colors command.
+
+The color dictionary is compiled into a single word-boundary regex, and
+each distinct color string is mapped once per process, so a catalog of
+a million products costs one regex search per distinct color. Only
+products whose base_color actually changes are written: one UPDATE per
+base color per chunk, which also recomputes their search vectors, and
+one mirroring it onto their ProductCard rows.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ProductCard
+from .search import build_search_vector
+
+BaseColor = Product.BaseColor
+
+# Checked in this order: a color naming several (e.g. "Rose Gold") gets
+# the first base color listed. Override with settings.CATALOG_COLOR_WORDS.
+COLOR_WORDS = (
+    (BaseColor.BLACK, ('black', 'noir')),
+    (BaseColor.WHITE, ('white', 'ecru', 'cream', 'ivory', 'chalk')),
+    (BaseColor.GREY, ('grey', 'gray', 'silver', 'charcoal', 'slate')),
+    (BaseColor.BLUE, ('navy', 'blue', 'indigo', 'denim', 'azure')),
+    (BaseColor.RED, ('red', 'burgundy', 'maroon', 'crimson')),
+    (BaseColor.GREEN, ('green', 'olive', 'khaki', 'sage', 'emerald')),
+    (BaseColor.YELLOW, ('yellow', 'gold', 'mustard')),
+    (BaseColor.ORANGE, ('orange', 'rust', 'amber')),
+    (BaseColor.PURPLE, ('purple', 'violet', 'lilac', 'plum')),
+    (BaseColor.BROWN, ('brown', 'tan', 'chocolate', 'coffee')),
+    (BaseColor.BEIGE, ('beige', 'sand', 'camel', 'stone')),
+    (BaseColor.PINK, ('pink', 'rose', 'coral')),
+    (BaseColor.MULTI, ('multi', 'multicolor', 'multicolour', 'multicolored', 'multicoloured', 'pattern')),
+)
+
+# Products read per chunk, and the most changed rows written per flush
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class ColorMapper:
+    """
+    Callable mapping a color string to its base color, or None. Words only
+    match whole ("tan" is not in "tangerine", "red" not in "hundred"),
+    allowing a plural or "-ish"/"-ed" ending ("Reds", "Greyish").
+    """
+
+    def __init__(self, color_words=COLOR_WORDS):
+        self.ranks = {}
+        for rank, (base_color, words) in enumerate(color_words):
+            for word in words:
+                self.ranks.setdefault(word, (rank, base_color))
+        # Longest first, so "multicolor" wins over "multi"
+        words = sorted(self.ranks, key=len, reverse=True)
+        self.pattern = re.compile(r'\b(%s)(?:s|es|ish|ed)?\b' % '|'.join(map(re.escape, words)))
+        self._mapped = {}
+
+    def __call__(self, color):
+        try:
+            return self._mapped[color]
+        except KeyError:
+            matches = [self.ranks[word] for word in self.pattern.findall(color.lower())]
+            base_color = self._mapped[color] = min(matches)[1] if matches else None
+            return base_color
+
+
+@lru_cache(maxsize=None)
+def _mapper(color_words):
+    return ColorMapper(color_words)
+
+
+def color_mapper():
+    """The process's mapper for settings.CATALOG_COLOR_WORDS (or COLOR_WORDS)."""
+    return _mapper(getattr(settings, 'CATALOG_COLOR_WORDS', COLOR_WORDS))
+
+
+def _apply(changes):
+    """Write ``{base_color: [product ids]}`` in one transaction."""
+    now = timezone.now()
+    with transaction.atomic():
+        for base_color, product_ids in changes.items():
+            # updated_at moves only for rows that change: it drives the catalog index sync and ETags
+            Product.objects.filter(pk__in=product_ids).update(
+                base_color=base_color, updated_at=now, search_vector=build_search_vector(base_color=base_color)
+            )
+            ProductCard.objects.filter(pk__in=product_ids).update(base_color=base_color)
+
+
+def map_base_colors(pk_range=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Set base_color from color for every product with a color (those with
+    ``pk_range[0] <= pk <= pk_range[1]`` if given), reading them with a
+    chunked server-side cursor. Unmapped colors are left alone. Returns
+    the counts per (color, base color) of changed products, per unmapped
+    color, and the category ids of changed products. With ``dry_run``
+    nothing is written.
+    """
+    mapper = color_mapper()
+    products = Product.objects.exclude(color__isnull=True).exclude(color='').order_by()
+    if pk_range is not None:
+        products = products.filter(pk__gte=pk_range[0], pk__lte=pk_range[1])
+
+    result = {'checked': 0, 'mapped': Counter(), 'unmapped': Counter(), 'category_ids': set()}
+    changes, pending = {}, 0
+    rows = products.values_list('pk', 'color', 'base_color', 'category_id').iterator(chunk_size=chunk_size)
+    for pk, color, current, category_id in rows:
+        result['checked'] += 1
+        base_color = mapper(color)
+        if base_color is None:
+            result['unmapped'][color] += 1
+        elif base_color != current:
+            result['mapped'][color, base_color] += 1
+            result['category_ids'].add(category_id)
+            changes.setdefault(base_color, []).append(pk)
+            pending += 1
+            if pending >= chunk_size:
+                if not dry_run:
+                    _apply(changes)
+                changes, pending = {}, 0
+    if changes and not dry_run:
+        _apply(changes)
+    return result
+
+
+def pk_ranges(parts):
+    """Split the ids of products with a color into ``parts`` contiguous ranges of about equal size."""
+    products = Product.objects.exclude(color__isnull=True).exclude(color='').order_by('pk')
+    total = products.count()
+    if not total:
+        return []
+    size = -(-total // parts)
+    bounds = products.values_list('pk', flat=True)
+    ranges = []
+    for start in range(0, total, size):
+        ranges.append((bounds[start], bounds[min(start + size, total) - 1]))
+    return ranges
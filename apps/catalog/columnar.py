@@ -0,0 +1,373 @@
+"""
+Optional in-process columnar index of the catalog.
+
+A read-only NumPy snapshot of every product (id, price, base_color,
+category, created_at) plus brand and size membership, so product_list can
+filter, sort, paginate and count facets with vectorized mask operations
+and only fetch the final page of ids from the database.
+
+Enabled with settings.CATALOG_INDEX_ENABLED; requires numpy. Snapshots are
+immutable and swapped atomically, so request threads never see a
+half-applied update.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+from .cards import cards_for
+from .facets import FACETS, PRICE_BUCKETS, build_facets
+from .models import Brand, Category, Product, ProductBrand, ProductSize
+from .pagination import PAGE_SIZE, KeysetPage, decode_cursor, encode_cursor
+from .versioning import catalog_version
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Re-read rows touched this long before the last sync, to cover
+# transactions that committed after we looked
+SYNC_OVERLAP = timedelta(seconds=60)
+
+COLORS = list(Product.BaseColor.values)
+BUCKET_LOWER_CENTS = [int(lower * 100) for lower, upper in PRICE_BUCKETS]
+
+
+def to_micros(value):
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def to_cents(value, rounding):
+    return int((value * 100).to_integral_value(rounding=rounding))
+
+
+class Membership:
+    """
+    Many-to-many column (product -> brands, product -> sizes) stored as
+    parallel (row, value index) arrays. Per-value bitmaps are derived on
+    demand and memoized; counting uses a single bincount over the pairs.
+    """
+
+    def __init__(self, rows, codes, values):
+        self.rows = rows
+        self.codes = codes
+        self.values = values
+        self.index = {value: i for i, value in enumerate(values)}
+        self._bitmaps = {}
+        self._size = None
+
+    def bind(self, size):
+        self._size = size
+        return self
+
+    def bitmap(self, value):
+        bitmap = self._bitmaps.get(value)
+        if bitmap is None:
+            bitmap = np.zeros(self._size, dtype=bool)
+            code = self.index.get(value)
+            if code is not None:
+                bitmap[self.rows[self.codes == code]] = True
+            self._bitmaps[value] = bitmap
+        return bitmap
+
+    def any_of(self, values):
+        mask = np.zeros(self._size, dtype=bool)
+        for value in values:
+            mask |= self.bitmap(value)
+        return mask
+
+    def counts(self, mask):
+        """Products per value among rows selected by ``mask``."""
+        hits = np.bincount(self.codes[mask[self.rows]], minlength=len(self.values))
+        return {self.values[code]: int(count) for code, count in enumerate(hits) if count}
+
+    def replace_rows(self, stale_rows, pairs):
+        """New Membership with ``stale_rows`` dropped and ``pairs`` (row, value) added."""
+        keep = ~np.isin(self.rows, stale_rows)
+        values = list(self.values)
+        index = dict(self.index)
+        new_rows, new_codes = [], []
+        for row, value in pairs:
+            if value not in index:
+                index[value] = len(values)
+                values.append(value)
+            new_rows.append(row)
+            new_codes.append(index[value])
+        return Membership(
+            np.concatenate([self.rows[keep], np.array(new_rows, dtype=np.int64)]),
+            np.concatenate([self.codes[keep], np.array(new_codes, dtype=np.int32)]),
+            values,
+        )
+
+
+def _membership(pairs):
+    return Membership(
+        np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), []
+    ).replace_rows(np.empty(0, dtype=np.int64), pairs)
+
+
+class CatalogSnapshot:
+    def __init__(self, ids, alive, price_cents, colors, categories, created, brands, sizes,
+                 brand_names, category_ids_by_name, synced_at):
+        self.ids = ids
+        self.alive = alive
+        self.price_cents = price_cents
+        self.colors = colors
+        self.categories = categories
+        self.created = created
+        self.brands = brands.bind(len(ids))
+        self.sizes = sizes.bind(len(ids))
+        self.brand_names = brand_names
+        self.category_ids_by_name = category_ids_by_name
+        self.synced_at = synced_at
+        self.built = time.monotonic()
+        self.position = {int(product_id): row for row, product_id in enumerate(ids)}
+        self.price_buckets = np.searchsorted(BUCKET_LOWER_CENTS, price_cents, side='right') - 1
+        # Listing order: newest first, ties broken by id (matches the ORM keyset order)
+        self.order = np.lexsort((-ids, -created))
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # --- Filtering ---
+
+    def scope_mask(self, category_name=None):
+        mask = self.alive.copy()
+        if category_name:
+            category_ids = self.category_ids_by_name.get(category_name.lower(), [])
+            mask &= np.isin(self.categories, category_ids)
+        return mask
+
+    def facet_masks(self, filters):
+        """One mask per active facet; inactive facets are absent."""
+        masks = {}
+        if filters['brand']:
+            masks['brand'] = self.brands.any_of(filters['brand'])
+        if filters['color']:
+            codes = [COLORS.index(color) for color in filters['color']]
+            masks['color'] = np.isin(self.colors, codes)
+        if filters['size']:
+            masks['size'] = self.sizes.any_of(filters['size'])
+        if filters['price']:
+            masks['price'] = np.isin(self.price_buckets, filters['price'])
+        return masks
+
+    def range_mask(self, filters):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if filters['min_price'] is not None:
+            mask &= self.price_cents >= to_cents(filters['min_price'], ROUND_CEILING)
+        if filters['max_price'] is not None:
+            mask &= self.price_cents <= to_cents(filters['max_price'], ROUND_FLOOR)
+        return mask
+
+    # --- Queries ---
+
+    def page(self, mask, cursor=None, page_size=PAGE_SIZE):
+        """
+        Ids of the next page in (-created_at, -id) order, plus the cursor
+        values (created_at, id) of the last row when more rows follow.
+        """
+        if cursor is not None:
+            created, product_id = to_micros(cursor[0]), cursor[1]
+            mask = mask & ((self.created < created) | ((self.created == created) & (self.ids < product_id)))
+        rows = self.order[mask[self.order]][:page_size + 1]
+        ids = [int(product_id) for product_id in self.ids[rows[:page_size]]]
+        if len(rows) <= page_size:
+            return ids, None
+        last = rows[page_size - 1]
+        return ids, [from_micros(self.created[last]), int(self.ids[last])]
+
+    def facets(self, scope, filters):
+        """Same result as facets.compute_facets(), computed from masks."""
+        masks = self.facet_masks(filters)
+        base = scope & self.range_mask(filters)
+
+        def without(facet):
+            mask = base.copy()
+            for name, facet_mask in masks.items():
+                if name != facet:
+                    mask &= facet_mask
+            return mask
+
+        counts = {facet: {} for facet in FACETS}
+        counts['brand'] = {str(k): v for k, v in self.brands.counts(without('brand')).items()}
+        color_mask = without('color') & (self.colors >= 0)
+        counts['color'] = {
+            COLORS[code]: int(count)
+            for code, count in enumerate(np.bincount(self.colors[color_mask], minlength=len(COLORS))) if count
+        }
+        counts['size'] = self.sizes.counts(without('size'))
+        counts['price'] = {
+            str(bucket): int(count)
+            for bucket, count in enumerate(np.bincount(self.price_buckets[without('price')], minlength=len(PRICE_BUCKETS)))
+            if count
+        }
+
+        total = int(without(None).sum())
+        scope_prices = self.price_cents[scope]
+        max_price = Decimal(int(scope_prices.max())).scaleb(-2) if len(scope_prices) else None
+        brand_names = {str(brand_id): name for brand_id, name in self.brand_names.items()}
+        return build_facets(counts, brand_names, total, max_price, filters)
+
+    def query(self, category_name, filters, cursor=None, page_size=PAGE_SIZE, with_facets=True):
+        scope = self.scope_mask(category_name)
+        mask = scope & self.range_mask(filters)
+        for facet_mask in self.facet_masks(filters).values():
+            mask &= facet_mask
+        ids, next_cursor = self.page(mask, cursor, page_size)
+        return ids, next_cursor, self.facets(scope, filters) if with_facets else None
+
+
+def _load_rows(product_ids=None):
+    products = Product.objects.order_by()
+    brand_pairs = ProductBrand.objects.order_by()
+    size_pairs = ProductSize.objects.order_by()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        brand_pairs = brand_pairs.filter(product_id__in=product_ids)
+        size_pairs = size_pairs.filter(product_id__in=product_ids)
+    rows = list(
+        products.values_list('id', 'price', 'base_color', 'category_id', 'created_at').iterator(chunk_size=20000)
+    )
+    brands = list(brand_pairs.values_list('product_id', 'brand_id').iterator(chunk_size=20000))
+    sizes = list(size_pairs.values_list('product_id', 'size').iterator(chunk_size=20000))
+    return rows, brands, sizes
+
+
+def _columns(rows):
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([int(row[1] * 100) for row in rows], dtype=np.int64),
+        np.array([COLORS.index(row[2]) if row[2] in COLORS else -1 for row in rows], dtype=np.int16),
+        np.array([row[3] if row[3] is not None else -1 for row in rows], dtype=np.int64),
+        np.array([to_micros(row[4]) for row in rows], dtype=np.int64),
+    )
+
+
+def _lookups():
+    brand_names = dict(Brand.objects.values_list('id', 'name'))
+    category_ids_by_name = {}
+    for category_id, name in Category.objects.values_list('id', 'name'):
+        category_ids_by_name.setdefault(name.lower(), []).append(category_id)
+    return brand_names, category_ids_by_name
+
+
+def build_snapshot():
+    synced_at = timezone.now()
+    rows, brands, sizes = _load_rows()
+    ids, price_cents, colors, categories, created = _columns(rows)
+    position = {int(product_id): row for row, product_id in enumerate(ids)}
+    return CatalogSnapshot(
+        ids, np.ones(len(ids), dtype=bool), price_cents, colors, categories, created,
+        _membership((position[pid], brand_id) for pid, brand_id in brands),
+        _membership((position[pid], size) for pid, size in sizes),
+        *_lookups(), synced_at,
+    )
+
+
+def sync_snapshot(snapshot):
+    """
+    Apply the changes since ``snapshot`` was synced: rows whose updated_at
+    moved (brand/size edits touch it too) are re-read and patched in, new
+    products are appended, and deleted products are masked out.
+    """
+    synced_at = timezone.now()
+    changed_ids = list(
+        Product.objects.filter(updated_at__gte=snapshot.synced_at - SYNC_OVERLAP).values_list('id', flat=True)
+    )
+    live_ids = np.fromiter(Product.objects.values_list('id', flat=True).iterator(chunk_size=50000), dtype=np.int64)
+    rows, brands, sizes = _load_rows(changed_ids)
+
+    ids, price_cents, colors = snapshot.ids, snapshot.price_cents.copy(), snapshot.colors.copy()
+    categories, created = snapshot.categories.copy(), snapshot.created.copy()
+    alive = snapshot.alive & np.isin(ids, live_ids)
+
+    new_ids, new_prices, new_colors, new_categories, new_created = _columns(rows)
+    position = dict(snapshot.position)
+    appended = []
+    for i, product_id in enumerate(new_ids):
+        row = position.get(int(product_id))
+        if row is None:
+            appended.append(i)
+            position[int(product_id)] = len(ids) + len(appended) - 1
+        else:
+            price_cents[row], colors[row] = new_prices[i], new_colors[i]
+            categories[row], created[row] = new_categories[i], new_created[i]
+            alive[row] = True
+    if appended:
+        ids = np.concatenate([ids, new_ids[appended]])
+        price_cents = np.concatenate([price_cents, new_prices[appended]])
+        colors = np.concatenate([colors, new_colors[appended]])
+        categories = np.concatenate([categories, new_categories[appended]])
+        created = np.concatenate([created, new_created[appended]])
+        alive = np.concatenate([alive, np.ones(len(appended), dtype=bool)])
+
+    stale_rows = np.array([position[int(product_id)] for product_id in new_ids], dtype=np.int64)
+    return CatalogSnapshot(
+        ids, alive, price_cents, colors, categories, created,
+        snapshot.brands.replace_rows(stale_rows, ((position[pid], brand_id) for pid, brand_id in brands)),
+        snapshot.sizes.replace_rows(stale_rows, ((position[pid], size) for pid, size in sizes)),
+        *_lookups(), synced_at,
+    )
+
+
+class CatalogIndex:
+    """
+    Process-wide holder of the current snapshot. A read checks the shared
+    catalog version (one cache get); if it moved, or the snapshot is
+    older than max_age, the snapshot is delta-synced before use.
+    """
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._snapshot = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        version = catalog_version()
+        snapshot = self._snapshot
+        if snapshot is not None and version == self._version \
+                and time.monotonic() - snapshot.built < self.max_age:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._snapshot = build_snapshot() if snapshot is None else sync_snapshot(snapshot)
+                self._version = version
+            return self._snapshot
+
+    def reset(self):
+        with self._lock:
+            self._snapshot = None
+            self._version = None
+
+
+catalog_index = CatalogIndex(max_age=getattr(settings, 'CATALOG_INDEX_MAX_AGE', 60))
+
+
+def index_enabled():
+    return np is not None and getattr(settings, 'CATALOG_INDEX_ENABLED', False)
+
+
+def indexed_listing(category_name, filters, cursor=None, with_facets=True):
+    """
+    product_list through the index: returns (KeysetPage of ProductCards,
+    facets or None). Only the page's cards are read from the database.
+    Cursors are interchangeable with the ORM path's (created_at, id) ones.
+    """
+    cursor_values = decode_cursor(Product, ('created_at', 'id'), cursor) if cursor else None
+    ids, next_values, facets = catalog_index.snapshot().query(
+        category_name, filters, cursor_values, with_facets=with_facets
+    )
+    return KeysetPage(cards_for(ids), encode_cursor(next_values) if next_values else None), facets
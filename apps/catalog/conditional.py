@@ -0,0 +1,144 @@
+"""
+HTTP caching of catalog pages.
+
+Validators for conditional GETs are computed from the catalog versions
+and Product.updated_at only, so a matching If-None-Match /
+If-Modified-Since is answered with a 304 before the view runs any of its
+listing queries. With CATALOG_PUBLIC_CACHE the pages are also rendered
+without per-visitor state and marked cacheable by shared proxies.
+"""
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from apps.cart.service import Cart
+
+from .models import Category, Product
+from .versioning import catalog_version, version_datetime
+
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _representation(request):
+    # The same URL serves the full page and its HTMX partials
+    if request.headers.get('HX-Request'):
+        return request.headers.get('HX-Target') or 'htmx'
+    return 'page'
+
+
+def _visitor(request):
+    """
+    What a full page embeds per visitor: the cart badge and drawer (base.html)
+    and the CSRF token of its forms, whose secret rotates when the user
+    changes. HTMX partials embed neither.
+    """
+    if request.headers.get('HX-Request') or getattr(request, 'public_page', False):
+        return None
+    return Cart(request).cart or None, request.user.pk
+
+
+def _listing_categories(request):
+    """Ids of the categories a category-scoped product_list shows."""
+    if not hasattr(request, '_catalog_categories'):
+        category_name = request.GET.get('category', '').strip()
+        category_ids = []
+        if category_name:
+            category_ids = list(Category.objects.filter(name__iexact=category_name).values_list('pk', flat=True))
+        request._catalog_categories = category_ids
+    return request._catalog_categories
+
+
+def _listing_versions(request):
+    """Versions a product_list response depends on: its category's, or the whole catalog's."""
+    return tuple(catalog_version(pk) for pk in _listing_categories(request)) or (catalog_version(),)
+
+
+def product_list_etag(request):
+    return _etag('product_list', _listing_versions(request), _representation(request), _visitor(request))
+
+
+def product_list_last_modified(request):
+    return version_datetime(max(_listing_versions(request)))
+
+
+def home_etag(request):
+    return _etag('home', catalog_version(), _visitor(request))
+
+
+def home_last_modified(request):
+    return version_datetime(catalog_version())
+
+
+def _product_row(request, pk):
+    """(updated_at, category_id) or None for an unknown product."""
+    if not hasattr(request, '_product_row'):
+        request._product_row = Product.objects.filter(pk=pk).values_list('updated_at', 'category_id').first()
+    return request._product_row
+
+
+def _product_state(request, pk):
+    """(updated_at, version of its category) or None for an unknown product."""
+    row = _product_row(request, pk)
+    # Gallery images don't touch updated_at, but bump the category version
+    return row and (row[0], catalog_version(row[1]))
+
+
+def product_detail_etag(request, pk):
+    state = _product_state(request, pk)
+    return state and _etag('product_detail', pk, state, _visitor(request))
+
+
+def product_detail_last_modified(request, pk):
+    state = _product_state(request, pk)
+    return state and max(state[0], version_datetime(state[1]))
+
+
+def public_cache_enabled():
+    return getattr(settings, 'CATALOG_PUBLIC_CACHE', False)
+
+
+def public_page(surrogate_keys):
+    """
+    View decorator for CATALOG_PUBLIC_CACHE: the page is rendered without
+    the cart (the cart context processor checks request.public_page; the
+    badge and drawer load through cart:summary) and without a CSRF token,
+    then sent with Cache-Control: public and a Surrogate-Key header built
+    by ``surrogate_keys(request, *args, **kwargs)`` so a CDN can purge
+    exactly the pages a catalog change touches. Apply it outermost, so
+    304s are marked too.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not public_cache_enabled() or request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            request.public_page = True
+            response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                patch_cache_control(
+                    response, public=True,
+                    max_age=getattr(settings, 'CATALOG_PUBLIC_CACHE_MAX_AGE', 60),
+                    s_maxage=getattr(settings, 'CATALOG_PUBLIC_CACHE_S_MAXAGE', 600),
+                )
+                response['Surrogate-Key'] = ' '.join(surrogate_keys(request, *args, **kwargs))
+            return response
+        return wrapped
+    return decorator
+
+
+def home_surrogate_keys(request):
+    return ['catalog', 'home']
+
+
+def product_list_surrogate_keys(request):
+    return ['catalog', 'product-list'] + [f'category-{pk}' for pk in _listing_categories(request)]
+
+
+def product_detail_surrogate_keys(request, pk):
+    keys = ['catalog', f'product-{pk}']
+    row = _product_row(request, pk)
+    if row and row[1] is not None:
+        keys.append(f'category-{row[1]}')
+    return keys
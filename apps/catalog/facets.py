@@ -0,0 +1,239 @@
+import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.http import QueryDict
+from django.db.models import Case, CharField, Count, Exists, F, Max, OuterRef, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product, ProductBrand, ProductSize
+from .versioning import catalog_version
+
+# (lower, upper) bounds; upper is exclusive and None means open-ended
+PRICE_BUCKETS = (
+    (Decimal('0'), Decimal('100')),
+    (Decimal('100'), Decimal('250')),
+    (Decimal('250'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), None),
+)
+
+FACET_CACHE_TIMEOUT = 60 * 15
+
+# Facets with disjunctive (OR within, AND across) semantics
+FACETS = ('brand', 'color', 'size', 'price')
+
+LETTER_SIZES = ('XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL')
+
+
+def parse_filters(params):
+    """
+    Normalize the filter query parameters: unknown values are dropped and
+    every list is de-duplicated and sorted, so equivalent URLs share a
+    cache entry.
+    """
+    valid_colors = set(Product.BaseColor.values)
+    filters = {
+        'brand': sorted({int(v) for v in params.getlist('brand') if v.isdigit()}),
+        'color': sorted({v for v in params.getlist('color') if v in valid_colors}),
+        'size': sorted({v for v in params.getlist('size') if v}),
+        'price': sorted({int(v) for v in params.getlist('price') if v.isdigit() and int(v) < len(PRICE_BUCKETS)}),
+        'min_price': _parse_price(params.get('min_price')),
+        'max_price': _parse_price(params.get('max_price')),
+    }
+    return filters
+
+
+def filters_query(filters):
+    """The inverse of parse_filters(): a mutable QueryDict of the active filters."""
+    query = QueryDict(mutable=True)
+    for name in FACETS:
+        query.setlist(name, [str(value) for value in filters[name]])
+    for name in ('min_price', 'max_price'):
+        if filters[name] is not None:
+            query[name] = str(filters[name])
+    return query
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(value)
+    except (TypeError, InvalidOperation):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def apply_filters(queryset, filters, exclude=None):
+    """
+    Apply every active filter except the ``exclude`` facet. Relations are
+    tested with EXISTS so no join fans out the rows (no DISTINCT needed).
+    """
+    if filters['brand'] and exclude != 'brand':
+        queryset = queryset.filter(Exists(
+            ProductBrand.objects.filter(product=OuterRef('pk'), brand_id__in=filters['brand'])
+        ))
+    if filters['color'] and exclude != 'color':
+        queryset = queryset.filter(base_color__in=filters['color'])
+    if filters['size'] and exclude != 'size':
+        queryset = queryset.filter(Exists(
+            ProductSize.objects.filter(product=OuterRef('pk'), size__in=filters['size'])
+        ))
+    if filters['price'] and exclude != 'price':
+        buckets = Q()
+        for index in filters['price']:
+            lower, upper = PRICE_BUCKETS[index]
+            bucket = Q(price__gte=lower)
+            if upper is not None:
+                bucket &= Q(price__lt=upper)
+            buckets |= bucket
+        queryset = queryset.filter(buckets)
+    if filters['min_price'] is not None:
+        queryset = queryset.filter(price__gte=filters['min_price'])
+    if filters['max_price'] is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    return queryset
+
+
+def _price_bucket():
+    whens = [
+        When(price__lt=upper, then=Value(str(index)))
+        for index, (lower, upper) in enumerate(PRICE_BUCKETS) if upper is not None
+    ]
+    return Case(*whens, default=Value(str(len(PRICE_BUCKETS) - 1)), output_field=CharField())
+
+
+def _facet_branch(queryset, facet, value, label=None, count=None):
+    return queryset.annotate(
+        facet=Value(facet, output_field=CharField()),
+        value=Cast(value, CharField()),
+        label=label if label is not None else Value('', output_field=CharField()),
+    ).values('facet', 'value', 'label').annotate(
+        count=count or Count('pk', distinct=True)
+    ).order_by()
+
+
+def compute_facets(scope, filters):
+    """
+    Count every facet value for ``scope`` in one round trip: a UNION ALL
+    of one GROUP BY per facet. Each facet is counted with the *other*
+    facets' filters applied, so its counts show what selecting a value
+    would add (disjunctive faceting).
+    """
+    scope = scope.order_by()
+    branches = [
+        _facet_branch(
+            apply_filters(scope, filters, exclude='brand').filter(product_brands__isnull=False),
+            'brand', F('product_brands__brand'), label=F('product_brands__brand__name'),
+        ),
+        _facet_branch(
+            apply_filters(scope, filters, exclude='color').filter(base_color__isnull=False),
+            'color', F('base_color'),
+        ),
+        _facet_branch(
+            apply_filters(scope, filters, exclude='size').filter(sizes__isnull=False),
+            'size', F('sizes__size'),
+        ),
+        _facet_branch(apply_filters(scope, filters, exclude='price'), 'price', _price_bucket()),
+        # Scalars: matching products, and the price ceiling of the unfiltered scope
+        _facet_branch(apply_filters(scope, filters), 'total', Value('')),
+        _facet_branch(scope, 'max_price', Value(''), label=Cast(Max('price'), CharField()), count=Count('pk')),
+    ]
+    rows = branches[0].union(*branches[1:], all=True).values_list('facet', 'value', 'label', 'count')
+
+    counts = {facet: {} for facet in FACETS}
+    brand_names = {}
+    total = 0
+    max_price = None
+    for facet, value, label, count in rows:
+        if facet == 'total':
+            total = count
+        elif facet == 'max_price':
+            max_price = Decimal(label) if label else None
+        else:
+            counts[facet][value] = count
+            if facet == 'brand':
+                brand_names[value] = label
+
+    return build_facets(counts, brand_names, total, max_price, filters)
+
+
+def build_facets(counts, brand_names, total, max_price, filters):
+    """
+    Shape raw counts (facet -> {value as str: count}) into the sidebar
+    options. Shared by the SQL path and the in-memory catalog index.
+    """
+    return {
+        'total': total,
+        'max_price': max_price,
+        'brands': sorted(
+            _facet_values(counts['brand'], filters['brand'], brand_names),
+            key=lambda option: option['label'].lower(),
+        ),
+        'colors': _facet_values(counts['color'], filters['color'], dict(Product.BaseColor.choices), Product.BaseColor.values),
+        'sizes': sorted(_facet_values(counts['size'], filters['size']), key=lambda option: _size_sort_key(option['value'])),
+        'prices': _facet_values(
+            counts['price'], filters['price'],
+            {str(i): _price_label(i) for i in range(len(PRICE_BUCKETS))},
+            [str(i) for i in range(len(PRICE_BUCKETS))],
+        ),
+    }
+
+
+def _facet_values(counts, selected, labels=None, order=None):
+    """
+    Options worth showing: values with matches, plus selected values so
+    they can still be unticked.
+    """
+    selected = {str(value) for value in selected}
+    values = order if order is not None else list(counts)
+    options = []
+    for value in values:
+        count = counts.get(value, 0)
+        if count or value in selected:
+            options.append({
+                'value': value,
+                'label': labels.get(value, value) if labels else value,
+                'count': count,
+                'selected': value in selected,
+            })
+    for value in selected - set(values):
+        options.append({'value': value, 'label': labels.get(value, value) if labels else value, 'count': 0, 'selected': True})
+    return options
+
+
+def _price_label(index):
+    lower, upper = PRICE_BUCKETS[index]
+    if upper is None:
+        return f'${lower}+'
+    return f'${lower} - ${upper}'
+
+
+def _size_sort_key(size):
+    """Letter sizes in wear order, then numeric sizes ("US 6.5" < "US 10"), then the rest."""
+    if size.upper() in LETTER_SIZES:
+        return (0, LETTER_SIZES.index(size.upper()), size)
+    number = re.search(r'\d+(\.\d+)?', size)
+    if number:
+        return (1, float(number.group()), size)
+    return (2, 0, size)
+
+
+def facet_cache_key(scope_key, filters):
+    signature = repr((scope_key, sorted(filters.items())))
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    return f'catalog:facets:{catalog_version()}:{digest}'
+
+
+def get_facets(scope, scope_key, filters):
+    """
+    Cached compute_facets(). ``scope_key`` must identify ``scope``
+    (category and search query); the catalog version in the key changes
+    whenever the catalog does.
+    """
+    key = facet_cache_key(scope_key, filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(scope, filters)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
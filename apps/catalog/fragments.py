@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+from .versioning import catalog_version
+
+
+class FragmentCache:
+    """
+    Process-local LRU of rendered HTML fragments, bounded by entry count
+    and by total size. Keys carry the catalog version, so entries from
+    before a catalog change are never hit again and age out of the LRU.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = html
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+fragment_cache = FragmentCache(
+    max_entries=getattr(settings, 'CATALOG_FRAGMENT_CACHE_ENTRIES', 512),
+    max_bytes=getattr(settings, 'CATALOG_FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024),
+)
+
+
+def fragment_key(template_name, category_name, search_query, filters, cursor=None):
+    """
+    Canonical key of a product_list fragment. ``filters`` come from
+    parse_filters() (already de-duplicated and sorted); category and query
+    are compared case- and whitespace-insensitively, like the lookups.
+    """
+    return (
+        template_name,
+        (category_name or '').strip().lower(),
+        ' '.join((search_query or '').split()).lower(),
+        tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(filters.items())),
+        cursor or '',
+        catalog_version(),
+    )
@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from apps.catalog import columnar
+from apps.catalog.facets import PRICE_BUCKETS, apply_filters, compute_facets, parse_filters
+from apps.catalog.models import Brand, Category, Product, ProductSize
+from apps.catalog.pagination import paginate_keyset
+
+class Command(BaseCommand):
+    help = 'Compare product_list filtering + facet counting: ORM vs in-memory catalog index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if columnar.np is None:
+            raise CommandError('numpy is required for the catalog index.')
+
+        started = time.perf_counter()
+        snapshot = columnar.build_snapshot()
+        self.stdout.write(f'Snapshot of {len(snapshot)} products built in {self.ms(started):.1f} ms')
+
+        rng = random.Random(options['seed'])
+        brand_ids = list(Brand.objects.values_list('id', flat=True))
+        sizes = list(ProductSize.objects.values_list('size', flat=True).distinct())
+        categories = [None] + list(Category.objects.values_list('name', flat=True))
+        queries = [self.random_query(rng, brand_ids, sizes, categories) for _ in range(options['iterations'])]
+
+        orm_times, index_times, mismatches = [], [], 0
+        for category_name, filters in queries:
+            started = time.perf_counter()
+            scope = Product.objects.all()
+            if category_name:
+                scope = scope.filter(category__name__iexact=category_name)
+            page = paginate_keyset(apply_filters(scope, filters), ('created_at', 'id'))
+            orm_ids = [product.id for product in page.items]
+            compute_facets(scope, filters)
+            orm_times.append(self.ms(started))
+
+            started = time.perf_counter()
+            index_ids, _, _ = snapshot.query(category_name, filters)
+            index_times.append(self.ms(started))
+
+            mismatches += orm_ids != index_ids
+
+        for label, times in (('ORM', orm_times), ('Index', index_times)):
+            times.sort()
+            self.stdout.write(
+                f'{label:>6}: mean {statistics.mean(times):8.2f} ms  '
+                f'p50 {times[len(times) // 2]:8.2f} ms  p95 {times[int(len(times) * 0.95)]:8.2f} ms'
+            )
+        speedup = statistics.mean(orm_times) / max(statistics.mean(index_times), 1e-6)
+        self.stdout.write(self.style.SUCCESS(f'Index is {speedup:.1f}x faster over {len(queries)} queries.'))
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f'{mismatches} queries returned different pages.'))
+
+    def random_query(self, rng, brand_ids, sizes, categories):
+        params = QueryDict(mutable=True)
+        params.setlist('brand', [str(b) for b in rng.sample(brand_ids, min(len(brand_ids), rng.randint(0, 2)))])
+        params.setlist('color', rng.sample(Product.BaseColor.values, rng.randint(0, 2)))
+        params.setlist('size', rng.sample(sizes, min(len(sizes), rng.randint(0, 1))))
+        params.setlist('price', [str(rng.randrange(len(PRICE_BUCKETS)))] if rng.random() < 0.3 else [])
+        return rng.choice(categories), parse_filters(params)
+
+    @staticmethod
+    def ms(started):
+        return (time.perf_counter() - started) * 1000
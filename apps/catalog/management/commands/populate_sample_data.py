@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from apps.catalog.models import Category, Clothing, Footwear, Accessory, ProductSize, Product, ProductImage
+from apps.catalog.versioning import bulk_edit
 from django.utils.text import slugify
 import os
 from django.conf import settings
@@ -7,6 +8,7 @@ from django.conf import settings
 class Command(BaseCommand):
     help = 'Populate database with sample data from screenshots'
 
+    @bulk_edit()
     def handle(self, *args, **options):
         self.stdout.write('Populating database...')
 
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.search import REBUILD_BATCH_SIZE, rebuild_search_index
+from apps.catalog.versioning import bulk_edit
+
+class Command(BaseCommand):
+    help = 'Recompute Product.search_vector for the whole catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE)
+
+    @bulk_edit()
+    def handle(self, *args, **options):
+        updated = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search vectors for {updated} products.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.cards import REFRESH_BATCH_SIZE, refresh_all_product_cards
+from apps.catalog.versioning import bulk_edit
+
+class Command(BaseCommand):
+    help = 'Rebuild the ProductCard read model for the whole catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REFRESH_BATCH_SIZE)
+
+    @bulk_edit()
+    def handle(self, *args, **options):
+        refreshed = refresh_all_product_cards(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} product cards.'))
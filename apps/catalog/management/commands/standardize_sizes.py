@@ -1,37 +1,26 @@
-from django.core.management.base import BaseCommand
-from apps.catalog.models import Footwear, Accessory, ProductSize
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.catalog.sizes import PRODUCT_TYPES, size_templates, standardize_sizes
+from apps.catalog.versioning import bulk_edit
 
 class Command(BaseCommand):
-    help = 'Standardize sizes for Footwear and Accessories'
+    help = 'Standardize product sizes to the CATALOG_SIZE_TEMPLATES of each product type (Footwear and Accessories by default)'
 
-    def handle(self, *args, **kwargs):
-        footwear_sizes = ['US 6.5', 'US 7', 'US 7.5', 'US 8', 'US 8.5', 'US 9', 'US 9.5', 'US 10', 'US 10.5', 'US 11']
-        accessory_sizes = ['One Size']
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=sorted(PRODUCT_TYPES), action='append', dest='types',
+                            help='Only this product type (repeatable); default: every type with a template')
+        parser.add_argument('--diff', action='store_true',
+                            help='Only rewrite products whose sizes differ from the template; the others keep their rows')
 
-        # Update Footwear
-        footwear_products = Footwear.objects.all()
-        self.stdout.write(f'Found {footwear_products.count()} footwear products.')
-
-        for product in footwear_products:
-            # Clear existing sizes
-            # Since Footwear inherits from Product, 'product' here refers to the Footwear instance,
-            # but because of Multi-Table Inheritance, it acts as a Product instance too.
-            # We access the related ProductSize objects via the 'sizes' related manager defined in ProductSize.
-            product.sizes.all().delete()
-            
-            # Create new sizes
-            for size in footwear_sizes:
-                ProductSize.objects.create(product=product, size=size)
-        
-        self.stdout.write(self.style.SUCCESS(f'Updated sizes for {footwear_products.count()} footwear products.'))
-
-        # Update Accessories
-        accessory_products = Accessory.objects.all()
-        self.stdout.write(f'Found {accessory_products.count()} accessory products.')
-
-        for product in accessory_products:
-            product.sizes.all().delete()
-            for size in accessory_sizes:
-                ProductSize.objects.create(product=product, size=size)
-
-        self.stdout.write(self.style.SUCCESS(f'Updated sizes for {accessory_products.count()} accessory products.'))
+    @bulk_edit()
+    def handle(self, *args, **options):
+        templates = size_templates()
+        missing = [name for name in options['types'] or () if name not in templates]
+        if missing:
+            raise CommandError(f'No size template for {", ".join(missing)}; see CATALOG_SIZE_TEMPLATES.')
+        # All or nothing: a failure never leaves products without sizes
+        with transaction.atomic():
+            for product_type in options['types'] or [name for name in PRODUCT_TYPES if name in templates]:
+                total, changed = standardize_sizes(product_type, templates[product_type], diff_only=options['diff'])
+                self.stdout.write(f'Found {total} {product_type} products.')
+                self.stdout.write(self.style.SUCCESS(f'Updated sizes for {changed} {product_type} products.'))
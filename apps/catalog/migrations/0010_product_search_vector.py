@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-18 06:56
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Mirrors apps.catalog.search.build_search_vector() for the initial backfill
+BACKFILL_SEARCH_VECTOR = """
+UPDATE catalog_product p SET search_vector =
+    setweight(to_tsvector('english', coalesce(p.name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce((
+        SELECT string_agg(b.name, ' ')
+        FROM catalog_productbrand pb JOIN catalog_brand b ON b.id = pb.brand_id
+        WHERE pb.product_id = p.id
+    ), '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(p.color, '') || ' ' || coalesce(p.base_color, '')), 'C') ||
+    setweight(to_tsvector('english', coalesce(p.description, '')), 'D');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_alter_product_image_alter_productimage_image'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SEARCH_VECTOR, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='product_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0 on 2026-10-18 07:05
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# Mirrors apps.catalog.cards.build_card() for the initial backfill
+BACKFILL_PRODUCT_CARDS = """
+INSERT INTO catalog_productcard (
+    product_id, name, price, brand_name, color, base_color, image,
+    category_id, category_name, in_stock, created_at
+)
+SELECT
+    p.id, p.name, p.price,
+    coalesce((
+        SELECT b.name FROM catalog_productbrand pb JOIN catalog_brand b ON b.id = pb.brand_id
+        WHERE pb.product_id = p.id ORDER BY pb.id LIMIT 1
+    ), ''),
+    p.color, p.base_color,
+    coalesce(nullif(p.image, ''), (
+        SELECT i.image FROM catalog_productimage i WHERE i.product_id = p.id ORDER BY i.id LIMIT 1
+    ), ''),
+    p.category_id, coalesce(c.name, ''), p.in_stock, p.created_at
+FROM catalog_product p LEFT JOIN catalog_category c ON c.id = p.category_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='catalog.product')),
+                ('name', models.CharField(max_length=255)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('brand_name', models.CharField(blank=True, max_length=100)),
+                ('color', models.CharField(blank=True, max_length=100, null=True)),
+                ('base_color', models.CharField(blank=True, max_length=20, null=True)),
+                ('image', models.ImageField(blank=True, max_length=500, upload_to='products/')),
+                ('category_name', models.CharField(blank=True, max_length=255)),
+                ('in_stock', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField()),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.category')),
+            ],
+            options={
+                'indexes': [models.Index(django.db.models.functions.text.Upper('category_name'), models.OrderBy(models.F('created_at'), descending=True), name='productcard_category_recent')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_PRODUCT_CARDS, reverse_sql=migrations.RunSQL.noop),
+    ]
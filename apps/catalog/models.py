@@ -1,4 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Upper
 from django.utils.text import slugify
 
 class Category(models.Model):
@@ -77,7 +81,19 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products')
     in_stock = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Weighted name/brand/color/description vector, kept current by catalog.signals
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            # Trigram index on name powers typo-tolerant matching
+            GinIndex(fields=['name'], name='product_name_trgm', opclasses=['gin_trgm_ops']),
+            # Keyset pagination order for listing pages
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -112,6 +128,9 @@ class ProductImage(models.Model):
 class ProductSize(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sizes')
     size = models.CharField(max_length=50)
+    # Units left to sell; empty means stock isn't tracked for this size.
+    # Checkout reserves units with a conditional UPDATE, see apps.orders.services
+    stock = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         verbose_name = "Product Size"
@@ -150,3 +169,31 @@ class Accessory(Product):
     type = models.CharField(max_length=20, choices=TYPE_CHOICES)
     # Removed size field
     material = models.CharField(max_length=100)
+
+class ProductCard(models.Model):
+    """
+    Denormalized listing row, one per product, so grids and rails render
+    from a single narrow table with no joins. Kept current by
+    apps.catalog.cards (signals + refresh_product_cards command).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    name = models.CharField(max_length=255)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    brand_name = models.CharField(max_length=100, blank=True)
+    color = models.CharField(max_length=100, blank=True, null=True)
+    base_color = models.CharField(max_length=20, blank=True, null=True)
+    # Main thumbnail, or the first gallery image when there is none
+    image = models.ImageField(upload_to='products/', blank=True, max_length=500)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='+')
+    category_name = models.CharField(max_length=255, blank=True)
+    in_stock = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Home page rails: newest cards of a category (matched case-insensitively)
+            models.Index(Upper('category_name'), F('created_at').desc(), name='productcard_category_recent'),
+        ]
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,100 @@
+import base64
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _json_default(value):
+    # Full isoformat: DjangoJSONEncoder drops microseconds, which would
+    # make cursors skip or repeat rows created within the same millisecond
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values):
+    payload = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, keys, cursor):
+    """
+    Turn an opaque cursor back into typed key values. Model fields are
+    parsed with their own to_python(); anything else (e.g. a relevance
+    annotation) is a float.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor(cursor)
+
+    decoded = []
+    for key, value in zip(keys, values):
+        try:
+            field = model._meta.get_field(key)
+        except FieldDoesNotExist:
+            field = None
+        try:
+            value = field.to_python(value) if field else float(value)
+        except (TypeError, ValueError, ValidationError):
+            raise InvalidCursor(cursor)
+        # Keys are never null, and NaN or infinity can't be compared against
+        if value is None or (isinstance(value, (float, Decimal)) and not math.isfinite(value)):
+            raise InvalidCursor(cursor)
+        decoded.append(value)
+    return decoded
+
+
+def keyset_filter(keys, values):
+    """
+    Rows strictly after ``values`` when ordered by ``keys`` descending.
+
+    The leading ``keys[0] <= value`` range lets Postgres start the index
+    scan at the cursor instead of filtering from the top.
+    """
+    after = Q()
+    for i, key in enumerate(keys):
+        equal_prefix = dict(zip(keys[:i], values[:i]))
+        after |= Q(**equal_prefix, **{f'{key}__lt': values[i]})
+    return Q(**{f'{keys[0]}__lte': values[0]}) & after
+
+
+def paginate_keyset(queryset, keys, cursor=None, page_size=PAGE_SIZE):
+    """
+    Fetch one page of ``queryset`` ordered by ``keys`` (all descending).
+    Reads page_size + 1 rows to know whether another page exists, so the
+    cost of a page does not depend on how deep it is.
+    """
+    if cursor:
+        values = decode_cursor(queryset.model, keys, cursor)
+        queryset = queryset.filter(keyset_filter(keys, values))
+
+    items = list(queryset.order_by(*[f'-{key}' for key in keys])[:page_size + 1])
+    if len(items) <= page_size:
+        return KeysetPage(items)
+
+    items = items[:page_size]
+    return KeysetPage(items, encode_cursor(getattr(items[-1], key) for key in keys))
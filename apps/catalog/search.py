@@ -0,0 +1,85 @@
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db.models import F, FloatField, Func, OuterRef, Q, TextField, Value
+from django.db.models.functions import Cast
+
+from .models import Product, ProductBrand
+
+SEARCH_CONFIG = 'english'
+
+# Rows per UPDATE when rebuilding the whole index
+REBUILD_BATCH_SIZE = 5000
+
+
+def build_search_vector(**values):
+    """
+    Weighted document for a product row: name (A), brand names (B),
+    color/base_color (C) and description (D). Pass the new ``values`` of
+    columns an UPDATE is changing in the same statement, which would
+    otherwise still read the old ones.
+    """
+    def column(name):
+        return Value(values[name]) if name in values else F(name)
+
+    brand_names = Func(
+        ArraySubquery(ProductBrand.objects.filter(product=OuterRef('pk')).values('brand__name')),
+        Value(' '),
+        function='array_to_string',
+        output_field=TextField(),
+    )
+    return (
+        SearchVector(column('name'), weight='A', config=SEARCH_CONFIG)
+        + SearchVector(brand_names, weight='B', config=SEARCH_CONFIG)
+        + SearchVector(column('color'), column('base_color'), weight='C', config=SEARCH_CONFIG)
+        + SearchVector(column('description'), weight='D', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(product_ids=None):
+    """
+    Recompute search_vector in a single UPDATE for the given products
+    (or every product). Uses .update() so no save signals fire.
+    """
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return products.update(search_vector=build_search_vector())
+
+
+def rebuild_search_index(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Backfill every product in primary-key ranges so a large catalog
+    is never rewritten in one long transaction.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return updated
+        updated += update_search_vectors(ids)
+        last_id = ids[-1]
+
+
+def search_products(queryset, query):
+    """
+    Restrict ``queryset`` to products matching ``query`` and annotate a
+    ``search_rank`` to order by.
+
+    Full-text matches use the GIN index on search_vector; the trigram
+    word-similarity match on name catches typos ("jaket" -> "Jacket").
+    Postgres combines both indexes with a BitmapOr, so no sequential scan.
+    The rank is cast to double precision so it round-trips exactly through
+    a pagination cursor.
+    """
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return queryset.filter(
+        Q(search_vector=search_query) | Q(name__trigram_word_similar=query)
+    ).annotate(
+        search_rank=Cast(
+            SearchRank(F('search_vector'), search_query) + TrigramWordSimilarity(query, 'name'),
+            FloatField(),
+        )
+    )
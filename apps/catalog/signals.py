@@ -0,0 +1,124 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cards import refresh_product_cards
+from .models import (
+    Accessory, Brand, Category, Clothing, Footwear, Product, ProductBrand, ProductImage, ProductSize,
+)
+from .search import update_search_vectors
+from .versioning import bump_catalog_version
+
+# Multi-table subclasses send signals with their own class as sender
+PRODUCT_MODELS = (Product, Clothing, Footwear, Accessory)
+
+
+def touch_product(product_id):
+    # Relation edits count as product edits: updated_at drives the catalog
+    # index delta sync. .update() skips save() and its signals.
+    Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+
+
+def deleting_product(origin):
+    """True when a relation row is being removed by its product's cascade."""
+    model = getattr(origin, 'model', type(origin))
+    return issubclass(model, Product)
+
+
+def product_categories(product_ids):
+    """Category ids of the given products (an id list or a values() queryset)."""
+    return set(Product.objects.filter(pk__in=product_ids).values_list('category_id', flat=True).distinct())
+
+
+def product_changed(product_id):
+    bump_catalog_version(product_categories([product_id]))
+
+
+def product_saving(sender, instance, **kwargs):
+    # A product moving category changes the listing it leaves, too
+    if not instance._state.adding:
+        instance._previous_category_ids = product_categories([instance.pk])
+
+
+def product_saved(sender, instance, **kwargs):
+    update_search_vectors([instance.pk])
+    refresh_product_cards([instance.pk])
+    previous = getattr(instance, '_previous_category_ids', set())
+    bump_catalog_version(previous | {instance.category_id})
+
+
+def product_deleted(sender, instance, **kwargs):
+    bump_catalog_version([instance.category_id])
+
+
+for model in PRODUCT_MODELS:
+    pre_save.connect(product_saving, sender=model, dispatch_uid=f'product_saving_{model.__name__}')
+    post_save.connect(product_saved, sender=model, dispatch_uid=f'product_saved_{model.__name__}')
+    post_delete.connect(product_deleted, sender=model, dispatch_uid=f'product_deleted_{model.__name__}')
+
+
+@receiver(post_save, sender=ProductBrand)
+@receiver(post_delete, sender=ProductBrand)
+def product_brand_changed(sender, instance, origin=None, **kwargs):
+    if deleting_product(origin):
+        return
+    update_search_vectors([instance.product_id])
+    refresh_product_cards([instance.product_id])
+    touch_product(instance.product_id)
+    product_changed(instance.product_id)
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def product_size_changed(sender, instance, origin=None, **kwargs):
+    if deleting_product(origin):
+        return
+    touch_product(instance.product_id)
+    product_changed(instance.product_id)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, origin=None, **kwargs):
+    if deleting_product(origin):
+        return
+    # The first gallery image is the card thumbnail fallback
+    refresh_product_cards([instance.product_id])
+    product_changed(instance.product_id)
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, created, **kwargs):
+    if created:
+        bump_catalog_version()
+        return
+    # Renamed brand: refresh every product carrying it
+    product_ids = ProductBrand.objects.filter(brand=instance).values('product_id')
+    update_search_vectors(product_ids)
+    refresh_product_cards(product_ids)
+    bump_catalog_version(product_categories(product_ids))
+
+
+@receiver(post_delete, sender=Brand)
+def brand_deleted(sender, instance, **kwargs):
+    # Its ProductBrand rows were cascaded first and bumped their categories
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if not created:
+        refresh_product_cards(Product.objects.filter(category=instance).values('pk'))
+    bump_catalog_version([instance.pk])
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance, **kwargs):
+    # Products are detached with SET_NULL (no signals); remember them for their cards
+    instance._product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    refresh_product_cards(getattr(instance, '_product_ids', []))
+    bump_catalog_version([instance.pk])
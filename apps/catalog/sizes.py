@@ -0,0 +1,100 @@
+"""
+Standard size runs per product type, applied by the standardize_sizes
+command.
+
+Sizes are rewritten set-based: one statement per product type deletes
+the affected products' size rows and inserts the products x template
+cross product in template order, whatever the number of products. Stock
+counts carry over to the new row of the same (product, size), and order
+lines follow it, so reservations can still be released; lines of sizes
+the template drops lose their size. The per-row ProductSize signals are
+skipped; their effects (touching updated_at for the catalog index sync,
+bumping the catalog version) are applied once for all affected products.
+"""
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import connection, transaction
+from django.db.models import OuterRef
+from django.utils import timezone
+from apps.orders.models import OrderItem
+
+from .models import Accessory, Clothing, Footwear, Product, ProductSize
+from .versioning import bulk_edit, bump_catalog_version
+
+PRODUCT_TYPES = {'clothing': Clothing, 'footwear': Footwear, 'accessory': Accessory}
+
+# Sizes in display order, per product type; types without a template are
+# left alone. Override with settings.CATALOG_SIZE_TEMPLATES.
+SIZE_TEMPLATES = {
+    'footwear': ['US 6.5', 'US 7', 'US 7.5', 'US 8', 'US 8.5', 'US 9', 'US 9.5', 'US 10', 'US 10.5', 'US 11'],
+    'accessory': ['One Size'],
+}
+
+# {products} is the SQL of the affected product ids; sizes display in primary key order
+REWRITE_SQL = """
+WITH product(id) AS MATERIALIZED ({products}),
+old AS (
+    DELETE FROM {size_table} WHERE product_id IN (SELECT id FROM product)
+    RETURNING id, product_id, size, stock
+),
+new AS (
+    INSERT INTO {size_table} (product_id, size, stock)
+    SELECT product.id, template.size, kept.stock
+    FROM product
+    CROSS JOIN unnest(%s::varchar[]) WITH ORDINALITY AS template(size, position)
+    LEFT JOIN (
+        SELECT DISTINCT ON (product_id, size) product_id, size, stock FROM old ORDER BY product_id, size, id
+    ) AS kept ON kept.product_id = product.id AND kept.size = template.size
+    ORDER BY product.id, template.position
+    RETURNING id, product_id, size
+),
+moved AS (
+    UPDATE {item_table} SET product_size_id = pair.new_id
+    FROM (SELECT old.id AS old_id, new.id AS new_id FROM old LEFT JOIN new USING (product_id, size)) AS pair
+    WHERE product_size_id = pair.old_id
+),
+touched AS (
+    UPDATE {product_table} SET updated_at = %s WHERE id IN (SELECT id FROM product)
+    RETURNING category_id
+)
+SELECT category_id, count(*) FROM touched GROUP BY category_id
+"""
+
+
+def size_templates():
+    return getattr(settings, 'CATALOG_SIZE_TEMPLATES', SIZE_TEMPLATES)
+
+
+def out_of_template(model, template):
+    """``model`` products whose sizes, in display order, aren't exactly ``template`` (compared in the database)."""
+    sizes = ProductSize.objects.filter(product=OuterRef('pk')).order_by('pk').values('size')
+    return model.objects.annotate(current_sizes=ArraySubquery(sizes)).exclude(current_sizes=template)
+
+
+def _rewrite_sizes(products, template):
+    """Give the ``products`` (a queryset) the ``template`` sizes; returns the number per category id."""
+    products_sql, params = products.values('pk').query.sql_with_params()
+    sql = REWRITE_SQL.format(
+        products=products_sql,
+        size_table=connection.ops.quote_name(ProductSize._meta.db_table),
+        item_table=connection.ops.quote_name(OrderItem._meta.db_table),
+        product_table=connection.ops.quote_name(Product._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*params, list(template), timezone.now()))
+        return dict(cursor.fetchall())
+
+
+def standardize_sizes(product_type, template, diff_only=False):
+    """
+    Give every ``product_type`` product exactly the ``template`` sizes.
+    With ``diff_only``, products that already have them (in that order)
+    keep their rows. Returns the number of products and of products
+    rewritten.
+    """
+    model = PRODUCT_TYPES[product_type]
+    products = out_of_template(model, template) if diff_only else model.objects.all()
+    with bulk_edit(), transaction.atomic():
+        changed = _rewrite_sizes(products, template)
+        bump_catalog_version(set(changed))
+        return model.objects.count(), sum(changed.values())
@@ -0,0 +1,587 @@
+import io
+from decimal import Decimal
+from unittest import skipIf
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from apps.orders.models import Order, OrderItem
+from . import columnar
+from .facets import apply_filters, compute_facets, get_facets, parse_filters
+from .fragments import FragmentCache, fragment_cache
+from .cards import cards_for
+from .colors import ColorMapper, pk_ranges
+from .models import Accessory, Brand, Category, Clothing, Footwear, Product, ProductBrand, ProductCard, ProductImage, ProductSize
+from .pagination import PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor
+from .sizes import SIZE_TEMPLATES
+from . import versioning
+from .versioning import CATALOG_VERSION_KEY, bulk_edit, catalog_version
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('catalog:product_list')
+        self.brand = Brand.objects.create(name="Arc'teryx")
+        self.jacket = Product.objects.create(
+            name='Beta SL Jacket',
+            price=Decimal('400.00'),
+            description='Lightweight shell',
+            color='Black',
+        )
+        ProductBrand.objects.create(product=self.jacket, brand=self.brand)
+        self.sneaker = Product.objects.create(
+            name='Samba OG Sneaker',
+            price=Decimal('100.00'),
+            description='Pairs well with a jacket',
+            color='White',
+        )
+
+    def search(self, query):
+        response = self.client.get(self.url, {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [card.pk for card in response.context['products']]
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('jacket'), [self.jacket.pk, self.sneaker.pk])
+
+    def test_search_matches_brand_and_color(self):
+        self.assertEqual(self.search("arc'teryx"), [self.jacket.pk])
+        self.assertEqual(self.search('white'), [self.sneaker.pk])
+
+    def test_search_tolerates_typos(self):
+        self.assertIn(self.jacket.pk, self.search('jaket'))
+
+    def test_brand_rename_refreshes_search_vector(self):
+        self.brand.name = 'Veilance'
+        self.brand.save()
+        self.assertEqual(self.search('veilance'), [self.jacket.pk])
+
+    def test_htmx_partial_contract(self):
+        response = self.client.get(
+            self.url, {'q': 'samba'},
+            HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid'
+        )
+        self.assertTemplateUsed(response, 'catalog/partials/filtered_results.html')
+        self.assertContains(response, 'Samba OG Sneaker')
+
+class ProductListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('catalog:product_list')
+        self.products = [
+            Product.objects.create(name=f'Tee {i}', price=Decimal('20.00'), description='Cotton')
+            for i in range(PAGE_SIZE + 5)
+        ]
+
+    def test_first_page_is_limited(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['products']), PAGE_SIZE)
+        self.assertEqual(response.context['product_count'], PAGE_SIZE + 5)
+        self.assertIsNotNone(response.context['next_page_query'])
+
+    def test_load_more_walks_every_product_once(self):
+        response = self.client.get(self.url)
+        seen = [card.pk for card in response.context['products']]
+        next_query = response.context['next_page_query']
+
+        response = self.client.get(
+            f'{self.url}?{next_query}',
+            HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid-next'
+        )
+        self.assertTemplateUsed(response, 'catalog/partials/product_cards.html')
+        seen += [card.pk for card in response.context['products']]
+
+        self.assertIsNone(response.context['next_page_query'])
+        expected = sorted(self.products, key=lambda p: (p.created_at, p.id), reverse=True)
+        self.assertEqual(seen, [product.pk for product in expected])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_null_or_non_finite_cursor_is_invalid(self):
+        for values in ([None, None], [None, self.products[0].pk]):
+            response = self.client.get(self.url, {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400)
+        for rank in (float('nan'), float('inf')):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(Product, ('search_rank', 'id'), encode_cursor([rank, 1]))
+
+class FacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nike = Brand.objects.create(name='Nike')
+        self.adidas = Brand.objects.create(name='Adidas')
+        self.make_product('Dunk Low', '110.00', 'Black', self.nike, ['US 9', 'US 10'])
+        self.make_product('Air Max 1', '150.00', 'White', self.nike, ['US 9'])
+        self.make_product('Samba OG', '90.00', 'White', self.adidas, ['US 10'])
+
+    def make_product(self, name, price, color, brand, sizes):
+        product = Product.objects.create(name=name, price=Decimal(price), description='', base_color=color)
+        ProductBrand.objects.create(product=product, brand=brand)
+        for size in sizes:
+            ProductSize.objects.create(product=product, size=size)
+        return product
+
+    def counts(self, options):
+        return {option['label']: option['count'] for option in options}
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Product.objects.all(), parse_filters(QueryDict()))
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(facets['max_price'], Decimal('150.00'))
+        self.assertEqual(self.counts(facets['brands']), {'Adidas': 1, 'Nike': 2})
+        self.assertEqual(self.counts(facets['colors']), {'Black': 1, 'White': 2})
+        self.assertEqual(self.counts(facets['sizes']), {'US 9': 2, 'US 10': 2})
+        self.assertEqual(self.counts(facets['prices']), {'$0 - $100': 1, '$100 - $250': 2})
+
+    def test_disjunctive_counts(self):
+        filters = parse_filters(QueryDict(f'brand={self.nike.id}&color=White'))
+        facets = compute_facets(Product.objects.all(), filters)
+        self.assertEqual(facets['total'], 1)
+        # Brand counts ignore the brand filter but respect the color filter
+        self.assertEqual(self.counts(facets['brands']), {'Adidas': 1, 'Nike': 1})
+        # Color counts ignore the color filter but respect the brand filter
+        self.assertEqual(self.counts(facets['colors']), {'Black': 1, 'White': 1})
+        self.assertTrue(all(option['selected'] for option in facets['brands'] if option['label'] == 'Nike'))
+
+    def test_cache_invalidated_on_catalog_change(self):
+        filters = parse_filters(QueryDict())
+        get_facets(Product.objects.all(), ('', ''), filters)
+        with self.assertNumQueries(0):
+            get_facets(Product.objects.all(), ('', ''), filters)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_product('Gazelle', '100.00', 'Blue', self.adidas, [])
+        facets = get_facets(Product.objects.all(), ('', ''), filters)
+        self.assertEqual(facets['total'], 4)
+
+@skipIf(columnar.np is None, 'numpy is not installed')
+@override_settings(CATALOG_INDEX_ENABLED=True)
+class CatalogIndexTest(FacetTest):
+    def setUp(self):
+        super().setUp()
+        columnar.catalog_index.reset()
+
+    def test_index_matches_orm(self):
+        snapshot = columnar.catalog_index.snapshot()
+        for query in ('', f'brand={self.nike.id}', 'color=White&size=US+10', 'price=0&price=1', 'min_price=100'):
+            filters = parse_filters(QueryDict(query))
+            ids, _, facets = snapshot.query(None, filters)
+            self.assertEqual(facets, compute_facets(Product.objects.all(), filters))
+            expected = Product.objects.filter(
+                pk__in=compute_ids(filters)
+            ).order_by('-created_at', '-id').values_list('id', flat=True)
+            self.assertEqual(ids, list(expected))
+
+    def test_incremental_sync(self):
+        before = columnar.catalog_index.snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            gazelle = self.make_product('Gazelle', '100.00', 'Blue', self.adidas, ['US 9'])
+            Product.objects.get(name='Dunk Low').delete()
+        # Backdate the snapshot so the delta sync can see the new rows
+        before.synced_at -= columnar.SYNC_OVERLAP
+
+        after = columnar.catalog_index.snapshot()
+        self.assertIsNot(before, after)
+        self.assertEqual(len(after), 3)
+        ids, _, facets = after.query(None, parse_filters(QueryDict(f'brand={self.adidas.id}')))
+        self.assertEqual(ids[0], gazelle.id)
+        self.assertEqual(self.counts(facets['sizes']), {'US 9': 1, 'US 10': 1})
+
+    def test_product_list_uses_index(self):
+        columnar.catalog_index.snapshot()
+        url = reverse('catalog:product_list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'color': 'White'})
+        self.assertEqual(response.context['product_count'], 2)
+        # Filtering and facets ran in memory: the only catalog query is the card fetch by id
+        catalog_queries = [q['sql'] for q in queries if 'FROM "catalog_' in q['sql']]
+        self.assertEqual(len(catalog_queries), 1)
+        self.assertIn('"catalog_productcard"."product_id" IN', catalog_queries[0])
+
+class ProductCardTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Footwear')
+        self.brand = Brand.objects.create(name='Salomon')
+        self.product = Product.objects.create(
+            name='XT-6', price=Decimal('190.00'), description='Trail', color='Black', category=self.category
+        )
+        ProductBrand.objects.create(product=self.product, brand=self.brand)
+
+    def card(self):
+        return ProductCard.objects.get(pk=self.product.pk)
+
+    def test_card_follows_product_and_relations(self):
+        card = self.card()
+        self.assertEqual((card.name, card.brand_name, card.category_name), ('XT-6', 'Salomon', 'Footwear'))
+        self.assertEqual(card.image.name, '')
+
+        ProductImage.objects.create(product=self.product, image='products/xt6.jpg')
+        self.assertEqual(self.card().image.name, 'products/xt6.jpg')
+
+        self.brand.name = 'Salomon Advanced'
+        self.brand.save()
+        self.category.name = 'Sneakers'
+        self.category.save()
+        self.product.price = Decimal('170.00')
+        self.product.save()
+        card = self.card()
+        self.assertEqual((card.brand_name, card.category_name, card.price), ('Salomon Advanced', 'Sneakers', Decimal('170.00')))
+
+        self.product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+    def test_missing_cards_are_built_on_read(self):
+        ProductCard.objects.all().delete()
+        self.assertEqual([card.name for card in cards_for([self.product.pk])], ['XT-6'])
+        self.assertTrue(ProductCard.objects.filter(pk=self.product.pk).exists())
+
+    def test_listing_reads_cards_without_joins(self):
+        url = reverse('catalog:product_list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid-next')
+        self.assertContains(response, 'Salomon')
+        card_queries = [q['sql'] for q in queries if 'FROM "catalog_productcard"' in q['sql']]
+        self.assertEqual(len(card_queries), 1)
+        self.assertNotIn('JOIN', card_queries[0])
+        # No per-card lookups of brands or gallery images
+        self.assertFalse([q for q in queries if 'catalog_productimage' in q['sql'] or 'catalog_productbrand' in q['sql']])
+
+class MapColorsTest(TestCase):
+    COLORS = {
+        'Triple Black': 'Black', 'Off-White/Sail': 'White', 'Rose Gold': 'Yellow', 'Reds': 'Red',
+        'Multi-Color': 'Multi', 'Multicolor': 'Multi', 'Tangerine': None, 'Three Hundred': None,
+    }
+
+    def setUp(self):
+        self.products = {
+            color: Product.objects.create(name=color, price=Decimal('10.00'), description='', color=color)
+            for color in self.COLORS
+        }
+        self.mapped = Product.objects.create(name='Done', price=Decimal('10.00'), description='', color='Black', base_color='Black')
+
+    def map_colors(self, *args):
+        out = io.StringIO()
+        call_command('map_colors', *args, stdout=out)
+        return out.getvalue()
+
+    def test_whole_words_in_dictionary_order(self):
+        mapper = ColorMapper()
+        for color, base_color in self.COLORS.items():
+            self.assertEqual(mapper(color), base_color, color)
+
+    def test_dry_run_writes_nothing(self):
+        out = self.map_colors('--dry-run')
+        self.assertIn('Would map "Triple Black" -> Black (1 products)', out)
+        self.assertIn('Could not map "Tangerine"', out)
+        self.assertEqual(Product.objects.filter(base_color__isnull=False).count(), 1)
+
+    def test_only_changed_products_are_written(self):
+        updated_at = self.mapped.updated_at
+        out = self.map_colors('--chunk-size', '2')
+        self.assertIn('Mapped 6 of 9 products; 2 left unmapped.', out)
+        for color, base_color in self.COLORS.items():
+            self.assertEqual(Product.objects.get(pk=self.products[color].pk).base_color, base_color)
+            self.assertEqual(ProductCard.objects.get(pk=self.products[color].pk).base_color, base_color)
+        self.mapped.refresh_from_db()
+        self.assertEqual(self.mapped.updated_at, updated_at)
+        self.assertIn('Mapped 0 of 9 products', self.map_colors())
+
+    def test_pk_ranges_cover_every_product(self):
+        ranges = pk_ranges(4)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(sum(Product.objects.filter(pk__range=bounds).count() for bounds in ranges), 9)
+
+class StandardizeSizesTest(TestCase):
+    def setUp(self):
+        self.shoes = [
+            Footwear.objects.create(name=f'Shoe {i}', price=Decimal('100.00'), description='', height='low') for i in range(3)
+        ]
+        self.bag = Accessory.objects.create(name='Bag', price=Decimal('50.00'), description='', type='bag', material='Nylon')
+        self.tee = Clothing.objects.create(name='Tee', price=Decimal('30.00'), description='', material='Cotton', fit='slim')
+        ProductSize.objects.create(product=self.tee, size='M')
+        ProductSize.objects.create(product=self.shoes[0], size='US 12')
+
+    def sizes(self, product):
+        return list(ProductSize.objects.filter(product=product).order_by('pk').values_list('size', flat=True))
+
+    def standardize(self, *args):
+        call_command('standardize_sizes', *args, stdout=io.StringIO())
+
+    def test_sizes_are_replaced_set_based(self):
+        with CaptureQueriesContext(connection) as few:
+            self.standardize()
+        for shoe in self.shoes:
+            self.assertEqual(self.sizes(shoe), SIZE_TEMPLATES['footwear'])
+        self.assertEqual(self.sizes(self.bag), ['One Size'])
+        self.assertEqual(self.sizes(self.tee), ['M'])
+
+        for i in range(3, 10):
+            Footwear.objects.create(name=f'Shoe {i}', price=Decimal('100.00'), description='', height='low')
+        with CaptureQueriesContext(connection) as many:
+            self.standardize()
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(ProductSize.objects.filter(product__in=Footwear.objects.all()).count(), 100)
+
+    def test_diff_keeps_correct_products(self):
+        self.standardize()
+        ProductSize.objects.filter(product=self.shoes[1]).update(stock=5)
+        kept = list(ProductSize.objects.filter(product=self.shoes[1]).values_list('pk', flat=True))
+        ProductSize.objects.filter(product=self.shoes[2], size='US 9').delete()
+        order = Order.objects.create(first_name='T', last_name='U', email='t@example.com')
+        item = OrderItem.objects.create(
+            order=order, product=self.shoes[2], price=Decimal('100.00'), size='US 10',
+            product_size=ProductSize.objects.get(product=self.shoes[2], size='US 10'),
+        )
+
+        self.standardize('--diff')
+        self.assertEqual(list(ProductSize.objects.filter(product=self.shoes[1]).values_list('pk', flat=True)), kept)
+        self.assertEqual(set(ProductSize.objects.filter(product=self.shoes[1]).values_list('stock', flat=True)), {5})
+        self.assertEqual(self.sizes(self.shoes[2]), SIZE_TEMPLATES['footwear'])
+        # The order line follows its size to the new row
+        item.refresh_from_db()
+        self.assertEqual(item.product_size, ProductSize.objects.get(product=self.shoes[2], size='US 10'))
+
+    def test_stock_survives_a_plain_run(self):
+        ProductSize.objects.create(product=self.shoes[1], size='US 9', stock=3)
+        ProductSize.objects.create(product=self.shoes[1], size='US 7', stock=0)
+        dropped = ProductSize.objects.get(product=self.shoes[0], size='US 12')
+        order = Order.objects.create(first_name='T', last_name='U', email='t@example.com')
+        reserved = OrderItem.objects.create(
+            order=order, product=self.shoes[1], price=Decimal('100.00'), size='US 9',
+            product_size=ProductSize.objects.get(product=self.shoes[1], size='US 9'),
+        )
+        gone = OrderItem.objects.create(
+            order=order, product=self.shoes[0], price=Decimal('100.00'), size='US 12', product_size=dropped,
+        )
+
+        self.standardize()
+        stock = dict(ProductSize.objects.filter(product=self.shoes[1]).values_list('size', 'stock'))
+        self.assertEqual(self.sizes(self.shoes[1]), SIZE_TEMPLATES['footwear'])
+        self.assertEqual((stock['US 9'], stock['US 7'], stock['US 8']), (3, 0, None))
+        reserved.refresh_from_db()
+        gone.refresh_from_db()
+        self.assertEqual((reserved.product_size.product_id, reserved.product_size.size), (self.shoes[1].pk, 'US 9'))
+        self.assertIsNone(gone.product_size)
+
+    def test_type_without_template_is_refused(self):
+        with self.assertRaisesMessage(CommandError, 'No size template for clothing'):
+            self.standardize('--type', 'footwear', '--type', 'clothing')
+        self.assertEqual(self.sizes(self.shoes[0]), ['US 12'])
+
+    @override_settings(CATALOG_SIZE_TEMPLATES={'clothing': ['S', 'M', 'L']})
+    def test_configured_templates(self):
+        self.standardize()
+        self.assertEqual(self.sizes(self.tee), ['S', 'M', 'L'])
+        self.assertEqual(self.sizes(self.shoes[0]), ['US 12'])
+        self.assertEqual(self.sizes(self.bag), [])
+
+class CatalogVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        versioning._recent.clear()
+        self.clothing = Category.objects.create(name='Clothing')
+        self.footwear = Category.objects.create(name='Footwear')
+        self.product = Product.objects.create(
+            name='Overshirt', price=Decimal('150.00'), description='Wool', category=self.clothing
+        )
+
+    def versions(self):
+        return catalog_version(), catalog_version(self.clothing.pk), catalog_version(self.footwear.pk)
+
+    def test_product_change_bumps_its_category_only(self):
+        before = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.create(product=self.product, size='M')
+        after = self.versions()
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+        self.assertEqual(after[2], before[2])
+
+    def test_bump_waits_for_the_commit(self):
+        before = self.versions()
+        with self.captureOnCommitCallbacks() as callbacks:
+            ProductSize.objects.create(product=self.product, size='M')
+            self.assertEqual(self.versions(), before)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_moving_category_bumps_both(self):
+        before = self.versions()
+        self.product.category = self.footwear
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        after = self.versions()
+        self.assertTrue(all(a != b for a, b in zip(after, before)))
+
+    def test_bulk_edit_coalesces_bumps(self):
+        before = self.versions()
+        with self.captureOnCommitCallbacks(execute=True), bulk_edit():
+            for size in ('S', 'M', 'L'):
+                ProductSize.objects.create(product=self.product, size=size)
+            Product.objects.filter(pk=self.product.pk).update(price=Decimal('120.00'))
+            self.assertEqual(self.versions(), before)
+        after = self.versions()
+        self.assertNotEqual(after[:2], before[:2])
+        self.assertEqual(after[2], before[2])
+
+    def test_bumps_are_shared_between_processes(self):
+        before = catalog_version()
+        # Another worker (or a management command) has its own cache client
+        other = caches.create_connection('shared')
+        self.assertEqual(other.get(CATALOG_VERSION_KEY), before)
+        other.set(CATALOG_VERSION_KEY, before + 1, None)
+        self.assertEqual(catalog_version(), before)
+        # Once CATALOG_VERSION_LOCAL_TTL has passed
+        versioning._recent.clear()
+        self.assertEqual(catalog_version(), before + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.create(product=self.product, size='M')
+        self.assertEqual(other.get(CATALOG_VERSION_KEY), catalog_version())
+        versioning._recent.clear()
+        self.assertNotIn(catalog_version(), (before, before + 1))
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragment_cache.clear()
+        self.url = reverse('catalog:product_list')
+        self.nike = Brand.objects.create(name='Nike')
+        self.adidas = Brand.objects.create(name='Adidas')
+        for name, brand, color in (('Dunk', self.nike, 'Black'), ('Samba', self.adidas, 'White')):
+            product = Product.objects.create(name=name, price=Decimal('100.00'), description='', color=color, base_color=color.upper())
+            ProductBrand.objects.create(product=product, brand=brand)
+
+    def grid(self, query):
+        return self.client.get(f'{self.url}?{query}', HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid')
+
+    def test_equivalent_filters_share_an_entry(self):
+        first = self.grid(f'brand={self.nike.id}&color=BLACK&color=WHITE')
+        with self.assertNumQueries(0):
+            second = self.grid(f'color=WHITE&brand={self.nike.id}&color=BLACK&brand={self.nike.id}&utm=x')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(fragment_cache.stats()['hits'], 1)
+        self.assertEqual(fragment_cache.stats()['misses'], 1)
+
+    def test_catalog_change_misses(self):
+        self.assertNotContains(self.grid(f'brand={self.nike.id}'), 'Air Max')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Air Max', price=Decimal('120.00'), description='')
+            ProductBrand.objects.create(product=product, brand=self.nike)
+        self.assertContains(self.grid(f'brand={self.nike.id}'), 'Air Max')
+
+    def test_lru_bounds(self):
+        lru = FragmentCache(max_entries=2, max_bytes=10)
+        lru.set('a', 'aaaa')
+        lru.set('b', 'bbbb')
+        lru.get('a')
+        lru.set('c', 'cccc')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 'aaaa')
+        # Over the byte budget: the least recently used entry goes
+        lru.set('d', 'dddddd')
+        self.assertIsNone(lru.get('c'))
+        self.assertEqual(lru.stats()['bytes'], 10)
+        self.assertEqual(lru.stats()['evictions'], 2)
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Footwear')
+        self.product = Product.objects.create(
+            name='Samba', price=Decimal('100.00'), description='', category=self.category
+        )
+        self.list_url = reverse('catalog:product_list') + '?category=footwear'
+        self.detail_url = reverse('catalog:product_detail', args=[self.product.pk])
+
+    def revalidate(self, url, etag, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+        return response, [q['sql'] for q in queries if 'FROM "catalog_product' in q['sql']]
+
+    def test_unchanged_listing_is_304_without_listing_queries(self):
+        etag = self.client.get(self.list_url)['ETag']
+        response, product_queries = self.revalidate(self.list_url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(product_queries, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.create(product=self.product, size='US 9')
+        response, _ = self.revalidate(self.list_url, etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_partials_have_their_own_validators(self):
+        page = self.client.get(self.list_url)
+        partial = self.client.get(self.list_url, HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid')
+        self.assertNotEqual(page['ETag'], partial['ETag'])
+        self.assertIn('HX-Target', partial['Vary'])
+        response, _ = self.revalidate(
+            self.list_url, partial['ETag'], HTTP_HX_REQUEST='true', HTTP_HX_TARGET='product-grid'
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_detail_follows_gallery_and_updated_at(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.revalidate(self.detail_url, etag)[0].status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/samba.jpg')
+        response, _ = self.revalidate(self.detail_url, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.revalidate(self.detail_url, etag)[0].status_code, 304)
+
+        self.product.price = Decimal('90.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.revalidate(self.detail_url, etag)[0].status_code, 200)
+
+@override_settings(CATALOG_PUBLIC_CACHE=True)
+class PublicCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Footwear')
+        self.product = Product.objects.create(
+            name='Samba', price=Decimal('100.00'), description='', category=self.category
+        )
+
+    def assertPublic(self, response, *keys):
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertFalse(response.cookies)
+        for key in keys:
+            self.assertIn(key, response['Surrogate-Key'].split())
+
+    def test_pages_render_without_visitor_state(self):
+        session = self.client.session
+        session['cart'] = {f'{self.product.pk}-M': {'quantity': 2, 'price': '100.00', 'size': 'M', 'product_id': str(self.product.pk)}}
+        session.save()
+
+        response = self.client.get(reverse('catalog:product_list'), {'category': 'footwear'})
+        self.assertPublic(response, 'catalog', f'category-{self.category.pk}')
+        self.assertContains(response, reverse('cart:summary'))
+
+        response = self.client.get(reverse('catalog:product_detail', args=[self.product.pk]))
+        self.assertPublic(response, f'product-{self.product.pk}', f'category-{self.category.pk}')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+        self.assertPublic(self.client.get(reverse('catalog:home')), 'home')
+
+        # The visitor's cart arrives through the lazy, private request
+        response = self.client.get(reverse('cart:summary'), HTTP_HX_REQUEST='true')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertContains(response, 'id="cart-icon-container" hx-swap-oob="true"')
+        self.assertIn('csrftoken', response.cookies)
+
+
+def compute_ids(filters):
+    from .facets import apply_filters
+    return apply_filters(Product.objects.all(), filters).values('id')
@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATEGORY_VERSION_KEY = 'catalog:version:category:{}'
+
+_local = threading.local()
+
+# This process's recently read versions: {key: (version, read until)}
+_recent = {}
+
+
+def _cache():
+    # Shared by every worker and management command, see settings.CACHES
+    return caches[getattr(settings, 'CATALOG_VERSION_CACHE_ALIAS', 'shared')]
+
+
+def _local_ttl():
+    return getattr(settings, 'CATALOG_VERSION_LOCAL_TTL', 1)
+
+
+def _new_version():
+    # Time-based so an evicted counter never restarts at a value old entries
+    # used; also gives HTTP validators a modification time for free.
+    return time.time_ns()
+
+
+def _category_key(category_id):
+    return CATEGORY_VERSION_KEY.format(category_id)
+
+
+def catalog_version(category_id=None):
+    """
+    Opaque version that changes whenever the catalog does. With a
+    ``category_id`` it only changes when that category's products do.
+    """
+    key = CATALOG_VERSION_KEY if category_id is None else _category_key(category_id)
+    now = time.monotonic()
+    recent = _recent.get(key)
+    if recent is not None and recent[1] > now:
+        # Bumps made by other processes show up within CATALOG_VERSION_LOCAL_TTL
+        return recent[0]
+    version = _cache().get_or_set(key, _new_version, None)
+    _recent[key] = (version, now + _local_ttl())
+    return version
+
+
+def version_datetime(version):
+    """The (UTC) time a version was issued, e.g. for Last-Modified."""
+    return datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+
+
+def _bump(category_ids):
+    version = _new_version()
+    versions = {_category_key(category_id): version for category_id in category_ids if category_id is not None}
+    versions[CATALOG_VERSION_KEY] = version
+    _cache().set_many(versions, None)
+    # This process sees its own bumps at once
+    until = time.monotonic() + _local_ttl()
+    _recent.update({key: (version, until) for key in versions})
+
+
+def bump_catalog_version(category_ids=()):
+    """
+    Move the global version, and those of ``category_ids``, forward.
+
+    Inside a transaction the bump waits for the commit, so nothing cached
+    from a concurrent read of the old rows outlives the change; otherwise
+    it happens at once. Inside bulk_edit() the bump is deferred instead.
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(category_ids)
+        return
+    category_ids = set(category_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(category_ids))
+    else:
+        _bump(category_ids)
+
+
+@contextmanager
+def bulk_edit():
+    """
+    Coalesce every bump made inside the block into a single one on exit,
+    e.g. around a management command saving thousands of products. The
+    exit bump always happens, so queryset.update() and bulk_create(),
+    which send no signals, are covered too.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        # Nested: the outermost block bumps
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+    finally:
+        category_ids, _local.pending = _local.pending, None
+        bump_catalog_version(category_ids)
@@ -1,13 +1,27 @@
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404
-from .models import Product, Category
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from . import conditional
+from .cards import cards_for
+from .columnar import index_enabled, indexed_listing
+from .facets import apply_filters, filters_query, get_facets, parse_filters
+from .fragments import fragment_cache, fragment_key
+from .models import Product, ProductCard
+from .pagination import InvalidCursor, paginate_keyset
+from .search import search_products
+from .versioning import catalog_version
 import random
 
+@conditional.public_page(conditional.home_surrogate_keys)
+@condition(etag_func=conditional.home_etag, last_modified_func=conditional.home_last_modified)
 def home(request):
     # New In: Clothing only, 10 items (2 rows)
-    new_in = Product.objects.filter(category__name__iexact='clothing').order_by('-created_at')[:10]
+    new_in = ProductCard.objects.filter(category_name__iexact='clothing').order_by('-created_at')[:10]
     
     # Sneakers: Footwear only, 10 items (2 rows)
-    sneakers = Product.objects.filter(category__name__iexact='footwear').order_by('-created_at')[:10]
+    sneakers = ProductCard.objects.filter(category_name__iexact='footwear').order_by('-created_at')[:10]
     
     context = {
         'new_in': new_in,
@@ -18,80 +32,104 @@ def home(request):
 def women(request):
     return render(request, 'pages/women.html')
 
-from django.db.models import Max, Q
-
+@conditional.public_page(conditional.product_list_surrogate_keys)
+@vary_on_headers('HX-Request', 'HX-Target')
+@condition(etag_func=conditional.product_list_etag, last_modified_func=conditional.product_list_last_modified)
 def product_list(request):
-    products = Product.objects.all().select_related('category').prefetch_related('product_brands__brand')
-    category_name = request.GET.get('category')
-    search_query = request.GET.get('q')
+    scope = Product.objects.all()
+    category_name = request.GET.get('category', '').strip()
+    search_query = ' '.join(request.GET.get('q', '').split())
+    cursor = request.GET.get('cursor')
+    # "Load more" requests from the infinite-scroll sentinel only need the next cards
+    is_next_page = request.headers.get('HX-Request') and request.headers.get('HX-Target') == 'product-grid-next'
+    # Filter toggles only need the grid and the sidebar options (OOB swaps)
+    is_grid = request.headers.get('HX-Request') and request.headers.get('HX-Target') == 'product-grid'
     
-    # 0. Search Filter
+    # 0. Search Filter (full-text + trigram, index-backed)
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        scope = search_products(scope, search_query)
     
     # 1. Base Filter (Category)
     if category_name:
-        products = products.filter(category__name__iexact=category_name)
-    
-    # 2. Dynamic Max Price (based on current scope)
-    max_price_val = products.aggregate(Max('price'))['price__max']
-    max_price_limit = int(max_price_val) if max_price_val else 1000
+        scope = scope.filter(category__name__iexact=category_name)
 
-    # --- Capture Available Facets (Optimization) ---
-    # Determine which brands/colors exist in the current category scope *before* other filters apply
-    # This prevents showing "Adidas" in "Clothing" if Adidas only makes Footwear.
-    available_brand_ids = products.values_list('product_brands__brand', flat=True).distinct()
-    available_colors = set(products.values_list('base_color', flat=True).distinct())
+    # 2. Apply Filters (brand / color / size / price, normalized)
+    filters = parse_filters(request.GET)
+    facets = None
 
-    # 3. Apply Filters
-    selected_brands = request.GET.getlist('brand')
-    selected_colors = request.GET.getlist('color')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
+    # HTMX fragments don't depend on the session: popular filter combinations
+    # are served from the fragment cache without touching the database
+    fragment = None
+    if is_next_page:
+        fragment = 'catalog/partials/product_cards.html'
+    elif is_grid:
+        fragment = 'catalog/partials/filtered_results.html'
+    if fragment:
+        key = fragment_key(fragment, category_name, search_query, filters, cursor)
+        html = fragment_cache.get(key)
+        if html is not None:
+            return HttpResponse(html)
 
-    if selected_brands:
-        products = products.filter(product_brands__brand__id__in=selected_brands).distinct()
-    
-    if selected_colors:
-        products = products.filter(base_color__in=selected_colors)
+    # Keyset pagination: newest first, or by relevance when searching.
+    # Optimization: Avoid order_by('?') for DoS protection
+    try:
+        if index_enabled() and not search_query:
+            # In-memory columnar index: filtering, ordering and facet counts
+            # happen in NumPy; only the page of ids is fetched from the DB
+            page, facets = indexed_listing(
+                category_name, filters, cursor, with_facets=not is_next_page
+            )
+        else:
+            # Page through product ids only; the cards come from the flat ProductCard table
+            products = apply_filters(scope, filters).only('id', 'created_at')
+            keys = ('search_rank', 'created_at', 'id') if search_query else ('created_at', 'id')
+            page = paginate_keyset(products, keys, cursor)
+            page.items = cards_for([product.id for product in page.items])
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
 
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    
-    if max_price:
-        products = products.filter(price__lte=max_price)
+    next_page_query = None
+    if page.has_next:
+        # Built from the normalized filters so cached fragments link canonically
+        query = filters_query(filters)
+        if category_name:
+            query['category'] = category_name
+        if search_query:
+            query['q'] = search_query
+        query['cursor'] = page.next_cursor
+        next_page_query = query.urlencode()
 
-    # Default ordering if not filtered by relevance or other
-    # Optimization: Avoid order_by('?') for DoS protection
-    # For large datasets, we should implement a better strategy (e.g. shuffling a list of IDs)
-    # For now, we'll order by created_at. If random is needed, we should select IDs first.
-    products = products.order_by('-created_at')
+    if is_next_page:
+        context = {'products': page.items, 'next_page_query': next_page_query}
+        html = render_to_string(fragment, context)
+        fragment_cache.set(key, html)
+        return HttpResponse(html)
 
-    # 4. Context Data
-    from .models import Brand
-    # Only available brands
-    all_brands = Brand.objects.filter(id__in=available_brand_ids).order_by('name')
-    
-    # Filter BaseColor choices to only valid ones
-    all_colors = [c for c in Product.BaseColor.choices if c[0] in available_colors]
+    # 3. Facets for the sidebar: counts per brand / color / size / price bucket,
+    # the result total and the price ceiling, in one cached query
+    if facets is None:
+        facets = get_facets(scope, (category_name.lower(), search_query), filters)
 
     context = {
-        'products': products,
+        'products': page.items,
+        'product_count': facets['total'],
+        'next_page_query': next_page_query,
         'current_category': category_name,
-        'all_brands': all_brands,
-        'all_colors': all_colors,
-        'max_price_limit': max_price_limit,
+        'facets': facets,
+        'filters': filters,
+        'max_price_limit': int(facets['max_price']) if facets['max_price'] else 1000,
     }
     
     # Only return partial if specifically requesting the product grid (e.g. from filters)
-    if request.headers.get('HX-Request') and request.headers.get('HX-Target') == 'product-grid':
-        return render(request, 'catalog/partials/filtered_results.html', context)
+    if is_grid:
+        html = render_to_string(fragment, context)
+        fragment_cache.set(key, html)
+        return HttpResponse(html)
         
     return render(request, 'catalog/product_list.html', context)
 
+@conditional.public_page(conditional.product_detail_surrogate_keys)
+@condition(etag_func=conditional.product_detail_etag, last_modified_func=conditional.product_detail_last_modified)
 def product_detail(request, pk):
     # Optimize main product query
     queryset = Product.objects.select_related(
@@ -107,15 +145,16 @@ def product_detail(request, pk):
     
     # Get 4 random products from the same category, excluding current product
     # Optimization: Avoid order_by('?') for DoS protection
-    related_qs = Product.objects.filter(category=product.category).exclude(pk=pk)
-    all_related_ids = list(related_qs.values_list('id', flat=True))
+    related_qs = ProductCard.objects.filter(category_id=product.category_id).exclude(pk=pk)
+    all_related_ids = list(related_qs.values_list('pk', flat=True))
     
     if len(all_related_ids) > 4:
-        random_ids = random.sample(all_related_ids, 4)
-        # Prefetch images for related products to avoid N+1 in template loop
-        related_products = Product.objects.filter(id__in=random_ids).prefetch_related('gallery_images')
+        # Seeded by the catalog version so the page (and its ETag) is stable until the catalog changes
+        rng = random.Random(f'{pk}:{catalog_version(product.category_id)}')
+        random_ids = rng.sample(all_related_ids, 4)
+        related_products = cards_for(random_ids)
     else:
-        related_products = related_qs.prefetch_related('gallery_images')
+        related_products = cards_for(all_related_ids)
     
     context = {
         'product': product,
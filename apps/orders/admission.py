@@ -0,0 +1,305 @@
+"""
+Admission control for checkout.
+
+During a drop only CHECKOUT_ADMISSION_LIMIT visitors are let into
+order_create / payment_process at a time; everyone else waits in a FIFO
+virtual waiting room and polls their position over HTMX. An admitted
+visitor holds a lease until their invoice is created or the lease runs
+out, so a stalled payment provider queues people instead of piling up
+blocked workers and DB connections. A limit of 0 turns it off.
+"""
+import threading
+import time
+import uuid
+from functools import lru_cache, wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils.cache import add_never_cache_headers
+from django.utils.module_loading import import_string
+
+# Session key of the visitor's waiting room ticket
+TICKET_SESSION_KEY = 'checkout_ticket'
+
+# The waiting page polls with this element id (sent as HX-Trigger)
+POLL_TRIGGER = 'checkout-queue'
+
+
+def admission_limit():
+    return getattr(settings, 'CHECKOUT_ADMISSION_LIMIT', 0)
+
+
+def lease_seconds():
+    return getattr(settings, 'CHECKOUT_ADMISSION_LEASE', 60 * 10)
+
+
+def poll_interval():
+    return getattr(settings, 'CHECKOUT_QUEUE_POLL_INTERVAL', 3)
+
+
+def queue_timeout():
+    # Waiting visitors who stop polling (closed the tab) lose their place
+    return getattr(settings, 'CHECKOUT_QUEUE_TIMEOUT', 60)
+
+
+def admission_cache_alias():
+    return getattr(settings, 'CHECKOUT_ADMISSION_CACHE_ALIAS', 'shared')
+
+
+@lru_cache(maxsize=None)
+def _store(path):
+    return import_string(path)()
+
+
+def get_admission_store():
+    """The settings.CHECKOUT_ADMISSION_STORE (a dotted path) instance of this process."""
+    return _store(getattr(settings, 'CHECKOUT_ADMISSION_STORE', 'apps.orders.admission.CacheAdmissionStore'))
+
+
+def empty_state():
+    return {'active': {}, 'queue': [], 'admitted': 0, 'recent': []}
+
+
+def _expire(state, now):
+    state['active'] = {ticket: expires for ticket, expires in state['active'].items() if expires > now}
+    state['queue'] = [entry for entry in state['queue'] if entry[1] > now - queue_timeout()]
+    state['recent'] = [admitted_at for admitted_at in state['recent'] if admitted_at > now - 60]
+
+
+def _enter(state, ticket, limit, now):
+    """Queue ``ticket`` if new, admit from the head while slots are free; returns its position."""
+    _expire(state, now)
+    if ticket in state['active']:
+        return 0
+    for entry in state['queue']:
+        if entry[0] == ticket:
+            entry[1] = now
+            break
+    else:
+        state['queue'].append([ticket, now])
+    while state['queue'] and len(state['active']) < limit:
+        admitted, _ = state['queue'].pop(0)
+        state['active'][admitted] = now + lease_seconds()
+        state['admitted'] += 1
+        state['recent'].append(now)
+    if ticket in state['active']:
+        return 0
+    return next(i for i, entry in enumerate(state['queue'], 1) if entry[0] == ticket)
+
+
+def _leave(state, ticket, now):
+    state['active'].pop(ticket, None)
+    state['queue'] = [entry for entry in state['queue'] if entry[0] != ticket]
+
+
+def _stats(state, now):
+    _expire(state, now)
+    return {
+        'active': len(state['active']),
+        'queued': len(state['queue']),
+        'admitted': state['admitted'],
+        'admitted_last_minute': len(state['recent']),
+    }
+
+
+class AdmissionStore:
+    """
+    Where the waiting room state lives: 'active' maps admitted tickets to
+    their lease expiry, 'queue' lists waiting [ticket, last_poll] in
+    arrival order, plus admission counters for stats(). Subclasses
+    implement _change(), applying a function to the state atomically.
+    """
+
+    def _change(self, mutate):
+        raise NotImplementedError
+
+    def enter(self, ticket, limit):
+        """0 if ``ticket`` may check out now, else its 1-based place in the queue."""
+        return self._change(lambda state, now: _enter(state, ticket, limit, now))
+
+    def leave(self, ticket):
+        """Free the ticket's slot (or place in the queue) for the next visitor."""
+        self._change(lambda state, now: _leave(state, ticket, now))
+
+    def stats(self):
+        return self._change(_stats)
+
+    def clear(self):
+        self._change(lambda state, now: state.update(empty_state()))
+
+
+class LocalAdmissionStore(AdmissionStore):
+    """Per-process state; only right for a single worker (and tests)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = empty_state()
+
+    def _change(self, mutate):
+        with self._lock:
+            return mutate(self._state, time.time())
+
+
+class CacheAdmissionStore(AdmissionStore):
+    """
+    The waiting room as separate keys of the CHECKOUT_ADMISSION_CACHE_ALIAS
+    cache ('shared' by default), so no request ever waits on a lock:
+
+    - each visitor draws a ticket number from an incr() counter, kept in
+      their own key for as long as they keep polling;
+    - an admitted visitor holds one of ``limit`` slot keys, claimed with
+      cache.add() (atomic on every backend) and expiring with the lease;
+    - a "now serving" counter moves forward by the number of free slots,
+      at most once per poll interval (guarded by another cache.add(), never
+      waited on), and visitors whose number it has reached claim a slot.
+
+    Positions count visitors who gave up as still waiting until the
+    counter passes them. The cache must be the same for every worker: with
+    a per-process LocMemCache each worker would admit its own
+    CHECKOUT_ADMISSION_LIMIT visitors and number its own queue.
+    """
+
+    KEY = 'checkout:admission'
+    # Admissions are counted per bucket of this many seconds, for stats()
+    BUCKET = 10
+
+    def __init__(self):
+        self.cache = caches[admission_cache_alias()]
+        if isinstance(self.cache, LocMemCache):
+            raise ImproperlyConfigured(
+                f'CHECKOUT_ADMISSION_CACHE_ALIAS {admission_cache_alias()!r} is a per-process LocMemCache; '
+                'the checkout waiting room needs a cache shared by every worker.'
+            )
+
+    def _prefix(self):
+        # clear() starts a new generation instead of finding every key
+        return f'{self.KEY}:{self.cache.get_or_set(self.KEY + ":generation", 0, None)}'
+
+    def _incr(self, key, delta=1):
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            self.cache.add(key, 0, None)
+            return self.cache.incr(key, delta)
+
+    def _free_slots(self, prefix, limit):
+        slots = [f'{prefix}:slot:{i}' for i in range(limit)]
+        taken = self.cache.get_many(slots)
+        return [slot for slot in slots if slot not in taken]
+
+    def _claim(self, prefix, ticket, number, limit):
+        for slot in self._free_slots(prefix, limit):
+            if self.cache.add(slot, ticket, lease_seconds()):
+                self.cache.set(f'{prefix}:ticket:{ticket}', (number, slot), lease_seconds())
+                self._incr(f'{prefix}:admitted')
+                self._incr(f'{prefix}:admitted:{int(time.time() // self.BUCKET)}')
+                return True
+        return False
+
+    def enter(self, ticket, limit):
+        prefix = self._prefix()
+        ticket_key, serving_key = f'{prefix}:ticket:{ticket}', f'{prefix}:serving'
+        record = self.cache.get(ticket_key)
+        if record is not None and record[1] is not None and self.cache.get(record[1]) == ticket:
+            return 0
+        if record is None or record[1] is not None:
+            # New, or back after their lease ran out: to the end of the queue
+            number = self._incr(f'{prefix}:issued')
+        else:
+            number = record[0]
+        # Visitors who stop polling lose their number
+        self.cache.set(ticket_key, (number, None), queue_timeout())
+
+        serving = self.cache.get(serving_key) or 0
+        if number > serving:
+            free = self._free_slots(prefix, limit)
+            # Those already called get a poll interval to claim a slot before more are
+            if not free or not self.cache.add(f'{prefix}:advance', 1, poll_interval() * 2):
+                return number - serving
+            serving = self._incr(serving_key, len(free))
+            if number > serving:
+                return number - serving
+        # Called, but every slot may have been claimed meanwhile
+        return 0 if self._claim(prefix, ticket, number, limit) else 1
+
+    def leave(self, ticket):
+        prefix = self._prefix()
+        ticket_key = f'{prefix}:ticket:{ticket}'
+        record = self.cache.get(ticket_key)
+        if record is not None and record[1] is not None and self.cache.get(record[1]) == ticket:
+            self.cache.delete(record[1])
+        self.cache.delete(ticket_key)
+
+    def stats(self):
+        prefix = self._prefix()
+        bucket = int(time.time() // self.BUCKET)
+        recent = [f'{prefix}:admitted:{bucket - i}' for i in range(60 // self.BUCKET)]
+        values = self.cache.get_many([f'{prefix}:issued', f'{prefix}:serving', f'{prefix}:admitted', *recent])
+        return {
+            'active': admission_limit() - len(self._free_slots(prefix, admission_limit())),
+            'queued': max(values.get(f'{prefix}:issued', 0) - values.get(f'{prefix}:serving', 0), 0),
+            'admitted': values.get(f'{prefix}:admitted', 0),
+            'admitted_last_minute': sum(values.get(key, 0) for key in recent),
+        }
+
+    def clear(self):
+        self._incr(self.KEY + ':generation')
+
+
+def release_admission(request):
+    """Give the visitor's checkout slot to the next in line (their checkout is done)."""
+    ticket = request.session.get(TICKET_SESSION_KEY)
+    if ticket is not None and admission_limit():
+        get_admission_store().leave(ticket)
+
+
+def _waiting_response(request):
+    """None if the visitor may go on to the checkout view, else what to answer instead."""
+    limit = admission_limit()
+    if not limit:
+        return None
+    ticket = request.session.get(TICKET_SESSION_KEY)
+    if ticket is None:
+        ticket = request.session[TICKET_SESSION_KEY] = uuid.uuid4().hex
+    position = get_admission_store().enter(ticket, limit)
+    polling = request.headers.get('HX-Trigger') == POLL_TRIGGER
+
+    if position == 0 and not polling:
+        return None
+    if position == 0 or (request.headers.get('HX-Request') and not polling):
+        # Admitted while polling, or an HTMX form post while queued: load the page
+        response = HttpResponse()
+        response['HX-Redirect'] = request.path if request.method != 'GET' else request.get_full_path()
+    else:
+        template = 'orders/order/partials/queue_status.html' if polling else 'orders/order/queue.html'
+        response = render(request, template, {
+            'position': position,
+            'poll_interval': poll_interval(),
+            'poll_url': request.get_full_path(),
+        })
+    add_never_cache_headers(response)
+    return response
+
+
+def admission_required(view):
+    """
+    Only run the checkout ``view`` (sync or async) for admitted visitors.
+    Others get the waiting page, which polls the same URL: the answer is
+    its updated position, or an HX-Redirect back to the page once they
+    are admitted.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            response = await sync_to_async(_waiting_response)(request)
+            return response or await view(request, *args, **kwargs)
+        return wrapped
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        return _waiting_response(request) or view(request, *args, **kwargs)
+    return wrapped
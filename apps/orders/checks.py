@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+from .admission import CacheAdmissionStore, admission_cache_alias, admission_limit
+
+
+@checks.register(checks.Tags.caches)
+def check_admission_cache(app_configs, **kwargs):
+    """The waiting room must not run on a per-process cache: each worker would admit its own limit."""
+    store = import_string(getattr(settings, 'CHECKOUT_ADMISSION_STORE', 'apps.orders.admission.CacheAdmissionStore'))
+    if not admission_limit() or not issubclass(store, CacheAdmissionStore):
+        return []
+    if isinstance(caches[admission_cache_alias()], LocMemCache):
+        return [checks.Error(
+            f'CHECKOUT_ADMISSION_CACHE_ALIAS {admission_cache_alias()!r} is a per-process LocMemCache.',
+            hint='Point it at a cache shared by every worker (the database, Redis or Memcached), '
+                 'or set CHECKOUT_ADMISSION_LIMIT to 0.',
+            id='orders.E001',
+        )]
+    return []
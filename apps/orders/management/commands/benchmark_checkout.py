@@ -0,0 +1,43 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from apps.catalog.models import Product
+from apps.orders.models import Order
+from apps.orders.services import place_order
+
+class Command(BaseCommand):
+    help = 'Time checkout (order + items) as the number of cart lines grows; nothing is kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:max(options['lines'])])
+        if len(product_ids) < max(options['lines']):
+            raise CommandError(f'Only {len(product_ids)} products; run populate_sample_data first.')
+
+        for count in options['lines']:
+            lines = [{'product_id': str(pk), 'size': 'M', 'quantity': 1} for pk in product_ids[:count]]
+            times = []
+            for _ in range(options['iterations']):
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        place_order(self.order(), lines)
+                        times.append((time.perf_counter() - started) * 1000)
+                    transaction.set_rollback(True)
+            times.sort()
+            self.stdout.write(
+                f'{count:>5} lines: mean {statistics.mean(times):8.2f} ms  '
+                f'p95 {times[int(len(times) * 0.95)]:8.2f} ms  {len(queries)} queries'
+            )
+
+    @staticmethod
+    def order():
+        return Order(
+            first_name='Bench', last_name='Mark', email='bench@example.com',
+            address='1 Loop St', postal_code='00000', city='Benchville',
+        )
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.orders.services import release_expired_reservations
+
+class Command(BaseCommand):
+    help = 'Cancel unpaid orders older than STOCK_RESERVATION_TTL and put their reserved stock back'
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f'Released the stock of {released} expired orders.'))
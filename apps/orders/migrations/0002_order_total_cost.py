@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE orders_order SET total_cost = totals.total_cost
+            FROM (
+                SELECT order_id, SUM(price * quantity) AS total_cost
+                FROM orders_orderitem GROUP BY order_id
+            ) AS totals
+            WHERE totals.order_id = orders_order.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
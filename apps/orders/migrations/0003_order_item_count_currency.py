@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_total_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(default='usd', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE orders_order SET item_count = totals.item_count
+            FROM (
+                SELECT order_id, SUM(quantity) AS item_count
+                FROM orders_orderitem GROUP BY order_id
+            ) AS totals
+            WHERE totals.order_id = orders_order.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_invoice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        # Paid orders can't regress to an earlier status
+        migrations.RunSQL("UPDATE orders_order SET payment_status = 'finished' WHERE paid", migrations.RunSQL.noop),
+    ]
@@ -1,5 +1,21 @@
 from django.db import models
-from apps.catalog.models import Product
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from apps.catalog.models import Product, ProductSize
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each order with ``items_total`` and ``items_quantity``
+        summed from its items in SQL, for reports that must not trust the
+        stored totals. Listing pages should just read the stored fields.
+        """
+        money = DecimalField(max_digits=10, decimal_places=2)
+        return self.annotate(
+            items_total=Coalesce(Sum(F('items__price') * F('items__quantity'), output_field=money), Value(0, money)),
+            items_quantity=Coalesce(Sum('items__quantity'), 0),
+        )
+
 
 class Order(models.Model):
     STATUS_CHOICES = (
@@ -19,15 +35,35 @@ class Order(models.Model):
     paid = models.BooleanField(default=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     nowpayments_id = models.CharField(max_length=100, blank=True, null=True)
+    # Latest NOWPayments status applied from a webhook, see apps.payments.inbox
+    payment_status = models.CharField(max_length=30, blank=True)
+    # Set once at checkout from the repriced lines, see apps.orders.services
+    total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    currency = models.CharField(max_length=3, default='usd')
+    # Stock held for this unpaid order is released after this, see apps.orders.services
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Current NOWPayments invoice, reused until it expires (see apps.payments.services).
+    # invoice_key identifies the request that created, or is creating, it
+    invoice_id = models.CharField(max_length=100, blank=True)
+    invoice_url = models.URLField(max_length=500, blank=True)
+    invoice_expires_at = models.DateTimeField(null=True, blank=True)
+    invoice_key = models.UUIDField(null=True, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # Stale pending orders, polled by the reconcile_payments command
+            models.Index(fields=['updated_at'], condition=models.Q(status='pending'), name='order_pending_updated_at'),
+        ]
 
     def __str__(self):
         return f'Order {self.id}'
 
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.total_cost
 
 
 class OrderItem(models.Model):
@@ -36,6 +72,10 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
     size = models.CharField(max_length=20, blank=True)
+    # The stock-tracked size this line reserved units of, if any
+    product_size = models.ForeignKey(
+        ProductSize, related_name='order_items', null=True, blank=True, on_delete=models.SET_NULL
+    )
 
     def __str__(self):
         return str(self.id)
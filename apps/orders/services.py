@@ -0,0 +1,156 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.cart.storage import to_minor
+from apps.catalog.models import Product, ProductSize
+from .models import Order, OrderItem
+
+# Unpaid orders hold their stock for this long (NOWPayments invoices also expire)
+DEFAULT_RESERVATION_TTL = 60 * 30
+
+
+class CheckoutError(Exception):
+    """The cart can't be turned into an order (e.g. a product was removed)."""
+
+
+class PriceChanged(CheckoutError):
+    """
+    A product's price changed since it was added to the cart; ``prices``
+    maps the product ids concerned to their current price.
+    """
+
+    def __init__(self, prices):
+        super().__init__('Some prices in your cart have changed. Please review your order before paying.')
+        self.prices = prices
+
+
+def reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_RESERVATION_TTL)
+
+
+def _reserve_stock(items, names):
+    """
+    Take each item's units off its stock-tracked ProductSize, if it has one.
+    Every size is decremented with UPDATE ... SET stock = stock - n WHERE
+    stock >= n, so concurrent checkouts never oversell and never read stock
+    they then overwrite. Rows are updated in primary key order, the same in
+    every checkout, so two carts sharing sizes can't deadlock; the locks are
+    held only until the checkout transaction commits.
+    """
+    tracked = {}
+    rows = ProductSize.objects.filter(
+        product_id__in={item.product_id for item in items}, size__in={item.size for item in items}, stock__isnull=False
+    ).order_by('pk').values_list('pk', 'product_id', 'size')
+    for pk, product_id, size in rows:
+        tracked.setdefault((product_id, size), pk)
+
+    reserved = []
+    for item in items:
+        item.product_size_id = tracked.get((item.product_id, item.size))
+        if item.product_size_id is not None:
+            reserved.append(item)
+    for item in sorted(reserved, key=lambda item: item.product_size_id):
+        in_stock = ProductSize.objects.filter(pk=item.product_size_id, stock__gte=item.quantity)
+        if not in_stock.update(stock=F('stock') - item.quantity):
+            raise CheckoutError(f'Sorry, {names[item.product_id]} in size {item.size} has sold out.')
+    return reserved
+
+
+def place_order(order, lines):
+    """
+    Save the unsaved ``order`` with one OrderItem per cart line, all or
+    nothing. Lines (dicts with 'product_id', 'size' and 'quantity') are
+    priced at current product prices, read in one query; a line carrying
+    the 'price' the customer saw (minor units, as in the cart) that no
+    longer matches raises PriceChanged, so nobody is charged an amount
+    they didn't confirm. The order's total_cost, item_count and currency
+    are stored; the items are written with a single bulk INSERT, so the
+    number of queries does not grow with the number of lines. Units of
+    stock-tracked sizes are reserved until ``reserved_until``, see
+    release_reservation().
+    """
+    lines = [line for line in lines if line['quantity'] > 0]
+    if not lines:
+        raise CheckoutError('Your cart is empty.')
+
+    with transaction.atomic():
+        products = {
+            pk: (price, name) for pk, price, name in
+            Product.objects.filter(pk__in={int(line['product_id']) for line in lines}).values_list('pk', 'price', 'name')
+        }
+        unavailable = {int(line['product_id']) for line in lines} - products.keys()
+        if unavailable:
+            raise CheckoutError('Some products in your cart are no longer available.')
+        changed = {
+            int(line['product_id']): products[int(line['product_id'])][0] for line in lines
+            if 'price' in line and to_minor(products[int(line['product_id'])][0]) != line['price']
+        }
+        if changed:
+            raise PriceChanged(changed)
+
+        items = [
+            OrderItem(
+                product_id=int(line['product_id']),
+                price=products[int(line['product_id'])][0],
+                quantity=line['quantity'],
+                size=line['size'],
+            )
+            for line in lines
+        ]
+        if _reserve_stock(items, {pk: name for pk, (_, name) in products.items()}):
+            order.reserved_until = timezone.now() + timedelta(seconds=reservation_ttl())
+        order.total_cost = sum(item.get_cost() for item in items)
+        order.item_count = sum(item.quantity for item in items)
+        order.currency = getattr(settings, 'ORDER_CURRENCY', 'usd')
+        order.save()
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+    return order
+
+
+def release_reservation(order):
+    """
+    Cancel an unpaid order and put the stock it reserved back. Only the
+    call that clears ``reserved_until`` releases anything, so a webhook
+    racing the expiry job can't return the units twice. Returns whether
+    this call released the reservation.
+    """
+    with transaction.atomic():
+        released = Order.objects.filter(pk=order.pk, paid=False, reserved_until__isnull=False).update(
+            reserved_until=None, status='cancelled', updated_at=timezone.now()
+        )
+        if not released:
+            return False
+        reserved = OrderItem.objects.filter(order=order.pk, product_size__isnull=False).order_by('product_size_id')
+        for product_size_id, quantity in reserved.values_list('product_size_id', 'quantity'):
+            ProductSize.objects.filter(pk=product_size_id).update(stock=F('stock') + quantity)
+    order.reserved_until, order.status = None, 'cancelled'
+    return True
+
+
+def reclaim_stock(order):
+    """
+    Take the units of an order whose reservation was released back off
+    stock, all or nothing, with the same conditional UPDATEs as checkout
+    (for a payment that arrived after the release). Returns whether every
+    unit was still in stock.
+    """
+    reserved = OrderItem.objects.filter(order=order.pk, product_size__isnull=False).order_by('product_size_id')
+    try:
+        with transaction.atomic():
+            for product_size_id, quantity in reserved.values_list('product_size_id', 'quantity'):
+                in_stock = ProductSize.objects.filter(pk=product_size_id, stock__gte=quantity)
+                if not in_stock.update(stock=F('stock') - quantity):
+                    raise CheckoutError(f'Size {product_size_id} has sold out')
+    except CheckoutError:
+        return False
+    return True
+
+
+def release_expired_reservations(now=None):
+    """Release the stock of every unpaid order whose reservation has run out."""
+    expired = Order.objects.filter(paid=False, reserved_until__lt=now or timezone.now())
+    return sum(release_reservation(order) for order in expired.only('pk'))
@@ -1,8 +1,20 @@
-from django.test import TestCase, Client
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.utils import timezone
 from django.urls import reverse
 from django.conf import settings
-from apps.catalog.models import Product
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.catalog.models import Product, ProductSize
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from .admission import TICKET_SESSION_KEY, CacheAdmissionStore, get_admission_store
+from .checks import check_admission_cache
 from .models import Order, OrderItem
+from .services import CheckoutError, PriceChanged, place_order, release_expired_reservations, release_reservation
 from apps.cart.service import Cart
 from decimal import Decimal
 
@@ -53,11 +65,285 @@ class OrderCreateViewTest(TestCase):
         self.assertEqual(order.items.count(), 1)
         self.assertEqual(order.items.first().product, self.product)
         
-        # Check redirection to payment process
-        self.assertRedirects(response, reverse('payments:process'))
+        # Check redirection to payment process (which would call the provider)
+        self.assertRedirects(response, reverse('payments:process'), fetch_redirect_response=False)
         
         # Check if cart is cleared
         session = self.client.session
-        # Check if cart is cleared (it might be re-created as empty by context processors on the redirected page)
+        # The cart is removed from the session rather than left empty
         cart = session.get(settings.CART_SESSION_ID)
-        self.assertEqual(cart, {})
+        self.assertFalse(cart)
+
+    def test_price_change_is_confirmed_before_charging(self):
+        session = self.client.session
+        session[settings.CART_SESSION_ID] = {
+            f'{self.product.id}-M': {'product_id': str(self.product.id), 'quantity': 2, 'price': '100.00', 'size': 'M'}
+        }
+        session.save()
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('120.00'))
+        data = {
+            'first_name': 'John', 'last_name': 'Doe', 'email': 'john@example.com',
+            'address': '123 Main St', 'postal_code': '12345', 'city': 'New York',
+        }
+
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'prices in your cart have changed')
+        self.assertContains(response, '240.00')
+        self.assertFalse(Order.objects.exists())
+
+        response = self.client.post(self.url, data)
+        self.assertRedirects(response, reverse('payments:process'), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.get().total_cost, Decimal('240.00'))
+
+
+class PlaceOrderTest(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('10.00') + i, description='')
+            for i in range(50)
+        ]
+
+    def order(self):
+        return Order(
+            first_name='John', last_name='Doe', email='john@example.com',
+            address='123 Main St', postal_code='12345', city='New York',
+        )
+
+    def lines(self, products, quantity=1):
+        return [{'product_id': str(p.pk), 'size': 'M', 'quantity': quantity} for p in products]
+
+    def test_query_count_does_not_grow_with_lines(self):
+        counts = []
+        for products in (self.products[:1], self.products[:10], self.products):
+            with CaptureQueriesContext(connection) as queries:
+                place_order(self.order(), self.lines(products))
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1)
+        self.assertEqual(OrderItem.objects.count(), 61)
+
+    def test_lines_are_priced_and_total_persisted(self):
+        product = self.products[0]
+        lines = [{'product_id': str(product.pk), 'size': 'M', 'quantity': 3, 'price': 1000}]
+        Product.objects.filter(pk=product.pk).update(price=Decimal('12.50'))
+        with self.assertRaises(PriceChanged) as raised:
+            place_order(self.order(), lines)
+        self.assertEqual(raised.exception.prices, {product.pk: Decimal('12.50')})
+        self.assertFalse(Order.objects.exists())
+
+        lines[0]['price'] = 1250
+        order = place_order(self.order(), lines)
+        order.refresh_from_db()
+        self.assertEqual(order.total_cost, Decimal('37.50'))
+        self.assertEqual(order.items.get().price, Decimal('12.50'))
+        self.assertEqual((order.item_count, order.currency), (3, 'usd'))
+
+    def test_missing_product_rolls_back(self):
+        lines = self.lines(self.products[:3])
+        lines.append({'product_id': '999999', 'size': 'M', 'quantity': 1})
+        with self.assertRaises(CheckoutError):
+            place_order(self.order(), lines)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_totals_in_sql(self):
+        first = place_order(self.order(), self.lines(self.products[:2], quantity=2))
+        second = place_order(self.order(), self.lines(self.products[2:5]))
+        Order.objects.create(first_name='Jane', last_name='Doe', email='jane@example.com')
+        with self.assertNumQueries(1):
+            orders = {order.pk: order for order in Order.objects.with_totals()}
+        for order in (first, second):
+            self.assertEqual(orders[order.pk].items_total, order.total_cost)
+            self.assertEqual(orders[order.pk].items_quantity, order.item_count)
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(min(o.items_total for o in orders.values()), 0)
+
+
+def new_order():
+    return Order(
+        first_name='John', last_name='Doe', email='john@example.com',
+        address='123 Main St', postal_code='12345', city='New York',
+    )
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Drop', price=Decimal('200.00'), description='')
+        self.size = ProductSize.objects.create(product=self.product, size='US 9', stock=2)
+        self.untracked = ProductSize.objects.create(product=self.product, size='US 10')
+
+    def lines(self, size='US 9', quantity=1):
+        return [{'product_id': str(self.product.pk), 'size': size, 'quantity': quantity}]
+
+    def stock(self):
+        self.size.refresh_from_db()
+        return self.size.stock
+
+    def test_checkout_reserves_stock(self):
+        order = place_order(new_order(), self.lines(quantity=2))
+        self.assertEqual(self.stock(), 0)
+        self.assertIsNotNone(order.reserved_until)
+        self.assertEqual(order.items.get().product_size, self.size)
+        with self.assertRaises(CheckoutError):
+            place_order(new_order(), self.lines())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_untracked_sizes_are_unlimited(self):
+        order = place_order(new_order(), self.lines(size='US 10', quantity=50))
+        self.assertIsNone(order.reserved_until)
+        self.assertIsNone(order.items.get().product_size)
+
+    def test_release_is_idempotent(self):
+        order = place_order(new_order(), self.lines(quantity=2))
+        self.assertTrue(release_reservation(order))
+        self.assertFalse(release_reservation(Order.objects.get(pk=order.pk)))
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+    def test_expired_reservations_are_released(self):
+        expired = place_order(new_order(), self.lines())
+        current = place_order(new_order(), self.lines())
+        Order.objects.filter(pk=expired.pk).update(reserved_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(self.stock(), 1)
+        self.assertIsNotNone(Order.objects.get(pk=current.pk).reserved_until)
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def test_last_units_are_not_oversold(self):
+        product = Product.objects.create(name='Drop', price=Decimal('200.00'), description='')
+        size = ProductSize.objects.create(product=product, size='US 9', stock=3)
+        other = ProductSize.objects.create(product=product, size='US 10', stock=100)
+        buyers = 16
+        barrier = threading.Barrier(buyers)
+        outcomes, timings = [], []
+
+        def checkout(i):
+            # Half the carts also hold another size, in a different line order
+            lines = [{'product_id': str(product.pk), 'size': 'US 9', 'quantity': 1}]
+            if i % 2:
+                lines.insert(0, {'product_id': str(product.pk), 'size': 'US 10', 'quantity': 1})
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    place_order(new_order(), lines)
+                    outcomes.append(True)
+                except CheckoutError:
+                    outcomes.append(False)
+                timings.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(i,)) for i in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        size.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((outcomes.count(True), outcomes.count(False)), (3, buyers - 3))
+        self.assertEqual(size.stock, 0)
+        self.assertEqual(OrderItem.objects.filter(size='US 9').count(), 3)
+        # Failed checkouts rolled their other line back too
+        self.assertEqual(other.stock, 100 - OrderItem.objects.filter(size='US 10').count())
+        # Row locks are held for one short transaction, not queued behind each other
+        self.assertLess(max(timings), 5)
+
+
+@override_settings(CHECKOUT_ADMISSION_LIMIT=1, CHECKOUT_ADMISSION_STORE='apps.orders.admission.LocalAdmissionStore')
+class CheckoutAdmissionTest(TestCase):
+    def setUp(self):
+        self.store = get_admission_store()
+        self.store.clear()
+        self.product = Product.objects.create(name='Drop', price=Decimal('200.00'), description='')
+        self.url = reverse('orders:order_create')
+
+    def shopper(self):
+        client = Client()
+        session = client.session
+        session[settings.CART_SESSION_ID] = {
+            f'{self.product.pk}-M': {'product_id': str(self.product.pk), 'quantity': 1, 'price': '200.00', 'size': 'M'}
+        }
+        session.save()
+        return client
+
+    def poll(self, client):
+        return client.get(self.url, HTTP_HX_REQUEST='true', HTTP_HX_TRIGGER='checkout-queue')
+
+    def test_waiting_room(self):
+        first, second, third = self.shopper(), self.shopper(), self.shopper()
+        self.assertContains(first.get(self.url), 'Shipping Details')
+
+        response = second.get(self.url)
+        self.assertTemplateUsed(response, 'orders/order/queue.html')
+        self.assertEqual(response.context['position'], 1)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(third.get(self.url).context['position'], 2)
+
+        response = self.poll(second)
+        self.assertTemplateUsed(response, 'orders/order/partials/queue_status.html')
+        self.assertEqual(response.context['position'], 1)
+
+        self.store.leave(first.session[TICKET_SESSION_KEY])
+        self.assertEqual(self.poll(second)['HX-Redirect'], self.url)
+        self.assertContains(second.get(self.url), 'Shipping Details')
+        self.assertEqual(self.poll(third).context['position'], 1)
+        self.assertEqual(
+            self.store.stats(), {'active': 1, 'queued': 1, 'admitted': 2, 'admitted_last_minute': 2}
+        )
+
+    def test_expired_leases_and_abandoned_places_are_freed(self):
+        with self.settings(CHECKOUT_ADMISSION_LEASE=0, CHECKOUT_QUEUE_TIMEOUT=0):
+            self.assertEqual(self.store.enter('a', 1), 0)
+            self.assertEqual(self.store.enter('b', 1), 0)
+            self.assertEqual(self.store.stats()['queued'], 0)
+
+    def test_metrics_are_staff_only(self):
+        url = reverse('orders:checkout_queue_metrics')
+        self.assertEqual(Client().get(url).status_code, 302)
+        staff = get_user_model().objects.create_user('staff', password='pw', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        self.store.enter('a', 1)
+        self.assertEqual(client.get(url).json()['active'], 1)
+
+    @override_settings(
+        CHECKOUT_ADMISSION_STORE='apps.orders.admission.CacheAdmissionStore', CHECKOUT_QUEUE_POLL_INTERVAL=0
+    )
+    def test_cache_store_must_be_shared(self):
+        with self.settings(CHECKOUT_ADMISSION_CACHE_ALIAS='default'):
+            self.assertEqual([error.id for error in check_admission_cache(None)], ['orders.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                CacheAdmissionStore()
+        self.assertEqual(check_admission_cache(None), [])
+        # Two workers see one waiting room
+        worker, other = CacheAdmissionStore(), CacheAdmissionStore()
+        other.cache = caches.create_connection('shared')
+        worker.clear()
+        self.assertEqual(worker.enter('a', 1), 0)
+        self.assertEqual(other.enter('b', 1), 1)
+        self.assertEqual(other.enter('c', 1), 2)
+        worker.leave('a')
+        self.assertEqual(other.enter('b', 1), 0)
+        self.assertEqual(worker.enter('b', 1), 0)
+        self.assertEqual(worker.enter('c', 1), 1)
+        with self.settings(CHECKOUT_ADMISSION_LIMIT=1):
+            self.assertEqual(
+                other.stats(), {'active': 1, 'queued': 1, 'admitted': 2, 'admitted_last_minute': 2}
+            )
+        worker.clear()
+
+    @override_settings(
+        CHECKOUT_ADMISSION_STORE='apps.orders.admission.CacheAdmissionStore', CHECKOUT_QUEUE_POLL_INTERVAL=0
+    )
+    def test_cache_store_frees_expired_leases(self):
+        store = CacheAdmissionStore()
+        store.clear()
+        with self.settings(CHECKOUT_ADMISSION_LEASE=-1):
+            self.assertEqual(store.enter('a', 1), 0)
+        # 'a' overran its lease: 'b' gets the slot, 'a' goes to the back
+        self.assertEqual(store.enter('b', 1), 0)
+        self.assertEqual(store.enter('a', 1), 1)
+        store.clear()
+        self.assertEqual(store.enter('a', 1), 0)
@@ -9,4 +9,5 @@ urlpatterns = [
     path('payment/success/', views.payment_success, name='payment_success'),
     path('payment/failed/', views.payment_failed, name='payment_failed'),
     path('payment/waiting/', views.payment_waiting, name='payment_waiting'),
+    path('queue/metrics/', views.checkout_queue_metrics, name='checkout_queue_metrics'),
 ]
@@ -1,10 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
-from django.http import HttpResponse
-from .models import Order, OrderItem
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from .models import Order
 from .forms import OrderCreateForm
+from .admission import admission_limit, admission_required, get_admission_store
+from .services import CheckoutError, PriceChanged, place_order
 from apps.cart.service import Cart
 
+@admission_required
 def order_create(request):
     cart = Cart(request)
     if len(cart) == 0:
@@ -13,27 +18,29 @@ def order_create(request):
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            order = form.save()
-            for item in cart:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    price=item['price'],
-                    quantity=item['quantity'],
-                    size=item['size']
-                )
-            cart.clear()
-            request.session['order_id'] = order.id
-            
-            # For HTMX, we need to stop the browser from following the redirect chain via XHR.
-            # We return a 200 OK with HX-Redirect, which HTMX interprets as a command 
-            # to change window.location.
-            if request.headers.get('HX-Request'):
-                response = HttpResponse("Redirecting...")
-                response['HX-Redirect'] = reverse('payments:process')
-                return response
-                
-            return redirect('payments:process')
+            try:
+                # Reprices the lines and writes the order and its items in one transaction
+                order = place_order(form.save(commit=False), cart.cart.values())
+            except CheckoutError as e:
+                if isinstance(e, PriceChanged):
+                    # Show the new prices; the customer confirms them by submitting again
+                    cart.reprice(e.prices)
+                form.add_error(None, str(e))
+            else:
+                cart.clear()
+                request.session['order_id'] = order.id
+
+                # For HTMX, we need to stop the browser from following the redirect chain via XHR.
+                # We return a 200 OK with HX-Redirect, which HTMX interprets as a command
+                # to change window.location.
+                # payments:process_async on the ASGI stack
+                payment_url = reverse('payments:process_async' if settings.PAYMENTS_ASYNC else 'payments:process')
+                if request.headers.get('HX-Request'):
+                    response = HttpResponse("Redirecting...")
+                    response['HX-Redirect'] = payment_url
+                    return response
+
+                return redirect(payment_url)
     else:
         form = OrderCreateForm()
     
@@ -60,3 +67,9 @@ def payment_failed(request):
 
 def payment_waiting(request):
     return render(request, 'orders/payment/waiting.html')
+
+@staff_member_required
+def checkout_queue_metrics(request):
+    # Waiting room depth and admission rate, see apps.orders.admission
+    stats = get_admission_store().stats() if admission_limit() else {}
+    return JsonResponse({'limit': admission_limit(), **stats})
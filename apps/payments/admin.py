@@ -0,0 +1,8 @@
+from django.contrib import admin
+from .models import PaymentNotification
+
+@admin.register(PaymentNotification)
+class PaymentNotificationAdmin(admin.ModelAdmin):
+    list_display = ['payment_id', 'payment_status', 'order_id', 'received_at', 'processed_at', 'outcome']
+    list_filter = ['payment_status', 'outcome']
+    search_fields = ['payment_id', 'order_id']
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.payments'
+
+    def ready(self):
+        from . import checks  # noqa: F401 - registers the system checks
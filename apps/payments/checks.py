@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core import checks
+
+from .client import httpx
+
+
+@checks.register()
+def check_async_client(app_configs, **kwargs):
+    """PAYMENTS_ASYNC without httpx quietly creates invoices on the blocking client, in threads."""
+    if getattr(settings, 'PAYMENTS_ASYNC', False) and httpx is None:
+        return [checks.Warning(
+            'PAYMENTS_ASYNC is on but httpx is not installed; invoices are created with the blocking '
+            'client in a thread pool.',
+            hint='Install httpx (see requirements.txt), or turn PAYMENTS_ASYNC off.',
+            id='payments.W001',
+        )]
+    return []
@@ -0,0 +1,336 @@
+"""
+HTTP client for the NOWPayments API.
+
+One pooled requests.Session per process keeps TLS connections to the
+provider alive between invoices. Every call is bounded by connect/read
+timeouts and retried a few times with exponential backoff and full
+jitter; a circuit breaker makes calls fail fast while the provider is
+down, instead of tying up a worker per checkout. The API has no
+idempotency keys, so a POST (creating an invoice) is only sent again
+when it certainly wasn't processed: the connection was never made, or
+the provider answered 429 or 503.
+
+AsyncProviderClient does the same on httpx for async views under ASGI,
+one pooled client per event loop; httpx is optional.
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is optional
+    httpx = None
+
+# What a failed provider call raises, from either client
+TRANSPORT_ERRORS = (requests.exceptions.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+
+# Methods the provider may be sent twice without doing it twice
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+def is_retryable(status_code):
+    # The provider is rate limiting us, overloaded or restarting
+    return status_code == 429 or status_code >= 500
+
+
+def _not_sent(error):
+    """Whether the failed call certainly never reached the provider."""
+    if httpx is not None and isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # Refused or unresolvable; a reused connection dropped mid-request may have been processed
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def may_resend(method, status_code=None, error=None):
+    """
+    Whether a failed ``method`` call may be retried: always if idempotent,
+    else only if the provider turned it away (429, 503) or never got it.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    if status_code is not None:
+        return status_code in (429, 503)
+    return _not_sent(error)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The provider failed repeatedly; calls are refused until the breaker resets."""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failed calls and refuses
+    calls for ``reset_timeout`` seconds. After that a single trial call is
+    let through (half-open): success closes the breaker, failure opens it
+    for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'open' if time.monotonic() - self._opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._trial = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class RateLimiter:
+    """
+    Spaces calls at least ``1 / rate`` seconds apart, across all the
+    threads sharing it, so a batch job stays under the provider's rate
+    limit however many workers it runs. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class BaseProviderClient:
+    """Retry policy, circuit breaker and counters shared by the sync and async clients."""
+
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=10, max_retries=2, backoff=0.25,
+                 backoff_max=2, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'attempts': 0, 'retries': 0, 'errors': 0, 'rejected': 0, 'latency_ms': 0.0, 'max_latency_ms': 0.0}
+
+    def url(self, path):
+        return f'{self.base_url}/{path.lstrip("/")}'
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def _observe(self, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['attempts'] += 1
+            self._stats['latency_ms'] += elapsed
+            self._stats['max_latency_ms'] = max(self._stats['max_latency_ms'], elapsed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mean_latency_ms'] = stats['latency_ms'] / stats['attempts'] if stats['attempts'] else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def _admit(self):
+        self._count(requests=1)
+        if not self.breaker.allow():
+            self._count(rejected=1)
+            raise CircuitOpenError(f'{self.base_url} is failing, not calling it for now')
+
+    def _backoff_delay(self, attempt):
+        # Exponential backoff with full jitter, so retries from many workers spread out
+        self._count(retries=1)
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def _failed(self, error):
+        self._count(errors=1)
+        self.breaker.record_failure()
+        return error
+
+
+class ProviderClient(BaseProviderClient):
+    """
+    Pooled, timeout-bounded JSON client with retries, a circuit breaker
+    and counters (see stats()). Share one instance per process, e.g.
+    through nowpayments_client().
+    """
+
+    def __init__(self, base_url, pool_size=10, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.session = requests.Session()
+        # Retries are ours, so they count towards the breaker and the stats
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, headers=None, **kwargs):
+        """
+        Send a request and return the decoded JSON response. Raises a
+        requests RequestException (CircuitOpenError while the breaker is
+        open) once the retries are used up, or at once if the request
+        may not be resent (see may_resend()).
+        """
+        self._admit()
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, self.url(path), headers=headers, timeout=(self.connect_timeout, self.read_timeout), **kwargs
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error, resend = e, may_resend(method, error=e)
+            else:
+                if not is_retryable(response.status_code):
+                    self._observe(started)
+                    # The provider answered: a 4xx is our request's fault, not an outage
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.exceptions.HTTPError(f'{response.status_code} from {self.base_url}', response=response)
+                resend = may_resend(method, status_code=response.status_code)
+            self._observe(started)
+            if not resend or attempt == self.max_retries:
+                break
+            time.sleep(self._backoff_delay(attempt))
+        raise self._failed(error)
+
+    def post(self, path, payload, headers=None):
+        """POST ``payload`` as JSON, see request()."""
+        return self.request('POST', path, headers=headers, json=payload)
+
+    def get(self, path, params=None, headers=None):
+        """GET with query ``params``, see request()."""
+        return self.request('GET', path, headers=headers, params=params)
+
+
+class AsyncProviderClient(BaseProviderClient):
+    """
+    ProviderClient for async views, on an httpx.AsyncClient: waiting on
+    the provider doesn't hold a thread, so one ASGI worker can keep
+    hundreds of calls in flight. Bound to the event loop it is used on,
+    see async_nowpayments_client().
+    """
+
+    def __init__(self, base_url, pool_size=100, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def post(self, path, payload, headers=None):
+        """As ProviderClient.post(); failures raise httpx errors or CircuitOpenError."""
+        self._admit()
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(self.url(path), json=payload, headers=headers)
+            except httpx.TransportError as e:
+                error, resend = e, may_resend('POST', error=e)
+            else:
+                if not is_retryable(response.status_code):
+                    self._observe(started)
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(
+                    f'{response.status_code} from {self.base_url}', request=response.request, response=response
+                )
+                resend = may_resend('POST', status_code=response.status_code)
+            self._observe(started)
+            if not resend or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._backoff_delay(attempt))
+        raise self._failed(error)
+
+
+def _client_options():
+    return {
+        'connect_timeout': getattr(settings, 'NOWPAYMENTS_CONNECT_TIMEOUT', 3.05),
+        'read_timeout': getattr(settings, 'NOWPAYMENTS_READ_TIMEOUT', 10),
+        'max_retries': getattr(settings, 'NOWPAYMENTS_MAX_RETRIES', 2),
+        'backoff': getattr(settings, 'NOWPAYMENTS_RETRY_BACKOFF', 0.25),
+        'breaker': CircuitBreaker(
+            failure_threshold=getattr(settings, 'NOWPAYMENTS_CIRCUIT_FAILURES', 5),
+            reset_timeout=getattr(settings, 'NOWPAYMENTS_CIRCUIT_RESET', 30),
+        ),
+    }
+
+
+def _api_url():
+    return getattr(settings, 'NOWPAYMENTS_API_URL', 'https://api.nowpayments.io/v1')
+
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def nowpayments_client():
+    """The process-wide client for settings.NOWPAYMENTS_API_URL."""
+    base_url = _api_url()
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ProviderClient(
+                base_url, pool_size=getattr(settings, 'NOWPAYMENTS_POOL_SIZE', 10), **_client_options()
+            )
+    return client
+
+
+def async_nowpayments_client():
+    """
+    The running event loop's async client for settings.NOWPAYMENTS_API_URL,
+    or None without httpx. Under ASGI there is one loop per worker process;
+    async views served over WSGI get a short-lived loop per request.
+    """
+    if httpx is None:
+        return None
+    base_url = _api_url()
+    with _clients_lock:
+        clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(base_url)
+        if client is None:
+            client = clients[base_url] = AsyncProviderClient(
+                base_url, pool_size=getattr(settings, 'NOWPAYMENTS_ASYNC_POOL_SIZE', 100), **_client_options()
+            )
+    return client
@@ -0,0 +1,113 @@
+"""
+Durable inbox for NOWPayments webhooks.
+
+payment_webhook only verifies a notification and appends it here with a
+single INSERT ... ON CONFLICT DO NOTHING, so provider retries are dropped
+by the unique (payment_id, payment_status) constraint and the provider
+gets its 200 right away. process_notifications() (the
+process_payment_notifications command) applies them to orders later, in
+batches, with conditional UPDATEs that never move an order back to an
+earlier payment status. A payment for an order whose reservation has
+already run out only marks it paid if its units can be taken off stock
+again; otherwise it is recorded as paid_after_release, for staff to
+refund or fulfil by hand.
+"""
+import logging
+from django.db import transaction
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.orders.services import reclaim_stock, release_reservation
+
+from .models import PAID_STATUSES, PAYMENT_STATUS_RANK, PaymentNotification
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def record_notification(data):
+    """Append a verified webhook payload; duplicates are silently dropped."""
+    notification = PaymentNotification(
+        payment_id=str(data['payment_id']),
+        payment_status=str(data.get('payment_status', '')),
+        order_id=str(data.get('order_id', '')),
+        payload=data,
+    )
+    PaymentNotification.objects.bulk_create([notification], ignore_conflicts=True)
+
+
+def _earlier_statuses(payment_status):
+    rank = PAYMENT_STATUS_RANK.get(payment_status, 0)
+    return [''] + [status for status, other in PAYMENT_STATUS_RANK.items() if other < rank]
+
+
+def apply_notification(notification):
+    """Apply one notification to its order; returns the outcome to record."""
+    status = notification.payment_status
+    if not (notification.order_id.isascii() and notification.order_id.isdigit()):
+        return 'unknown_order'
+    # Only moves forward: e.g. 'confirmed' arriving after 'finished' matches nothing
+    order = Order.objects.filter(pk=notification.order_id, payment_status__in=_earlier_statuses(status))
+    now = timezone.now()
+
+    if status in PAID_STATUSES:
+        paid = {
+            'payment_status': status, 'paid': True, 'status': 'paid', 'nowpayments_id': notification.payment_id,
+            'reserved_until': None, 'updated_at': now,
+        }
+        # A paid order keeps the stock it reserved for good
+        applied = order.exclude(status='cancelled').update(**paid)
+        if not applied and order.filter(status='cancelled').exists():
+            return _paid_after_release(order, paid, int(notification.order_id))
+    elif status in ('failed', 'expired'):
+        applied = order.filter(paid=False).update(payment_status=status, status='cancelled', updated_at=now)
+        if applied:
+            # Returns the reserved stock, at most once
+            release_reservation(Order(pk=int(notification.order_id)))
+    else:
+        applied = order.update(payment_status=status, updated_at=now)
+    if applied:
+        return 'applied'
+    return 'stale' if Order.objects.filter(pk=notification.order_id).exists() else 'unknown_order'
+
+
+def _paid_after_release(order, paid, order_id):
+    """
+    Apply a payment to a cancelled order whose stock went back: paid if
+    its units are still in stock, else only the payment is recorded.
+    """
+    with transaction.atomic():
+        # Locks the order: a concurrent notification waits, then finds it paid
+        if not order.filter(status='cancelled').update(**paid):
+            return 'stale'
+        if reclaim_stock(Order(pk=order_id)):
+            return 'applied'
+        Order.objects.filter(pk=order_id).update(paid=False, status='cancelled')
+    return 'paid_after_release'
+
+
+def process_notifications(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply one batch of pending notifications in arrival order and mark
+    them processed; returns how many were processed. Rows are claimed with
+    SELECT ... FOR UPDATE SKIP LOCKED, so several workers can drain the
+    inbox at once. Each notification is applied in its own savepoint: one
+    that fails is rolled back alone and recorded with the 'error' outcome,
+    so it can't hold up the rest of the inbox.
+    """
+    with transaction.atomic():
+        batch = list(
+            PaymentNotification.objects.filter(processed_at__isnull=True)
+            .order_by('id').select_for_update(skip_locked=True)[:batch_size]
+        )
+        now = timezone.now()
+        for notification in batch:
+            try:
+                with transaction.atomic():
+                    notification.outcome = apply_notification(notification)
+            except Exception:
+                logger.exception('Could not apply payment notification %s', notification.pk)
+                notification.outcome = 'error'
+            notification.processed_at = now
+        PaymentNotification.objects.bulk_update(batch, ['outcome', 'processed_at'])
+    return len(batch)
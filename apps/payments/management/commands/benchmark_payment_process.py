@@ -0,0 +1,176 @@
+import asyncio
+import io
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from apps.orders.models import Order
+from apps.payments.client import httpx
+from apps.payments.stub import StubProvider
+
+HOST = 'testserver'
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test invoice creation against a local stub provider: sync payment_process on WSGI '
+        'worker threads vs payment_process_async on one ASGI event loop'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument(
+            '--concurrency', type=int, default=50,
+            help="Clients with a request in flight; keep it below the database's max_connections, as every "
+                 "in-flight async request holds a connection in its request thread",
+        )
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stub provider takes per invoice')
+
+    def handle(self, *args, **options):
+        invoice = {'id': '1', 'invoice_url': 'https://nowpayments.io/payment/?iid=1'}
+        orders, sessions = [], []
+        try:
+            with StubProvider((200, invoice, options['latency'])) as stub, override_settings(
+                NOWPAYMENTS_API_URL=stub.url, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST], CHECKOUT_ADMISSION_LIMIT=0,
+            ):
+                self.stdout.write(
+                    f"{options['requests']} requests, {options['concurrency']} concurrent clients, "
+                    f"provider latency {options['latency'] * 1000:.0f} ms, "
+                    f"async client: {'httpx' if httpx else 'threads (httpx not installed)'}"
+                )
+                for label, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                    keys = self.checkouts(options['requests'], orders, sessions)
+                    calls = len(stub.requests)
+                    started = time.perf_counter()
+                    latencies, statuses = run(keys, options)
+                    self.report(label, time.perf_counter() - started, latencies, statuses, len(stub.requests) - calls)
+        finally:
+            Order.objects.filter(pk__in=orders).delete()
+            Session.objects.filter(session_key__in=sessions).delete()
+
+    def checkouts(self, count, orders, sessions):
+        """Session keys of ``count`` fresh unpaid orders."""
+        created = Order.objects.bulk_create(
+            Order(first_name='Load', last_name='Test', email='load@example.com', total_cost=100, item_count=1)
+            for _ in range(count)
+        )
+        keys = []
+        for order in created:
+            session = SessionStore()
+            session['order_id'] = order.pk
+            session.create()
+            orders.append(order.pk)
+            sessions.append(session.session_key)
+            keys.append(session.session_key)
+        return keys
+
+    def run_wsgi(self, keys, options):
+        """``concurrency`` clients sharing ``threads`` sync workers, as behind a WSGI server."""
+        handler, path = WSGIHandler(), reverse('payments:process')
+        pending = iter(keys)
+        lock = threading.Lock()
+        latencies, statuses = [], Counter()
+
+        def serve(key):
+            try:
+                return self.wsgi_request(handler, path, key)
+            finally:
+                connections.close_all()
+
+        def client(workers):
+            while True:
+                with lock:
+                    key = next(pending, None)
+                if key is None:
+                    return
+                started = time.perf_counter()
+                # Queued FIFO until a worker thread is free
+                status = workers.submit(serve, key).result()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    statuses[status] += 1
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as workers:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+                for _ in range(options['concurrency']):
+                    clients.submit(client, workers)
+        return latencies, statuses
+
+    def wsgi_request(self, handler, path, session_key):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'SERVER_NAME': HOST, 'SERVER_PORT': '443', 'HTTP_HOST': HOST, 'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_COOKIE': f'{settings.SESSION_COOKIE_NAME}={session_key}',
+            'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        status = []
+        response = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+        b''.join(response)
+        response.close()
+        return int(status[0].split()[0])
+
+    def run_asgi(self, keys, options):
+        """``concurrency`` clients on a single event loop, as one ASGI worker."""
+        handler, path = ASGIHandler(), reverse('payments:process_async')
+        latencies, statuses = [], Counter()
+
+        async def client(pending):
+            for key in pending:
+                started = time.perf_counter()
+                statuses[await self.asgi_request(handler, path, key)] += 1
+                latencies.append(time.perf_counter() - started)
+
+        async def main():
+            pending = iter(keys)
+            await asyncio.gather(*(client(pending) for _ in range(options['concurrency'])))
+
+        asyncio.run(main())
+        connections.close_all()
+        return latencies, statuses
+
+    async def asgi_request(self, handler, path, session_key):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'https', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', HOST.encode()), (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode())],
+            'client': ('127.0.0.1', 0), 'server': (HOST, 443),
+        }
+        messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+        done = asyncio.Event()
+        status = []
+
+        async def receive():
+            message = next(messages, None)
+            if message is None:
+                await done.wait()
+                return {'type': 'http.disconnect'}
+            return message
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await handler(scope, receive, send)
+        done.set()
+        return status[0]
+
+    def report(self, label, elapsed, latencies, statuses, provider_calls):
+        latencies = sorted(latency * 1000 for latency in latencies)
+        self.stdout.write(
+            f'{label}: {len(latencies) / elapsed:8.1f} req/s  p50 {statistics.median(latencies):8.1f} ms  '
+            f'p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:8.1f} ms  '
+            f'statuses {dict(statuses)}  provider calls {provider_calls}'
+        )
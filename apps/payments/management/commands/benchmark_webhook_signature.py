@@ -0,0 +1,66 @@
+import hashlib
+import hmac
+import json
+import time
+from django.core.management.base import BaseCommand
+from apps.payments.services import NowPaymentsService, orjson, parse_json
+
+PAYLOAD = {
+    'payment_id': 5077125051,
+    'invoice_id': 4511223344,
+    'payment_status': 'finished',
+    'pay_address': 'bc1qxy2kgdygjrsqtzq2n0yrf2493p83kkfjhx0wlh',
+    'price_amount': 189.99,
+    'price_currency': 'usd',
+    'pay_amount': 0.00268613,
+    'actually_paid': 0.00268613,
+    'actually_paid_at_fiat': 0,
+    'pay_currency': 'btc',
+    'order_id': '1042',
+    'order_description': 'Order #1042',
+    'purchase_id': '5837122679',
+    'outcome_amount': 0.00261437,
+    'outcome_currency': 'btc',
+    'payin_extra_id': None,
+    'fee': {'currency': 'btc', 'depositFee': 0, 'withdrawalFee': 0, 'serviceFee': 0},
+    'created_at': '2026-10-18T09:12:44.103Z',
+    'updated_at': '2026-10-18T09:31:02.871Z',
+}
+
+
+def legacy_check(service, body, signature):
+    # What payment_webhook did before: parse, sort, re-serialize, sign
+    data = json.loads(body)
+    sorted_msg = json.dumps(dict(sorted(data.items())), separators=(',', ':'), sort_keys=True)
+    digest = hmac.new(str(service.ipn_secret).encode(), sorted_msg.encode(), hashlib.sha512)
+    return hmac.compare_digest(digest.hexdigest(), signature)
+
+
+def current_check(service, body, signature):
+    return service.check_signature(parse_json(body), signature, body=body)
+
+
+class Command(BaseCommand):
+    help = 'Webhook signature verifications per second (parse + verify), before and after raw-body verification'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        service = NowPaymentsService()
+        canonical = json.dumps(PAYLOAD, separators=(',', ':'), sort_keys=True).encode()
+        signature = hmac.new(str(service.ipn_secret).encode(), canonical, hashlib.sha512).hexdigest()
+        # As the provider may send it: the signed form, or the same payload unsorted and spaced
+        bodies = {'canonical body': canonical, 'unsorted body': json.dumps(PAYLOAD, indent=1).encode()}
+
+        self.stdout.write(f'orjson: {"yes" if orjson else "no"}; {options["iterations"]} verifications each')
+        for label, body in bodies.items():
+            rates = {}
+            for name, check in (('legacy', legacy_check), ('current', current_check)):
+                assert check(service, body, signature), f'{name} rejected a valid {label}'
+                started = time.perf_counter()
+                for _ in range(options['iterations']):
+                    check(service, body, signature)
+                rates[name] = options['iterations'] / (time.perf_counter() - started)
+                self.stdout.write(f'{label:>15} {name:>8}: {rates[name]:10.0f} verifications/s')
+            self.stdout.write(self.style.SUCCESS(f'{label:>15}  speedup: {rates["current"] / rates["legacy"]:.2f}x'))
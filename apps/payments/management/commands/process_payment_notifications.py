@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.payments.inbox import DEFAULT_BATCH_SIZE, process_notifications
+
+class Command(BaseCommand):
+    help = 'Apply pending payment webhooks from the inbox to their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep draining, sleeping --interval seconds when idle')
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_notifications(batch_size=options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} payment notifications.'))
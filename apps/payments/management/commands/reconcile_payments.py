@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from apps.payments import reconcile
+
+class Command(BaseCommand):
+    help = "Poll the provider for stale pending orders' payments and apply any update a lost webhook would have made"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=reconcile.DEFAULT_STALE_AFTER,
+                            help='Seconds an order must have been unchanged')
+        parser.add_argument('--max-age', type=int, default=reconcile.DEFAULT_MAX_AGE,
+                            help='Seconds after which an order is no longer polled')
+        parser.add_argument('--workers', type=int, default=reconcile.DEFAULT_WORKERS)
+        parser.add_argument('--rate', type=float, default=reconcile.DEFAULT_RATE,
+                            help='Provider calls per second, across all workers (0: unlimited)')
+        parser.add_argument('--chunk-size', type=int, default=reconcile.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--limit', type=int, help='Check at most this many orders in this run')
+
+    def handle(self, *args, **options):
+        stats = reconcile.reconcile_payments(
+            stale_after=options['stale_after'], max_age=options['max_age'], workers=options['workers'],
+            rate=options['rate'], chunk_size=options['chunk_size'], limit=options['limit'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {stats['checked']} orders: {stats['found']} payment statuses found, "
+            f"{stats['processed']} notifications processed, {stats['errors']} lookups failed."
+        ))
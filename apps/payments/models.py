@@ -0,0 +1,45 @@
+from django.db import models
+
+# NOWPayments statuses in the order a payment moves through them; a
+# notification never moves an order back to an earlier rank
+PAYMENT_STATUS_RANK = {
+    'waiting': 1,
+    'confirming': 2,
+    'confirmed': 3,
+    'sending': 4,
+    'partially_paid': 4,
+    'finished': 5,
+    'failed': 5,
+    'expired': 5,
+    'refunded': 6,
+}
+
+# Statuses that mark the order paid
+PAID_STATUSES = ('finished', 'confirmed')
+
+
+# Append-only inbox of verified payment webhooks, drained by the
+# process_payment_notifications command (see apps.payments.inbox)
+class PaymentNotification(models.Model):
+    payment_id = models.CharField(max_length=100)
+    payment_status = models.CharField(max_length=30)
+    order_id = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # What processing did: applied, stale (out of order), unknown_order,
+    # paid_after_release (the order's stock was gone; refund or fulfil it by
+    # hand) or error (applying it failed, see the logs)
+    outcome = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        constraints = [
+            # Provider retries of the same notification are dropped on insert
+            models.UniqueConstraint(fields=['payment_id', 'payment_status'], name='paymentnotification_unique_status'),
+        ]
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='paymentnotification_pending'),
+        ]
+
+    def __str__(self):
+        return f'{self.payment_id}: {self.payment_status} (order {self.order_id})'
@@ -0,0 +1,105 @@
+"""
+Reconciliation of orders whose payment webhooks never arrived.
+
+Pending orders that have a NOWPayments payment or invoice and haven't
+changed for a while are looked up in the provider's status API, a chunk
+at a time: the lookups run on a bounded thread pool behind a shared rate
+limiter, and the statuses found are written to the webhook inbox with one
+bulk INSERT per chunk. process_notifications() then applies them exactly
+as it applies webhooks (forward only, stock released at most once), and
+statuses the inbox already holds are dropped by its unique constraint.
+Worker threads only make HTTP calls, so they hold no DB connections.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from apps.orders.models import Order
+
+from .client import TRANSPORT_ERRORS, RateLimiter
+from .inbox import process_notifications
+from .models import PAID_STATUSES, PAYMENT_STATUS_RANK, PaymentNotification
+from .services import NowPaymentsService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STALE_AFTER = 60 * 30
+DEFAULT_MAX_AGE = 60 * 60 * 24 * 3
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 10
+DEFAULT_CHUNK_SIZE = 500
+
+
+def stale_orders(stale_after=DEFAULT_STALE_AFTER, max_age=DEFAULT_MAX_AGE, now=None):
+    """
+    Pending orders with a payment or invoice, unchanged for ``stale_after``
+    seconds and created less than ``max_age`` seconds ago (older ones are
+    given up on rather than polled on every run).
+    """
+    now = now or timezone.now()
+    return Order.objects.filter(
+        status='pending', updated_at__lt=now - timedelta(seconds=stale_after),
+        created_at__gte=now - timedelta(seconds=max_age),
+    ).filter(Q(nowpayments_id__gt='') | Q(invoice_id__gt=''))
+
+
+def _latest(payments):
+    """
+    The payment that decides the order, or None: a paid one if any (an
+    invoice can also have expired or failed attempts), else the one
+    furthest along, the most recently updated on a tie.
+    """
+    def key(payment):
+        status = payment.get('payment_status')
+        return status in PAID_STATUSES, PAYMENT_STATUS_RANK.get(status, 0), payment.get('updated_at') or ''
+    return max(payments, key=key, default=None)
+
+
+def _lookup(service, limiter, order_id, payment_id, invoice_id):
+    limiter.wait()
+    try:
+        if payment_id:
+            return order_id, service.get_payment(payment_id), False
+        return order_id, _latest(service.get_invoice_payments(invoice_id)), False
+    except TRANSPORT_ERRORS as e:
+        logger.warning('Could not reconcile order %s: %s', order_id, e)
+        return order_id, None, True
+
+
+def reconcile_payments(stale_after=DEFAULT_STALE_AFTER, max_age=DEFAULT_MAX_AGE, workers=DEFAULT_WORKERS,
+                       rate=DEFAULT_RATE, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """
+    Look up every stale order's payment (at most ``limit`` orders) with
+    ``workers`` threads and at most ``rate`` calls per second, record what
+    was found in the inbox and apply it. Orders are read a chunk at a
+    time, in primary key order, so memory use doesn't grow with the
+    backlog. Returns counts of orders checked, statuses found, lookups
+    that failed and inbox notifications processed.
+    """
+    service = NowPaymentsService()
+    limiter = RateLimiter(rate)
+    orders = stale_orders(stale_after, max_age).order_by('pk').values_list('pk', 'nowpayments_id', 'invoice_id')
+    stats = {'checked': 0, 'found': 0, 'errors': 0, 'processed': 0}
+    last_pk = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while limit is None or stats['checked'] < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - stats['checked'])
+            chunk = list(orders.filter(pk__gt=last_pk)[:size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            notifications = []
+            for order_id, payment, failed in executor.map(lambda row: _lookup(service, limiter, *row), chunk):
+                stats['errors'] += failed
+                if payment and payment.get('payment_id') and payment.get('payment_status'):
+                    notifications.append(PaymentNotification(
+                        payment_id=str(payment['payment_id']), payment_status=str(payment['payment_status']),
+                        order_id=str(order_id), payload=payment,
+                    ))
+            PaymentNotification.objects.bulk_create(notifications, ignore_conflicts=True)
+            stats['checked'] += len(chunk)
+            stats['found'] += len(notifications)
+            while processed := process_notifications():
+                stats['processed'] += processed
+    return stats
@@ -1,17 +1,77 @@
 import json
 import hmac
 import hashlib
-import requests
+import logging
+import uuid
+from datetime import timedelta
+from functools import lru_cache
+from itertools import chain
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from apps.orders.models import Order
+from .client import TRANSPORT_ERRORS, async_nowpayments_client, nowpayments_client
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# How long a request may take to create an invoice before another may try
+INVOICE_CLAIM_TIMEOUT = 60
+
+INVOICE_FIELDS = ['invoice_id', 'invoice_url', 'invoice_expires_at', 'invoice_key']
+
+
+@lru_cache(maxsize=None)
+def _warn_sync_fallback():
+    # Once per process: the async view was chosen, but each invoice still blocks a thread
+    if settings.PAYMENTS_ASYNC:
+        logger.warning('PAYMENTS_ASYNC is on but httpx is not installed; invoices are created in threads')
+
+
+class InvoicePending(Exception):
+    """Another request is creating this order's invoice right now."""
+
+
+def parse_json(body):
+    """Decode a JSON request body, with orjson when installed; raises ValueError."""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def canonical_json(data):
+    """
+    Yield the candidate signed forms of ``data``: compact JSON with keys
+    sorted at every level, each serialized in a single pass. The orjson
+    form (when installed) writes numbers and non-ASCII text the way the
+    provider's JSON.stringify does; the json.dumps form is the one this
+    service has always accepted. The second is only built if the first
+    didn't match, and only yielded if it differs.
+    """
+    fast = None
+    if orjson is not None:
+        try:
+            fast = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except orjson.JSONEncodeError:
+            pass
+        else:
+            yield fast
+    legacy = json.dumps(data, separators=(',', ':'), sort_keys=True).encode()
+    if legacy != fast:
+        yield legacy
+
 
 class NowPaymentsService:
-    API_URL = 'https://api.nowpayments.io/v1/invoice'
-    
     def __init__(self):
         self.api_key = settings.NOWPAYMENTS_API_KEY
         self.ipn_secret = settings.NOWPAYMENTS_IPN_SECRET
+        # Pooled, with timeouts, retries and a circuit breaker (see apps.payments.client)
+        self.client = nowpayments_client()
 
-    def create_invoice(self, order_id, amount, currency='usd', description='', success_url=None, cancel_url=None):
+    def _invoice_request(self, order_id, amount, currency, description, success_url, cancel_url):
         headers = {
             'x-api-key': self.api_key,
             'Content-Type': 'application/json'
@@ -30,44 +90,148 @@ class NowPaymentsService:
             payload['success_url'] = success_url
         if cancel_url:
             payload['cancel_url'] = cancel_url
-        
+        return payload, headers
+
+    def _log_error(self, order_id, e):
+        response = getattr(e, 'response', None)
+        logger.warning('NOWPayments API error for order %s: %s%s', order_id, e, f' ({response.text})' if response is not None else '')
+
+    def create_invoice(self, order_id, amount, currency='usd', description='', success_url=None, cancel_url=None):
+        payload, headers = self._invoice_request(order_id, amount, currency, description, success_url, cancel_url)
+        try:
+            return self.client.post('invoice', payload, headers=headers)
+        except TRANSPORT_ERRORS as e:
+            self._log_error(order_id, e)
+            return None
+
+    async def acreate_invoice(self, order_id, amount, currency='usd', description='', success_url=None, cancel_url=None):
+        """create_invoice() on the event loop's async client (in a thread without httpx)."""
+        client = async_nowpayments_client()
+        if client is None:
+            _warn_sync_fallback()
+            return await sync_to_async(self.create_invoice, thread_sensitive=False)(
+                order_id, amount, currency, description, success_url, cancel_url
+            )
+        payload, headers = self._invoice_request(order_id, amount, currency, description, success_url, cancel_url)
         try:
-            response = requests.post(self.API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            # Log error
-            print(f"NOWPayments API Error: {e}")
-            if response:
-                print(f"Response: {response.text}")
+            return await client.post('invoice', payload, headers=headers)
+        except TRANSPORT_ERRORS as e:
+            self._log_error(order_id, e)
             return None
 
-    def check_signature(self, request_data, signature):
+    def get_payment(self, payment_id):
+        """The provider's current state of a payment; raises TRANSPORT_ERRORS."""
+        return self.client.get(f'payment/{payment_id}', headers={'x-api-key': self.api_key})
+
+    def get_invoice_payments(self, invoice_id):
+        """The payments made against an invoice (often none); raises TRANSPORT_ERRORS."""
+        response = self.client.get('payment/', params={'invoiceId': invoice_id}, headers={'x-api-key': self.api_key})
+        return response.get('data', [])
+
+    # invoice_url_for() and its async twin share these steps
+
+    def _valid_invoice_url(self, order, now):
+        if order.invoice_url and order.invoice_expires_at and order.invoice_expires_at > now:
+            return order.invoice_url
+        return None
+
+    def _claimable(self, order, now):
+        return Order.objects.filter(Q(invoice_expires_at__isnull=True) | Q(invoice_expires_at__lte=now), pk=order.pk)
+
+    def _claim(self, now, key):
+        return {
+            'invoice_key': key, 'invoice_id': '', 'invoice_url': '',
+            'invoice_expires_at': now + timedelta(seconds=INVOICE_CLAIM_TIMEOUT),
+        }
+
+    def _invoice_kwargs(self, order, success_url, cancel_url):
+        return {
+            'order_id': order.id,
+            'amount': order.total_cost,
+            'currency': order.currency,
+            'description': f'Order {order.id}',
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+        }
+
+    def _stored_invoice(self, order, response, now, key):
+        """The fields to store for a created invoice (also set on ``order``)."""
+        expires_at = now + timedelta(seconds=getattr(settings, 'NOWPAYMENTS_INVOICE_TTL', 60 * 20))
+        if order.reserved_until:
+            # Paying after the stock went back would oversell
+            expires_at = min(expires_at, order.reserved_until)
+        fields = {'invoice_id': str(response.get('id', '')), 'invoice_url': response['invoice_url'], 'invoice_expires_at': expires_at}
+        for name, value in fields.items():
+            setattr(order, name, value)
+        order.invoice_key = key
+        return fields
+
+    def invoice_url_for(self, order, success_url=None, cancel_url=None):
         """
-        Verify the IPN signature from NOWPayments.
+        URL of a still valid invoice for ``order``. The invoice is created
+        only if the order has none or it expired, by the one request that
+        claims the order's idempotency key with a conditional UPDATE; a
+        concurrent request (refresh, double submit) gets the stored invoice,
+        or InvoicePending while it is being created. Returns None if the
+        provider call failed, after which the next request may retry.
+        """
+        now = timezone.now()
+        if self._valid_invoice_url(order, now):
+            return order.invoice_url
+
+        key = uuid.uuid4()
+        if not self._claimable(order, now).update(**self._claim(now, key)):
+            order.refresh_from_db(fields=INVOICE_FIELDS)
+            if order.invoice_url:
+                return order.invoice_url
+            raise InvoicePending(f'Invoice for order {order.pk} is being created')
+
+        response = self.create_invoice(**self._invoice_kwargs(order, success_url, cancel_url))
+        # Only the claim holder may store (or give up) the invoice
+        claim = Order.objects.filter(pk=order.pk, invoice_key=key)
+        if not response or 'invoice_url' not in response:
+            claim.update(invoice_expires_at=None)
+            return None
+        claim.update(**self._stored_invoice(order, response, now, key))
+        return order.invoice_url
+
+    async def ainvoice_url_for(self, order, success_url=None, cancel_url=None):
+        """invoice_url_for() with the async ORM and acreate_invoice()."""
+        now = timezone.now()
+        if self._valid_invoice_url(order, now):
+            return order.invoice_url
+
+        key = uuid.uuid4()
+        if not await self._claimable(order, now).aupdate(**self._claim(now, key)):
+            await order.arefresh_from_db(fields=INVOICE_FIELDS)
+            if order.invoice_url:
+                return order.invoice_url
+            raise InvoicePending(f'Invoice for order {order.pk} is being created')
+
+        response = await self.acreate_invoice(**self._invoice_kwargs(order, success_url, cancel_url))
+        claim = Order.objects.filter(pk=order.pk, invoice_key=key)
+        if not response or 'invoice_url' not in response:
+            await claim.aupdate(invoice_expires_at=None)
+            return None
+        await claim.aupdate(**self._stored_invoice(order, response, now, key))
+        return order.invoice_url
+
+    def check_signature(self, request_data, signature, body=None):
+        """
+        Verify the IPN signature from NOWPayments: the HMAC-SHA512, keyed
+        with the IPN secret, of the payload as compact JSON with sorted keys.
+        Pass the raw request ``body`` too when there is one; if the provider
+        sent the payload already in that form it is checked as is, without
+        serializing anything (see canonical_json() for the fallback).
         """
         if not signature:
             return False
-            
-        # Sort the dictionary by keys
-        sorted_data = dict(sorted(request_data.items()))
-        
-        # Convert to JSON string with separators and no spaces, sorted keys
-        # Python's json.dumps with sort_keys=True matches the requirement fairly well,
-        # but exact format matters. Docs say:
-        # JSON.stringify (params, Object.keys(params).sort())
-        # Python example in docs:
-        # sorted_msg = json.dumps(message, separators=(',', ':'), sort_keys=True)
-        
-        # We need to filter out 'x-nowpayments-sig' if it's in the data (usually it's in header)
-        
-        sorted_msg = json.dumps(sorted_data, separators=(',', ':'), sort_keys=True)
-        
-        digest = hmac.new(
-            str(self.ipn_secret).encode(),
-            sorted_msg.encode(),
-            hashlib.sha512
+        key = str(self.ipn_secret).encode()
+        signature = signature.encode()
+        messages = canonical_json(request_data)
+        if body:
+            messages = chain((body,), messages)
+        return any(
+            hmac.compare_digest(hmac.new(key, message, hashlib.sha512).hexdigest().encode(), signature)
+            for message in messages
         )
-        calculated_signature = digest.hexdigest()
-        
-        return hmac.compare_digest(calculated_signature, signature)
@@ -0,0 +1,70 @@
+"""
+A local stand-in for the NOWPayments API, for tests and load tests.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+
+class StubProvider:
+    """
+    Local HTTP server standing in for NOWPayments: answers each request
+    with the next scripted (status, body, delay) response, repeating the
+    last, unless its path (with the query string) is one of ``routes``.
+    """
+
+    def __init__(self, *responses, routes=None):
+        self.responses = list(responses)
+        self.routes = routes or {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, so pooled connections are reused
+
+            def do_POST(self):
+                self.respond(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+
+            def do_GET(self):
+                self.respond(None)
+
+            def respond(self, body):
+                stub.requests.append({
+                    'method': self.command, 'path': self.path, 'body': body, 'headers': dict(self.headers),
+                    'port': self.client_address[1],
+                })
+                if self.path in stub.routes:
+                    status, payload, delay = stub.routes[self.path]
+                else:
+                    status, payload, delay = stub.responses.pop(0) if len(stub.responses) > 1 else stub.responses[0]
+                time.sleep(delay)
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass # the client timed out and hung up
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,12 +1,33 @@
+import asyncio
+import io
 import json
 import hashlib
 import hmac
-from unittest.mock import patch
-from django.test import TestCase, Client, RequestFactory
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
+import requests
+from datetime import timedelta
+from django.core.management import call_command
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.utils import timezone
 from django.urls import reverse
 from django.conf import settings
+from decimal import Decimal
+from apps.catalog.models import Product, ProductSize
 from apps.orders.models import Order
-from .services import NowPaymentsService
+from apps.orders.services import place_order, release_reservation
+from . import inbox
+from .inbox import process_notifications
+from .models import PaymentNotification
+from .checks import check_async_client
+from .client import AsyncProviderClient, CircuitBreaker, CircuitOpenError, ProviderClient, RateLimiter, httpx
+from .reconcile import _latest, reconcile_payments
+from .services import NowPaymentsService, orjson, parse_json
+from .stub import StubProvider
+
+INVOICE = (200, {'id': '42', 'invoice_url': 'https://nowpayments.io/payment/?iid=42'}, 0)
 
 class PaymentServiceTest(TestCase):
     def setUp(self):
@@ -16,15 +37,20 @@ class PaymentServiceTest(TestCase):
             address='Street', postal_code='123', city='City'
         )
 
-    @patch('requests.post')
-    def test_create_invoice(self, mock_post):
-        mock_response = {'invoice_url': 'https://nowpayments.io/payment/?iid=123'}
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = mock_response
-        
-        result = self.service.create_invoice(self.order.id, 100)
-        self.assertEqual(result, mock_response)
+    def test_create_invoice(self):
+        with StubProvider(INVOICE) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            result = NowPaymentsService().create_invoice(self.order.id, 100)
+        self.assertEqual(result, INVOICE[1])
+        request = stub.requests[0]
+        self.assertEqual(request['path'], '/v1/invoice')
+        self.assertEqual(request['body']['order_id'], str(self.order.id))
+        self.assertEqual(request['headers']['x-api-key'], str(settings.NOWPAYMENTS_API_KEY))
+
+    def test_create_invoice_failure_returns_none(self):
+        with StubProvider((400, {'message': 'bad'}, 0)) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            self.assertIsNone(NowPaymentsService().create_invoice(self.order.id, 100))
         
+
     def test_check_signature(self):
         secret = settings.NOWPAYMENTS_IPN_SECRET
         data = {'key': 'value', 'order_id': '1'}
@@ -37,6 +63,19 @@ class PaymentServiceTest(TestCase):
         self.assertTrue(self.service.check_signature(data, signature))
         self.assertFalse(self.service.check_signature(data, 'wrong_signature'))
 
+    def test_signature_of_the_raw_body(self):
+        # Signed as the provider serializes it: unescaped unicode, JavaScript-style exponents
+        body = '{"amount":1e-7,"order_id":"1","title":"Café"}'.encode()
+        signature = hmac.new(str(settings.NOWPAYMENTS_IPN_SECRET).encode(), body, hashlib.sha512).hexdigest()
+        self.assertTrue(self.service.check_signature(parse_json(body), signature, body=body))
+        if orjson is not None:
+            # Rebuilt in the provider's form when the body isn't canonical
+            spaced = json.dumps(json.loads(body), indent=2).encode()
+            self.assertTrue(self.service.check_signature(parse_json(spaced), signature, body=spaced))
+        tampered = body.replace(b'"1"', b'"2"')
+        self.assertFalse(self.service.check_signature(parse_json(tampered), signature, body=tampered))
+        self.assertFalse(self.service.check_signature(parse_json(body), 'é'))
+
 class PaymentWebhookTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -80,9 +119,335 @@ class PaymentWebhookTest(TestCase):
         )
         
         self.assertEqual(response.status_code, 200)
+        # The webhook is only recorded; the worker applies it
+        self.assertEqual(process_notifications(), 1)
         
         # Refresh order
         self.order.refresh_from_db()
         self.assertTrue(self.order.paid)
         self.assertEqual(self.order.status, 'paid')
         self.assertEqual(self.order.nowpayments_id, '12345')
+
+    def post_status(self, order, payment_status, payment_id='12345'):
+        payload = {'payment_status': payment_status, 'payment_id': payment_id, 'order_id': str(order.id)}
+        sorted_data = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+        signature = hmac.new(str(self.secret).encode(), sorted_data.encode(), hashlib.sha512).hexdigest()
+        return self.client.post(self.url, data=payload, content_type='application/json', HTTP_X_NOWPAYMENTS_SIG=signature)
+
+    def test_failed_payment_releases_stock(self):
+        product = Product.objects.create(name='Drop', price=Decimal('200.00'), description='')
+        size = ProductSize.objects.create(product=product, size='US 9', stock=1)
+        order = place_order(
+            Order(first_name='Test', last_name='User', email='test@test.com'),
+            [{'product_id': str(product.pk), 'size': 'US 9', 'quantity': 1}],
+        )
+        for _ in range(2):
+            self.assertEqual(self.post_status(order, 'expired').status_code, 200)
+        process_notifications()
+        size.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(size.stock, 1)
+        self.assertEqual((order.status, order.reserved_until), ('cancelled', None))
+
+    def test_payment_after_the_reservation_ran_out(self):
+        product = Product.objects.create(name='Drop', price=Decimal('200.00'), description='')
+        size = ProductSize.objects.create(product=product, size='US 9', stock=1)
+        lines = [{'product_id': str(product.pk), 'size': 'US 9', 'quantity': 1}]
+        late = place_order(Order(first_name='Late', last_name='User', email='late@test.com'), lines)
+        self.assertTrue(release_reservation(late))
+        # Someone else bought the unit meanwhile, then their reservation ran out too
+        other = place_order(Order(first_name='Other', last_name='User', email='other@test.com'), lines)
+        self.post_status(late, 'finished')
+        process_notifications()
+        self.assertTrue(release_reservation(other))
+        self.post_status(other, 'finished', payment_id='777')
+        process_notifications()
+
+        outcomes = dict(PaymentNotification.objects.values_list('payment_id', 'outcome'))
+        self.assertEqual(outcomes, {'12345': 'paid_after_release', '777': 'applied'})
+        late.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((late.paid, late.status, late.payment_status), (False, 'cancelled', 'finished'))
+        self.assertEqual((other.paid, other.status, other.reserved_until), (True, 'paid', None))
+        size.refresh_from_db()
+        self.assertEqual(size.stock, 0)
+
+
+    def test_webhook_only_appends_to_the_inbox(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.post_status(self.order, 'finished').status_code, 200)
+        for _ in range(3):
+            self.post_status(self.order, 'finished')
+        self.assertEqual(PaymentNotification.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.paid)
+
+    def test_out_of_order_notifications_are_ignored(self):
+        for status in ('waiting', 'finished', 'confirmed', 'confirming'):
+            self.post_status(self.order, status)
+        self.post_status(Order(pk=999999), 'finished', payment_id='999')
+        self.assertEqual(process_notifications(batch_size=2), 2)
+        self.assertEqual(process_notifications(), 3)
+        self.assertEqual(process_notifications(), 0)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.status, self.order.paid), ('finished', 'paid', True))
+        outcomes = dict(PaymentNotification.objects.values_list('payment_status', 'outcome').filter(payment_id='12345'))
+        self.assertEqual(outcomes, {'waiting': 'applied', 'finished': 'applied', 'confirmed': 'stale', 'confirming': 'stale'})
+        self.assertEqual(PaymentNotification.objects.get(payment_id='999').outcome, 'unknown_order')
+
+    @override_settings(NOWPAYMENTS_WEBHOOK_MAX_BYTES=64)
+    def test_oversized_or_malformed_body_is_rejected(self):
+        response = self.client.post(self.url, data={'padding': 'x' * 64}, content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post(self.url, data=b'{"a":"\xff"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentNotification.objects.exists())
+
+    def test_failure_after_payment_is_ignored(self):
+        self.post_status(self.order, 'finished')
+        self.post_status(self.order, 'expired')
+        process_notifications()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+    def test_failing_notification_does_not_block_the_inbox(self):
+        PaymentNotification.objects.create(payment_id='1', payment_status='finished', order_id='\u00b2', payload={})
+        self.post_status(self.order, 'waiting', payment_id='2')
+        self.post_status(self.order, 'finished', payment_id='3')
+        apply = inbox.apply_notification
+
+        def apply_or_fail(notification):
+            if notification.payment_id == '2':
+                raise RuntimeError('boom')
+            return apply(notification)
+
+        with mock.patch.object(inbox, 'apply_notification', apply_or_fail), self.assertLogs(inbox.logger, 'ERROR'):
+            self.assertEqual(process_notifications(), 3)
+        self.assertFalse(PaymentNotification.objects.filter(processed_at__isnull=True).exists())
+        outcomes = dict(PaymentNotification.objects.values_list('payment_id', 'outcome'))
+        self.assertEqual(outcomes, {'1': 'unknown_order', '2': 'error', '3': 'applied'})
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.paid)
+
+class ProviderClientTest(TestCase):
+    def client_for(self, stub, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return ProviderClient(stub.url, **kwargs)
+
+    def test_connections_are_pooled(self):
+        with StubProvider(INVOICE) as stub:
+            client = self.client_for(stub)
+            for _ in range(3):
+                client.post('invoice', {})
+        self.assertEqual(len({request['port'] for request in stub.requests}), 1)
+
+    def test_transient_errors_are_retried(self):
+        with StubProvider((503, {}, 0), (429, {}, 0), INVOICE) as stub:
+            client = self.client_for(stub, max_retries=2)
+            self.assertEqual(client.post('invoice', {}), INVOICE[1])
+        stats = client.stats()
+        self.assertEqual((stats['attempts'], stats['retries'], stats['errors']), (3, 2, 0))
+
+    def test_post_is_not_resent_once_the_provider_may_have_it(self):
+        # A POST timing out or failing with a 502 may still have created the invoice
+        with StubProvider((200, INVOICE[1], 0.3)) as stub:
+            client = self.client_for(stub, read_timeout=0.1, max_retries=2)
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                client.post('invoice', {})
+            time.sleep(0.3)
+            self.assertEqual(len(stub.requests), 1)
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                client.get('payment/1')
+            time.sleep(0.3)
+            self.assertEqual(len(stub.requests), 4)
+        with StubProvider((502, {}, 0), INVOICE) as stub:
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client_for(stub, max_retries=2).post('invoice', {})
+            self.assertEqual(len(stub.requests), 1)
+
+    def test_refused_connection_is_retried(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        client = ProviderClient(f'http://127.0.0.1:{port}/v1', backoff=0, max_retries=2)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.post('invoice', {})
+        self.assertEqual(client.stats()['attempts'], 3)
+
+    def test_slow_provider_is_cut_off(self):
+        with StubProvider((200, {}, 1)) as stub:
+            client = self.client_for(stub, read_timeout=0.1, max_retries=1)
+            started = time.monotonic()
+            with self.assertRaises(requests.exceptions.Timeout):
+                client.post('invoice', {})
+            self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(client.stats()['errors'], 1)
+
+    def test_circuit_breaker_fails_fast_then_recovers(self):
+        with StubProvider((500, {}, 0), (500, {}, 0), INVOICE) as stub:
+            client = self.client_for(stub, max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+            for _ in range(2):
+                with self.assertRaises(requests.exceptions.HTTPError):
+                    client.post('invoice', {})
+            with self.assertRaises(CircuitOpenError):
+                client.post('invoice', {})
+            self.assertEqual((len(stub.requests), client.stats()['circuit']), (2, 'open'))
+
+            time.sleep(0.25)
+            self.assertEqual(client.post('invoice', {}), INVOICE[1])
+        stats = client.stats()
+        self.assertEqual((stats['circuit'], stats['rejected'], stats['requests']), ('closed', 1, 4))
+
+
+
+class AsyncPaymentsCheckTest(TestCase):
+    @override_settings(PAYMENTS_ASYNC=True)
+    def test_async_payments_without_httpx_are_reported(self):
+        warnings = [warning.id for warning in check_async_client(None)]
+        self.assertEqual(warnings, [] if httpx else ['payments.W001'])
+        with self.settings(PAYMENTS_ASYNC=False):
+            self.assertEqual(check_async_client(None), [])
+
+@skipIf(httpx is None, 'httpx is not installed')
+class AsyncProviderClientTest(TestCase):
+    async def test_retries_then_pools_connections(self):
+        with StubProvider((503, {}, 0), INVOICE) as stub:
+            client = AsyncProviderClient(stub.url, backoff=0, max_retries=1)
+            for _ in range(2):
+                self.assertEqual(await client.post('invoice', {}), INVOICE[1])
+            await client.client.aclose()
+        self.assertEqual(client.stats()['retries'], 1)
+        self.assertEqual(len({request['port'] for request in stub.requests}), 1)
+
+    async def test_post_is_not_resent_after_a_read_timeout(self):
+        with StubProvider((200, INVOICE[1], 0.3)) as stub:
+            client = AsyncProviderClient(stub.url, backoff=0, max_retries=2, read_timeout=0.1)
+            with self.assertRaises(httpx.ReadTimeout):
+                await client.post('invoice', {})
+            await client.client.aclose()
+            await asyncio.sleep(0.3)
+        self.assertEqual(len(stub.requests), 1)
+
+class PaymentProcessTest(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Tee', price=Decimal('20.00'), description='')
+        self.order = place_order(
+            Order(first_name='Test', last_name='User', email='test@test.com'),
+            [{'product_id': str(product.pk), 'size': 'M', 'quantity': 2}],
+        )
+        session = self.client.session
+        session['order_id'] = self.order.pk
+        session.save()
+        self.url = reverse('payments:process')
+
+    def process(self):
+        return self.client.get(self.url)
+
+    def test_invoice_is_reused_until_it_expires(self):
+        renewed = (200, {'id': '43', 'invoice_url': 'https://nowpayments.io/payment/?iid=43'}, 0)
+        with StubProvider(INVOICE, renewed) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            for _ in range(3):
+                self.assertRedirects(self.process(), INVOICE[1]['invoice_url'], fetch_redirect_response=False)
+            self.assertEqual(len(stub.requests), 1)
+            self.order.refresh_from_db()
+            self.assertEqual(self.order.invoice_id, '42')
+            self.assertEqual(stub.requests[0]['body']['price_amount'], 40.0)
+
+            Order.objects.filter(pk=self.order.pk).update(invoice_expires_at=timezone.now() - timedelta(seconds=1))
+            self.assertRedirects(self.process(), renewed[1]['invoice_url'], fetch_redirect_response=False)
+            self.assertEqual(len(stub.requests), 2)
+
+    def test_failed_invoice_can_be_retried(self):
+        with StubProvider((400, {}, 0), INVOICE) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            self.assertContains(self.process(), 'Could not initiate payment.')
+            self.assertRedirects(self.process(), INVOICE[1]['invoice_url'], fetch_redirect_response=False)
+            self.assertEqual(len(stub.requests), 2)
+
+    def test_concurrent_request_waits_for_the_invoice_being_created(self):
+        Order.objects.filter(pk=self.order.pk).update(invoice_expires_at=timezone.now() + timedelta(seconds=30))
+        with StubProvider(INVOICE) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            self.assertContains(self.process(), 'being prepared')
+        self.assertEqual(stub.requests, [])
+
+    def test_paid_order_is_not_invoiced_again(self):
+        Order.objects.filter(pk=self.order.pk).update(paid=True, status='paid')
+        self.assertRedirects(self.process(), reverse('orders:payment_success'), fetch_redirect_response=False)
+
+    async def test_async_view_reuses_the_invoice(self):
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = self.client.session.session_key
+        url = reverse('payments:process_async')
+        with StubProvider(INVOICE) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            for _ in range(2):
+                response = await self.async_client.get(url)
+                self.assertRedirects(response, INVOICE[1]['invoice_url'], fetch_redirect_response=False)
+        self.assertEqual(len(stub.requests), 1)
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.invoice_url, INVOICE[1]['invoice_url'])
+
+
+class ReconcilePaymentsTest(TestCase):
+    def setUp(self):
+        self.orders = {}
+        for name, payment_id, invoice_id in (
+            ('paid', None, '101'), ('unpaid', None, '102'), ('erroring', None, '103'),
+            ('expired', 'p9', '104'), ('fresh', None, '105'), ('no_invoice', None, ''),
+        ):
+            self.orders[name] = Order.objects.create(
+                first_name='Test', last_name='User', email='test@test.com', nowpayments_id=payment_id, invoice_id=invoice_id,
+            )
+        stale = timezone.now() - timedelta(hours=1)
+        Order.objects.exclude(pk=self.orders['fresh'].pk).update(updated_at=stale)
+        payment = {'payment_id': 'p1', 'order_id': str(self.orders['paid'].pk)}
+        self.routes = {
+            '/v1/payment/?invoiceId=101': (200, {'data': [
+                # A first attempt expired; the second was paid
+                {**payment, 'payment_status': 'waiting'}, {**payment, 'payment_id': 'p0', 'payment_status': 'expired'},
+                {**payment, 'payment_status': 'finished'},
+            ]}, 0),
+            '/v1/payment/?invoiceId=102': (200, {'data': []}, 0),
+            '/v1/payment/?invoiceId=103': (500, {}, 0),
+            '/v1/payment/p9': (200, {'payment_id': 'p9', 'payment_status': 'expired'}, 0),
+        }
+
+    def status(self, name):
+        self.orders[name].refresh_from_db()
+        return self.orders[name].status
+
+    def test_stale_orders_are_updated_from_the_provider(self):
+        with StubProvider((404, {}, 0), routes=self.routes) as stub, \
+                override_settings(NOWPAYMENTS_API_URL=stub.url, NOWPAYMENTS_MAX_RETRIES=0):
+            out = io.StringIO()
+            call_command('reconcile_payments', '--workers', '4', '--chunk-size', '2', stdout=out)
+            self.assertIn('Checked 4 orders: 2 payment statuses found', out.getvalue())
+            self.assertCountEqual([request['path'] for request in stub.requests], list(self.routes))
+            self.assertEqual(stub.requests[0]['headers']['x-api-key'], str(settings.NOWPAYMENTS_API_KEY))
+
+            self.assertEqual(self.status('paid'), 'paid')
+            self.assertEqual((self.orders['paid'].payment_status, self.orders['paid'].nowpayments_id), ('finished', 'p1'))
+            self.assertEqual(self.status('expired'), 'cancelled')
+            for name in ('unpaid', 'erroring', 'fresh', 'no_invoice'):
+                self.assertEqual(self.status(name), 'pending')
+
+            # Paid and cancelled orders aren't polled again
+            self.assertEqual(reconcile_payments(), {'checked': 2, 'found': 0, 'errors': 1, 'processed': 0})
+
+    def test_latest_payment_of_an_invoice(self):
+        expired = {'payment_status': 'expired', 'updated_at': '2026-01-01T10:00:00.000Z'}
+        failed = {'payment_status': 'failed', 'updated_at': '2026-01-01T11:00:00.000Z'}
+        confirmed = {'payment_status': 'confirmed', 'updated_at': '2026-01-01T09:00:00.000Z'}
+        self.assertEqual(_latest([failed, expired]), failed)
+        self.assertEqual(_latest([expired, confirmed, failed]), confirmed)
+        self.assertIsNone(_latest([]))
+
+    def test_limit(self):
+        with StubProvider((404, {}, 0), routes=self.routes) as stub, override_settings(NOWPAYMENTS_API_URL=stub.url):
+            self.assertEqual(reconcile_payments(chunk_size=1, limit=2)['checked'], 2)
+            self.assertEqual(len(stub.requests), 2)
+
+    def test_rate_limiter_spaces_calls_across_threads(self):
+        limiter = RateLimiter(100)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: limiter.wait(), range(11)))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
@@ -5,5 +5,7 @@ app_name = 'payments'
 
 urlpatterns = [
     path('process/', views.payment_process, name='process'),
+    path('process/async/', views.payment_process_async, name='process_async'),
     path('webhook/', views.payment_webhook, name='webhook'),
+    path('metrics/', views.payment_client_metrics, name='metrics'),
 ]
@@ -1,13 +1,18 @@
-import json
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
 from apps.orders.models import Order
-from .services import NowPaymentsService
+from apps.orders.admission import admission_required, release_admission
+from .client import nowpayments_client
+from .inbox import record_notification
+from .services import InvoicePending, NowPaymentsService, parse_json
 
 from django.urls import reverse
 
+@admission_required
 def payment_process(request):
     order_id = request.session.get('order_id')
     order = get_object_or_404(Order, id=order_id)
@@ -18,64 +23,100 @@ def payment_process(request):
         # or we pass a default if needed.
         pass
     
-    # Initiative payment
+    if order.paid:
+        return redirect('orders:payment_success')
+    if order.status == 'cancelled':
+        return render(request, 'payments/error.html', {'error': 'This order has expired. Please check out again.'})
+
+    # Reuses the order's invoice while it is valid, so refreshes and
+    # double submits don't create (and wait for) new ones
     service = NowPaymentsService()
-    # Using 'usd' as base currency, assuming product prices are in USD
-    # You can change this based on project requirements
-    
     success_url = request.build_absolute_uri(reverse('orders:payment_success'))
     failed_url = request.build_absolute_uri(reverse('orders:payment_failed'))
-    
-    response = service.create_invoice(
-        order_id=order.id,
-        amount=order.get_total_cost(),
-        currency='usd',
-        description=f'Order {order.id}',
-        success_url=success_url,
-        cancel_url=failed_url
-    )
-    
-    if response and 'invoice_url' in response:
-        return redirect(response['invoice_url'])
+    try:
+        invoice_url = service.invoice_url_for(order, success_url=success_url, cancel_url=failed_url)
+    except InvoicePending:
+        return render(request, 'payments/error.html', {'error': 'Your payment is being prepared. Please try again in a moment.'})
+
+    # Checkout is done either way: let the next visitor in
+    release_admission(request)
+
+    if invoice_url:
+        return redirect(invoice_url)
     else:
         # Handle error
         return render(request, 'payments/error.html', {'error': 'Could not initiate payment.'})
 
+@admission_required
+async def payment_process_async(request):
+    """
+    payment_process for the ASGI stack: the ORM calls are async and the
+    invoice is created on the async client, so waiting on the provider
+    doesn't hold a worker thread.
+    """
+    order_id = await request.session.aget('order_id')
+    order = await Order.objects.filter(id=order_id).afirst() if order_id else None
+    if order is None:
+        raise Http404('No Order matches the given query.')
+
+    if order.paid:
+        return redirect('orders:payment_success')
+    if order.status == 'cancelled':
+        return await sync_to_async(render)(request, 'payments/error.html', {'error': 'This order has expired. Please check out again.'})
+
+    service = NowPaymentsService()
+    success_url = request.build_absolute_uri(reverse('orders:payment_success'))
+    failed_url = request.build_absolute_uri(reverse('orders:payment_failed'))
+    try:
+        invoice_url = await service.ainvoice_url_for(order, success_url=success_url, cancel_url=failed_url)
+    except InvoicePending:
+        return await sync_to_async(render)(request, 'payments/error.html', {'error': 'Your payment is being prepared. Please try again in a moment.'})
+
+    await sync_to_async(release_admission)(request)
+
+    if invoice_url:
+        return redirect(invoice_url)
+    return await sync_to_async(render)(request, 'payments/error.html', {'error': 'Could not initiate payment.'})
+
+
+def _content_length(request):
+    # As Django reads it: a missing or malformed header means no body
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
 @csrf_exempt
 def payment_webhook(request):
     if request.method == 'POST':
         service = NowPaymentsService()
         signature = request.headers.get('x-nowpayments-sig')
-        
+
+        # Turn away oversized bodies before reading or parsing them
+        if _content_length(request) > settings.NOWPAYMENTS_WEBHOOK_MAX_BYTES:
+            return HttpResponse('Payload Too Large', status=413)
         try:
-            data = json.loads(request.body)
-        except json.JSONDecodeError:
+            data = parse_json(request.body)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid JSON')
+        if not isinstance(data, dict):
             return HttpResponseBadRequest('Invalid JSON')
             
-        if service.check_signature(data, signature):
-            # Signature is valid
-            order_id = data.get('order_id')
-            payment_status = data.get('payment_status')
-            payment_id = data.get('payment_id') # or id from invoice
-            
-            try:
-                order = Order.objects.get(id=order_id)
-            except Order.DoesNotExist:
-                return HttpResponseBadRequest('Order not found')
-            
-            # Update order based on status
-            # statuses: waiting, confirming, confirmed, sending, partially_paid, finished, failed, refunded, expired
-            if payment_status == 'finished' or payment_status == 'confirmed':
-                order.paid = True
-                order.status = 'paid'
-                order.nowpayments_id = str(data.get('payment_id'))
-                order.save()
-            elif payment_status == 'failed' or payment_status == 'expired':
-                order.status = 'cancelled' # or failed
-                order.save()
-                
+        if service.check_signature(data, signature, body=request.body):
+            if not data.get('payment_id'):
+                return HttpResponseBadRequest('Missing payment_id')
+            # Acknowledge right away: the order is updated by the
+            # process_payment_notifications worker (see apps.payments.inbox)
+            record_notification(data)
             return HttpResponse('OK')
         else:
             return HttpResponseBadRequest('Invalid Signature')
             
     return HttpResponseBadRequest('Invalid Method')
+
+
+@staff_member_required
+def payment_client_metrics(request):
+    # Latency, retry and error counters of this process's NOWPayments client
+    return JsonResponse(nowpayments_client().stats())
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Custom Apps
     'apps.catalog',
@@ -158,8 +159,84 @@ if not DEBUG:
     SECURE_HSTS_PRELOAD = True
     X_FRAME_OPTIONS = 'DENY'
 
+# 'default' is per process: it only holds data keyed by a catalog version
+# (facets, product snapshots), so stale entries are never read. 'shared' must
+# be the same for every worker and management command: catalog versions,
+# cached carts and the checkout waiting room live there. It is a table in the
+# main database by default (created by the catalog migrations, or manage.py
+# createcachetable); use Redis or Memcached through SHARED_CACHE_BACKEND /
+# SHARED_CACHE_LOCATION.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': config('SHARED_CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('SHARED_CACHE_LOCATION', default='shared_cache'),
+    },
+}
+
 CART_SESSION_ID = 'cart'
 
+# Where carts live: apps.cart.storage.SessionCartStorage (default),
+# DatabaseCartStorage or CacheCartStorage (atomic per-line updates, expire after CART_TTL)
+CART_STORAGE = config('CART_STORAGE', default='apps.cart.storage.SessionCartStorage')
+CART_CACHE_ALIAS = config('CART_CACHE_ALIAS', default='shared')
+CART_TTL = config('CART_TTL', default=60 * 60 * 24 * 30, cast=int)
+
+# Currency of product prices, stored on each order and sent to the payment provider
+ORDER_CURRENCY = config('ORDER_CURRENCY', default='usd')
+
+# Checkout waiting room: at most CHECKOUT_ADMISSION_LIMIT visitors in checkout at
+# once (0 disables it), each for up to CHECKOUT_ADMISSION_LEASE seconds
+CHECKOUT_ADMISSION_LIMIT = config('CHECKOUT_ADMISSION_LIMIT', default=0, cast=int)
+CHECKOUT_ADMISSION_LEASE = config('CHECKOUT_ADMISSION_LEASE', default=60 * 10, cast=int)
+CHECKOUT_ADMISSION_STORE = config('CHECKOUT_ADMISSION_STORE', default='apps.orders.admission.CacheAdmissionStore')
+CHECKOUT_ADMISSION_CACHE_ALIAS = config('CHECKOUT_ADMISSION_CACHE_ALIAS', default='shared')
+CHECKOUT_QUEUE_POLL_INTERVAL = config('CHECKOUT_QUEUE_POLL_INTERVAL', default=3, cast=int)
+CHECKOUT_QUEUE_TIMEOUT = config('CHECKOUT_QUEUE_TIMEOUT', default=60, cast=int)
+
+# Seconds an unpaid order holds the stock it reserved (see release_expired_reservations)
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=60 * 30, cast=int)
+
+# Catalog versions (invalidating facets, fragments, ETags and cart snapshots)
+# are kept in this shared cache; each process rereads them at most every
+# CATALOG_VERSION_LOCAL_TTL seconds, so other workers' changes show up that fast
+CATALOG_VERSION_CACHE_ALIAS = config('CATALOG_VERSION_CACHE_ALIAS', default='shared')
+CATALOG_VERSION_LOCAL_TTL = config('CATALOG_VERSION_LOCAL_TTL', default=1, cast=float)
+
+# In-process NumPy catalog index for product_list filtering (requires numpy)
+CATALOG_INDEX_ENABLED = config('CATALOG_INDEX_ENABLED', default=False, cast=bool)
+CATALOG_INDEX_MAX_AGE = config('CATALOG_INDEX_MAX_AGE', default=60, cast=int)
+
+# Per-process LRU of rendered product grid fragments (HTMX filter toggles / load more)
+CATALOG_FRAGMENT_CACHE_ENTRIES = config('CATALOG_FRAGMENT_CACHE_ENTRIES', default=512, cast=int)
+CATALOG_FRAGMENT_CACHE_BYTES = config('CATALOG_FRAGMENT_CACHE_BYTES', default=16 * 1024 * 1024, cast=int)
+
+# Render catalog pages without the cart (loaded lazily over HTMX) and mark them
+# Cache-Control: public with Surrogate-Key headers for a shared cache / CDN
+CATALOG_PUBLIC_CACHE = config('CATALOG_PUBLIC_CACHE', default=False, cast=bool)
+CATALOG_PUBLIC_CACHE_MAX_AGE = config('CATALOG_PUBLIC_CACHE_MAX_AGE', default=60, cast=int)
+CATALOG_PUBLIC_CACHE_S_MAXAGE = config('CATALOG_PUBLIC_CACHE_S_MAXAGE', default=600, cast=int)
+
 # NOWPayments Settings
 NOWPAYMENTS_API_KEY = config('NOWPAYMENTS_API_KEY')
 NOWPAYMENTS_IPN_SECRET = config('NOWPAYMENTS_IPN_SECRET')
+NOWPAYMENTS_API_URL = config('NOWPAYMENTS_API_URL', default='https://api.nowpayments.io/v1')
+# payment_process reuses an order's invoice for this long (capped by its stock reservation)
+NOWPAYMENTS_INVOICE_TTL = config('NOWPAYMENTS_INVOICE_TTL', default=60 * 20, cast=int)
+# Per-process pooled client: (connect, read) timeouts, retries with jittered
+# exponential backoff, and a circuit breaker opening after N failed calls
+NOWPAYMENTS_CONNECT_TIMEOUT = config('NOWPAYMENTS_CONNECT_TIMEOUT', default=3.05, cast=float)
+NOWPAYMENTS_READ_TIMEOUT = config('NOWPAYMENTS_READ_TIMEOUT', default=10, cast=float)
+NOWPAYMENTS_MAX_RETRIES = config('NOWPAYMENTS_MAX_RETRIES', default=2, cast=int)
+NOWPAYMENTS_RETRY_BACKOFF = config('NOWPAYMENTS_RETRY_BACKOFF', default=0.25, cast=float)
+NOWPAYMENTS_POOL_SIZE = config('NOWPAYMENTS_POOL_SIZE', default=10, cast=int)
+# Served over ASGI, checkout can hand off to the async payment view (async
+# ORM, httpx client with NOWPAYMENTS_ASYNC_POOL_SIZE connections per worker)
+PAYMENTS_ASYNC = config('PAYMENTS_ASYNC', default=False, cast=bool)
+NOWPAYMENTS_ASYNC_POOL_SIZE = config('NOWPAYMENTS_ASYNC_POOL_SIZE', default=100, cast=int)
+NOWPAYMENTS_CIRCUIT_FAILURES = config('NOWPAYMENTS_CIRCUIT_FAILURES', default=5, cast=int)
+NOWPAYMENTS_CIRCUIT_RESET = config('NOWPAYMENTS_CIRCUIT_RESET', default=30, cast=int)
+# IPN callbacks are a few hundred bytes; larger webhook bodies get a 413 unread
+NOWPAYMENTS_WEBHOOK_MAX_BYTES = config('NOWPAYMENTS_WEBHOOK_MAX_BYTES', default=16 * 1024, cast=int)